@@ -40,4 +40,11 @@ nginx
 #    --bind 0.0.0.0:8000 \
 #    --workers 2 \
 #    --reload
+
+# Alternatively, run under ASGI so that the pod status endpoints are served
+# asynchronously (see labs.asgi):
+#gunicorn lawliet.asgi:application \
+#    --bind 0.0.0.0:8000 \
+#    --workers 2 \
+#    --worker-class uvicorn.workers.UvicornWorker
 python3 manage.py runserver
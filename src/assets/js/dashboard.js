@@ -17,6 +17,9 @@ const active_lab_management_template = `
     <p class="monospace waiting-text uk-text-center">
       Lab starting...
     </p>
+    <p class="expiry-text uk-text-center uk-text-meta">
+      [[ expiry_text ]]
+    </p>
     <ul class="uk-list uk-margin-top">
       <li>
         <button
@@ -35,6 +38,14 @@ const active_lab_management_template = `
           Delete lab
         </button>
       </li>
+      <li v-if="expires_at">
+        <button
+          type="button"
+          class="uk-button uk-button-default uk-width-1-1@m"
+          v-on:click="extend_lab(conn_name, card_id)">
+          Extend lab
+        </button>
+      </li>
     </ul>
   </div>
 </div>`;
@@ -51,8 +62,13 @@ const active_lab_dashboard_header = `
 
 Vue.component("lab-component", {
   delimiters: ["[[", "]]"],
-  props: ["lab_name", "conn_name", "b64_conn_id", "card_id"],
+  props: ["lab_name", "conn_name", "b64_conn_id", "card_id", "expires_at"],
   template: active_lab_management_template,
+  computed: {
+    expiry_text: function() {
+      return format_expiry(this.expires_at);
+    }
+  }
 });
 
 Vue.component("active-lab-header", {
@@ -63,38 +79,118 @@ Vue.component("active-lab-header", {
  * Helper functions
  */
 
-function watch_lab_status(conn_name) {
-  // Monitor the status of the lab and wait until it's ready to go
+function format_expiry(expires_at) {
+  // Describe when a lab's lease expires
+  if ( !expires_at ) {
+    return "";
+  }
+  return "Lab will be deleted at " + new Date(expires_at).toLocaleString();
+}
+
+// Animations showing that a lab is still starting, keyed by connection name
+const waiting_animations = {};
+
+function show_lab_starting(conn_name) {
+  // Animate the waiting text on a lab's card until the lab is ready
+
+  if ( conn_name in waiting_animations ) {
+    return;
+  }
 
   const el = document.getElementById("conn_" + conn_name);
   const waiting_text = el.getElementsByClassName("waiting-text")[0];
   const open_button = el.getElementsByClassName("open-button")[0];
+  open_button.disabled = true;
 
   let counter = 0;
-  const check_status = window.setInterval(function() {
+  waiting_animations[conn_name] = window.setInterval(function() {
     waiting_text.innerHTML = "Lab starting" + ".".repeat(counter);
     counter = (counter + 1) % 4;
+  }, 500);
+}
+
+function show_lab_ready(conn_name) {
+  // Stop the animation, remove the waiting text, and enable the button to
+  // open the lab.
+
+  const el = document.getElementById("conn_" + conn_name);
+  if ( el === null ) {
+    return;
+  }
+  window.clearInterval(waiting_animations[conn_name]);
+  delete waiting_animations[conn_name];
+
+  el.getElementsByClassName("waiting-text")[0].innerHTML = "Ready";
+  el.getElementsByClassName("open-button")[0].disabled = false;
+}
+
+function watch_all_labs(conns) {
+  // Subscribe to readiness updates for all of the user's labs over a single
+  // Server-Sent Events stream. The browser automatically reconnects when the
+  // server closes the stream.
 
-    // Check whether the lab is ready
-    axios.get("/labs/pod/status?id=" + conn_name)
+  conns.forEach(show_lab_starting);
+
+  const source = new EventSource("/labs/pod/events");
+  source.addEventListener("status", event => {
+    const data = JSON.parse(event.data);
+    if ( data.ready ) {
+      show_lab_ready(data.conn_name);
+    } else if ( document.getElementById("conn_" + data.conn_name) !== null ) {
+      show_lab_starting(data.conn_name);
+    }
+  });
+  source.addEventListener("error", event => {
+    console.log("Lost connection to lab status stream; reconnecting");
+  });
+}
+
+function is_ready(status) {
+  // A lab is ready once all of the conditions on its pod are true
+  const conditions = status.conditions || [];
+  return conditions.length > 0 && conditions.every(c => c.status === "True");
+}
+
+function poll_all_labs(conns) {
+  // Monitor the status of all of the user's labs with a single batch request
+  // per check, until they're all ready to go. This is used unless the server
+  // has Server-Sent Events turned on and the browser supports them.
+
+  // Default delay between status checks (in ms). The server tells us how long
+  // to wait through the Retry-After header, and we back off when requests fail.
+  const default_delay = 1500;
+  const max_delay = 30000;
+
+  conns.forEach(show_lab_starting);
+  let waiting = conns.slice();
+
+  function check_status(delay) {
+    const query = waiting.map(conn => "id=" + encodeURIComponent(conn)).join("&");
+    axios.get("/labs/pod/status/batch?" + query)
       .then(response => {
-        const conditions = response.data.conditions;
-        for ( let ii = 0; ii < conditions.length; ++ii ) {
-          if ( conditions[ii].status !== "True" ) {
-            return;
+        const statuses = response.data.statuses;
+        waiting = waiting.filter(conn => {
+          if ( conn in statuses && is_ready(statuses[conn]) ) {
+            show_lab_ready(conn);
+            return false;
           }
+          return true;
+        });
+
+        if ( waiting.length > 0 ) {
+          const retry_after = parseFloat(response.headers["retry-after"]);
+          const next_delay = isNaN(retry_after) ? default_delay : 1000 * retry_after;
+          window.setTimeout(check_status, next_delay, next_delay);
         }
-        // Ready. Remove the listener, the waiting text, and enable the
-        // button to open the lab.
-        waiting_text.innerHTML = "Ready";
-        open_button.disabled = false;
-        window.clearInterval(check_status);
       })
       .catch(error => {
-        console.log("Error get status of " + conn_name + ": " + error);
-        return false;
+        console.log("Error getting lab statuses: " + error);
+        const next_delay = Math.min(2 * delay, max_delay);
+        window.setTimeout(check_status, next_delay, next_delay);
       });
-  }, 1500);
+  }
+
+  check_status(default_delay);
 }
 
 function display_lab_manager() {
@@ -118,6 +214,9 @@ function display_lab_manager() {
         lab_component.setAttribute("card_id", "conn_" + fields.conn_name);
         lab_component.setAttribute("lab_name", fields.name);
         lab_component.setAttribute("conn_name", fields.conn_name);
+        if ( fields.expires_at ) {
+          lab_component.setAttribute("expires_at", fields.expires_at);
+        }
         // TODO: something less hacky than this?
         lab_component.setAttribute("b64_conn_id", btoa(fields.conn_id + "\u0000c\u0000mysql"));
         el.appendChild(lab_component);
@@ -127,9 +226,16 @@ function display_lab_manager() {
       new Vue({
         el: "#active_labs",
         mounted: function() {
-          conns.forEach(conn => {
-            watch_lab_status(conn);
-          });
+          if ( conns.length === 0 ) {
+            return;
+          }
+          // Streams are only used when the server has them turned on
+          const pod_events = el.dataset.podEvents === "true";
+          if ( pod_events && window.EventSource ) {
+            watch_all_labs(conns);
+          } else {
+            poll_all_labs(conns);
+          }
         }
       });
 
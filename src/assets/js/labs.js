@@ -9,20 +9,89 @@ axios.defaults.xsrfHeaderName = "X-CSRFTOKEN";
  * Function definitions
  */
 
+// Idempotency keys for the requests made from this page. A key is reused for
+// every repeat of the same request (e.g. when a button is double-clicked), so
+// that the server only acts on the request once.
+const idempotency_keys = {};
+
+function random_key() {
+  if ( window.crypto && window.crypto.randomUUID ) {
+    return window.crypto.randomUUID();
+  }
+  return Date.now().toString(16) + "-" + Math.random().toString(16).slice(2);
+}
+
+function idempotency_key(action) {
+  if ( !(action in idempotency_keys) ) {
+    idempotency_keys[action] = random_key();
+  }
+  return {"Idempotency-Key": idempotency_keys[action]};
+}
+
+function post_once(url, action) {
+  /* Send a POST request with the idempotency key for an action. While an
+     earlier copy of the request is still being handled, the server answers
+     with a 409; we then wait and send it again with the same key, until we get
+     the earlier request's response. */
+  const max_delay = 8000;
+
+  function send(delay) {
+    return axios.post(url, null, {headers: idempotency_key(action)})
+      .catch(function (error) {
+        if ( !error.response || error.response.status !== 409 ) {
+          throw error;
+        }
+        const retry_after = parseFloat(error.response.headers["retry-after"]);
+        const wait = isNaN(retry_after) ? delay : Math.max(1000 * retry_after, delay);
+        return new Promise(resolve => window.setTimeout(resolve, wait))
+          .then(() => send(Math.min(2 * delay, max_delay)));
+      });
+  }
+
+  return send(1000);
+}
+
 function generate_lab(lab_id) {
   /* Start a new lab with the given environment ID. */
   console.log("Generating lab with id " + lab_id);
 
   const url = "/labs/generate?create=" + lab_id;
-  axios.post(url)
+  post_once(url, "generate:" + lab_id)
     .then(function (response) {
-      // Success
+      // If the cluster is full, the request is queued rather than started
+      if ( response.data.state === "waiting" ) {
+        let message = "The lab cluster is full. You are number " +
+          response.data.position + " in line";
+        if ( response.data.eta ) {
+          message += "; your lab should start around " +
+            new Date(response.data.eta).toLocaleTimeString();
+        }
+        create_notification(message, {status: "warning", timeout: 10000});
+        // Clicking again should check on the queue rather than replaying this
+        // response
+        delete idempotency_keys["generate:" + lab_id];
+        return;
+      }
+      window.location.reload();
     })
     .catch(function (error) {
       // Error
       console.log(error);
+      if ( error.response && error.response.status === 429 ) {
+        create_notification(error.response.data.err, {status: "danger"});
+        delete idempotency_keys["generate:" + lab_id];
+        return;
+      }
+      // The lab server is down; the same key can be used to try again
+      if ( error.response && error.response.status === 503 ) {
+        create_notification(
+          error.response.data.err + ". Please try again in a few moments.",
+          {status: "warning"}
+        );
+        return;
+      }
+      window.location.reload();
     });
-  window.location.reload();
 }
 
 function delete_lab(conn_name) {
@@ -30,16 +99,38 @@ function delete_lab(conn_name) {
   console.log("Deleting lab");
 
   const url = "/labs/delete?id=" + encodeURIComponent(conn_name);
-  axios.post(url)
+  post_once(url, "delete:" + conn_name)
     .then(function (response) {
       console.log("Successfully deleted lab");
       console.log(response);
+      window.location.reload();
     })
     .catch(function (error) {
       console.log("Error deleting lab");
       console.log(error);
+      window.location.reload();
+    });
+}
+
+function extend_lab(conn_name, card_id) {
+  /* Extend the lease on a running lab so that it isn't deleted as soon */
+  console.log("Extending lab " + conn_name);
+
+  const url = "/labs/lease/extend?id=" + encodeURIComponent(conn_name);
+  axios.post(url)
+    .then(function (response) {
+      const el = document.getElementById(card_id);
+      el.getElementsByClassName("expiry-text")[0].innerHTML =
+        format_expiry(response.data.expires_at);
+      create_notification("Your lab has been extended", {status: "success"});
+    })
+    .catch(function (error) {
+      console.log("Error extending lab");
+      console.log(error);
+      if ( error.response && error.response.status === 409 ) {
+        create_notification("This lab can't be extended any further", {status: "warning"});
+      }
     });
-  window.location.reload();
 }
 
 function create_notification(message) {
@@ -14,6 +14,7 @@ from django.urls import reverse
 from dashboard.forms.settings import PasswordChangeForm
 from labs.forms import LabUploadForm
 from labs.models import LabEnvironment
+from labs.prepull import start_prepull, warming_labs
 
 TEMPLATES = "dashboard"
 
@@ -43,7 +44,12 @@ class DashboardView(LoginRequiredMixin, View):
     def get(self, request):
         template = os.path.join(TEMPLATES, "dashboard.html")
         environments = LabEnvironment.objects.all().order_by("category")
-        return render(request, template, context={"environments": environments})
+        context = {
+            "environments": environments,
+            "warming": warming_labs(),
+            "pod_events": settings.LAB_POD_EVENTS,
+        }
+        return render(request, template, context=context)
 
     def post(self, request):
         template = os.path.join(TEMPLATES, "dashboard.html")
@@ -114,6 +120,7 @@ def upload_lab(request):
 
     if request.POST and lab_form.is_valid():
         lab = LabEnvironment.objects.create(**lab_form.cleaned_data)
+        start_prepull(lab, pin=True)
         context["success"] = True
         context["uploaded_id"] = lab.id
 
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("guacamole", "0002_auto_20200429_2052"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="guacamoleconnection",
+            name="date_created",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("guacamole", "0003_connection_date_created"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="guacamoleconnection",
+            name="node_pool",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("guacamole", "0004_connection_node_pool"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="guacamoleconnection",
+            name="hub_backend",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("guacamole", "0005_connection_hub_backend"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="guacamoleconnection",
+            name="primary",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="members",
+                to="guacamole.GuacamoleConnection",
+            ),
+        ),
+    ]
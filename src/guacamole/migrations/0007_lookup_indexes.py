@@ -0,0 +1,34 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:23
+
+from django.db import migrations, models
+import guacamole.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("guacamole", "0006_connection_primary"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="guacamoleconnection",
+            name="connection_name",
+            field=models.CharField(
+                default=guacamole.models.gen_connection_name,
+                max_length=128,
+                unique=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="guacamoleconnectionhistory",
+            name="connection_name",
+            field=models.CharField(db_index=True, max_length=128),
+        ),
+        migrations.AddIndex(
+            model_name="guacamoleuserhistory",
+            index=models.Index(
+                fields=["user", "start_date"], name="guac_user_hist_start_idx"
+            ),
+        ),
+    ]
@@ -20,7 +20,11 @@ def gen_connection_name():
 
 class GuacamoleConnection(models.Model):
     connection_id = models.AutoField(primary_key=True)
-    connection_name = models.CharField(max_length=128, default=gen_connection_name)
+    # Connection names are also the names of the labs' pods, so they have to
+    # be unique across every connection group, not just within one.
+    connection_name = models.CharField(
+        max_length=128, default=gen_connection_name, unique=True
+    )
     parent = models.ForeignKey(
         "GuacamoleConnectionGroup", models.CASCADE, blank=True, null=True
     )
@@ -36,6 +40,16 @@ class GuacamoleConnection(models.Model):
     # Additional custom fields, provided outside of Guacamole
     lab = models.ForeignKey("labs.LabEnvironment", on_delete=models.CASCADE,)
     user = models.ForeignKey("users.User", on_delete=models.CASCADE,)
+    date_created = models.DateTimeField(default=timezone.now)
+    node_pool = models.CharField(max_length=64, blank=True, default="")
+    hub_backend = models.CharField(max_length=64, blank=True, default="")
+
+    # For the connections to the other machines in a multi-machine lab (see
+    # labs.topology), the connection for the lab itself. Lab connections
+    # don't have a primary connection.
+    primary = models.ForeignKey(
+        "self", models.CASCADE, blank=True, null=True, related_name="members"
+    )
 
     class Meta:
         managed = True
@@ -99,7 +113,8 @@ class GuacamoleConnectionHistory(models.Model):
     connection = models.ForeignKey(
         GuacamoleConnection, models.CASCADE, blank=True, null=True
     )
-    connection_name = models.CharField(max_length=128)
+    # Used to look up the sessions for labs by name (see labs.lifecycle)
+    connection_name = models.CharField(max_length=128, db_index=True)
     sharing_profile = models.ForeignKey(
         "GuacamoleSharingProfile", models.CASCADE, blank=True, null=True
     )
@@ -294,6 +309,12 @@ class GuacamoleUserHistory(models.Model):
     class Meta:
         managed = True
         db_table = "guacamole_user_history"
+        indexes = [
+            # Used by Guacamole to list each user's most recent logins
+            models.Index(
+                fields=["user", "start_date"], name="guac_user_hist_start_idx"
+            ),
+        ]
 
 
 class GuacamoleUserPasswordHistory(models.Model):
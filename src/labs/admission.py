@@ -0,0 +1,269 @@
+"""
+Admission control for starting labs.
+
+Starting a lab when the cluster doesn't have room for it leaves a Pending pod
+that slows down everything else, so each request to start a lab is first
+checked against the cluster's capacity (LAB_CLUSTER_CPU and
+LAB_CLUSTER_MEMORY) and the user's quota (LAB_MAX_LABS_PER_USER).
+
+Requests that don't fit are given an AdmissionTicket and wait in a fair-share
+queue: users with fewer active labs go first, and ties are broken by the time
+at which they joined the queue. Waiting tickets are admitted by
+admit_waiting(), which is run periodically by the process_admission_queue
+management command.
+
+Capacity is checked without locking, so concurrent requests can briefly
+overshoot it by a few pods.
+"""
+
+import logging
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils import timezone
+from guacamole.models import GuacamoleConnection
+from labs.jobs import start_lab
+from labs.models import AdmissionTicket, LabEnvironment, LabLease, WarmPod
+from labs.topology import member_usage
+
+logger = logging.getLogger("labs")
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when a user asks to start more labs than they're allowed to run.
+    """
+
+
+"""
+---------------------------------------------------
+Capacity
+---------------------------------------------------
+"""
+
+
+def cluster_usage():
+    """
+    Return the total CPU (in millicores) and memory (in mebibytes) requested by
+    all of the pods that are running, including the pods in the warm pools
+    and the member pods of multi-machine labs.
+    """
+    # Labs are counted by their own connections, and the pods for their
+    # services by the connections to their members
+    usage = [
+        queryset.aggregate(
+            cpu=Sum("lab__cpu_request"), memory=Sum("lab__memory_request")
+        )
+        for queryset in (
+            GuacamoleConnection.objects.filter(primary=None),
+            WarmPod.objects.all(),
+        )
+    ]
+    members = member_usage()
+    return (
+        sum(u["cpu"] or 0 for u in usage) + sum(cpu for (_, cpu, _) in members),
+        sum(u["memory"] or 0 for u in usage) + sum(mem for (_, _, mem) in members),
+    )
+
+
+def cluster_limited():
+    """
+    Return whether or not a limit has been set on the cluster's capacity.
+    Without one, labs never have to wait to be admitted.
+    """
+    return settings.LAB_CLUSTER_CPU > 0 or settings.LAB_CLUSTER_MEMORY > 0
+
+
+def fits(lab: LabEnvironment, usage):
+    """
+    Return whether or not the pods for another lab fit in the cluster, given
+    the cluster's current usage.
+    """
+    cpu, memory = usage
+    cpu_request, memory_request = lab.footprint()
+    if settings.LAB_CLUSTER_CPU > 0 and cpu + cpu_request > settings.LAB_CLUSTER_CPU:
+        return False
+    if (
+        settings.LAB_CLUSTER_MEMORY > 0
+        and memory + memory_request > settings.LAB_CLUSTER_MEMORY
+    ):
+        return False
+    return True
+
+
+def check_quota(user):
+    """
+    Raise QuotaExceeded if a user is already running (or waiting for) as many
+    labs as they're allowed to.
+    """
+    limit = settings.LAB_MAX_LABS_PER_USER
+    if limit <= 0:
+        return
+
+    waiting = AdmissionTicket.objects.filter(
+        user=user, state=AdmissionTicket.WAITING
+    ).count()
+    if user.n_active_labs + waiting >= limit:
+        raise QuotaExceeded(f"You can only run {limit} labs at a time")
+
+
+"""
+---------------------------------------------------
+Queueing
+---------------------------------------------------
+"""
+
+
+def request_admission(lab: LabEnvironment, user, usage=None):
+    """
+    Decide whether a user can start a lab right away.
+
+    Keyword parameters
+    ----------
+    usage ((int, int)) (default = None)
+        The CPU and memory in use in the cluster, if they're already known
+        (e.g. because several labs are being admitted at once). Defaults to
+        cluster_usage().
+
+    Returns
+    ----------
+    AdmissionTicket or None
+        None if the lab can be started immediately; otherwise, the ticket
+        holding the user's place in the queue.
+    """
+    # A user who asks for the same lab again keeps their place in the queue
+    ticket = AdmissionTicket.objects.filter(
+        lab=lab, user=user, state=AdmissionTicket.WAITING
+    ).first()
+    if ticket is not None:
+        return ticket
+
+    check_quota(user)
+    if not cluster_limited():
+        return None
+
+    # New requests never jump ahead of requests that are already waiting
+    queue_empty = not AdmissionTicket.objects.filter(
+        state=AdmissionTicket.WAITING
+    ).exists()
+    if queue_empty and fits(lab, cluster_usage() if usage is None else usage):
+        return None
+
+    ticket = AdmissionTicket.objects.create(lab=lab, user=user)
+    logger.info(f"Cluster is full; queued {user.username!r} for lab {lab.name!r}")
+    return ticket
+
+
+def waiting_tickets():
+    """
+    Return the waiting tickets in the order in which they'll be admitted.
+    """
+    return AdmissionTicket.objects.filter(state=AdmissionTicket.WAITING).order_by(
+        "user__n_active_labs", "date_created"
+    )
+
+
+def queue_position(ticket: AdmissionTicket):
+    """
+    Return the (1-indexed) position of a waiting ticket in the queue.
+    """
+    n_active = ticket.user.n_active_labs
+    ahead = AdmissionTicket.objects.filter(state=AdmissionTicket.WAITING).filter(
+        Q(user__n_active_labs__lt=n_active)
+        | Q(user__n_active_labs=n_active, date_created__lt=ticket.date_created)
+    )
+    return ahead.count() + 1
+
+
+def estimate_admission(position, now=None):
+    """
+    Estimate when the ticket at a given position in the queue will be admitted,
+    assuming that each lab that is deleted frees up room for one more. Labs
+    are assumed to run until their leases expire.
+
+    Returns
+    ----------
+    datetime or None
+        The estimated admission time, or None if there aren't enough leases to
+        make an estimate.
+    """
+    now = now or timezone.now()
+    return (
+        LabLease.objects.filter(expires_at__gt=now)
+        .order_by("expires_at")
+        .values_list("expires_at", flat=True)[position - 1 : position]
+        .first()
+    )
+
+
+def ticket_status(ticket: AdmissionTicket):
+    """
+    Return a dictionary describing the state of a ticket, suitable for
+    returning to the user.
+    """
+    status = {"ticket_id": ticket.id, "state": ticket.state}
+    if ticket.state == AdmissionTicket.WAITING:
+        position = queue_position(ticket)
+        eta = estimate_admission(position)
+        status.update(
+            position=position, eta=None if eta is None else eta.isoformat(),
+        )
+    elif ticket.job is not None:
+        status.update(job_id=ticket.job_id, conn_name=ticket.job.connection_name)
+    return status
+
+
+"""
+---------------------------------------------------
+Admitting tickets
+---------------------------------------------------
+"""
+
+
+def admit_waiting():
+    """
+    Start labs for waiting tickets, in fair-share order, until the next ticket
+    in the queue no longer fits in the cluster.
+
+    Returns
+    ----------
+    list of AdmissionTicket
+        The tickets that were admitted.
+    """
+    admitted = []
+    while True:
+        # The order of the queue changes as users' labs are started, so we
+        # look up the head of the queue again after every admission.
+        ticket = waiting_tickets().select_related("lab", "user").first()
+        if ticket is None:
+            break
+
+        try:
+            check_quota_for_admission(ticket)
+        except QuotaExceeded as ex:
+            logger.info(f"Dropping ticket {ticket.id}: {ex}")
+            ticket.delete()
+            continue
+
+        if not fits(ticket.lab, cluster_usage()):
+            break
+
+        _, job, _ = start_lab(ticket.lab, ticket.user, requested_at=ticket.date_created)
+        ticket.state = AdmissionTicket.ADMITTED
+        ticket.job = job
+        ticket.date_admitted = timezone.now()
+        ticket.save(update_fields=["state", "job", "date_admitted"])
+        logger.info(f"Admitted ticket {ticket.id} for lab {ticket.lab.name!r}")
+        admitted.append(ticket)
+
+    return admitted
+
+
+def check_quota_for_admission(ticket: AdmissionTicket):
+    """
+    Raise QuotaExceeded if admitting a ticket would put its user over their
+    quota (e.g. because they started other labs while they were waiting).
+    """
+    limit = settings.LAB_MAX_LABS_PER_USER
+    if limit > 0 and ticket.user.n_active_labs >= limit:
+        raise QuotaExceeded(f"{ticket.user.username} is already running {limit} labs")
@@ -0,0 +1,518 @@
+"""
+Native asynchronous handling of the pod status endpoints under ASGI.
+
+Dashboards poll the status of every lab, and each of those requests spends
+almost all of its time waiting on the hub. Under WSGI every one of them holds
+a worker thread while it waits. When Lawliet is deployed under ASGI (see
+lawliet.asgi), PodStatusApp serves GET requests to the pod status endpoints
+itself: requests to the hub are made with a non-blocking client (built on
+httpx), and only the (short) database and cache lookups are run in a
+thread pool. A single process can then keep thousands of status requests in
+flight.
+
+Every other request is passed on to Django. Django 3.0 has no async views or
+async ORM, so those views run in threads as they would under WSGI. Starting a
+lab doesn't wait on the hub (pods are created by the provisioning queue), but
+deleting one still blocks its thread while the hub deletes each of the lab's
+pods, so deletions are bounded by the size of that thread pool rather than by
+the event loop.
+
+Requests are parsed into Django's own ASGIRequest, and are checked against
+ALLOWED_HOSTS and authenticated by the same session and authentication
+middleware as every other request. The responses are the same as those of
+PodStatusView and PodStatusBatchView, including the fallback to the last known
+status while the hub is failing.
+"""
+
+import asyncio
+import httpx
+import io
+import logging
+import math
+import requests
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.urls import reverse
+from guacamole.models import GuacamoleConnection
+from labs.hub import (
+    HubUnavailable,
+    get_backend,
+    get_client,
+    hub_retry_after,
+    is_hub_failure,
+)
+from labs.status import (
+    batch_poll_interval,
+    cache_key,
+    combine_lab_statuses,
+    is_ready,
+    local_pod_statuses,
+    observe_statuses,
+    poll_interval,
+    stale_statuses,
+    store_pod_status,
+)
+from labs.topology import pods_from_rows
+
+logger = logging.getLogger("labs")
+
+"""
+---------------------------------------------------
+Async hub client
+---------------------------------------------------
+"""
+
+
+class AsyncHubClient:
+    """
+    A non-blocking client for the hub's pod status API, built on an
+    httpx.AsyncClient that keeps a pool of keep-alive connections to the hub.
+    It shares its host, timeouts, circuit breaker, and latency statistics with
+    a HubClient.
+
+    Clients must only be used from the event loop that they were created in;
+    see get_async_client().
+
+    Parameters
+    ----------
+    client (HubClient)
+        The client for the hub that requests should be sent to.
+    pool_size (int)
+        Maximum number of connections to open to the hub at once.
+    """
+
+    def __init__(self, client, pool_size):
+        self.client = client
+        connect_timeout, read_timeout = client.timeout
+        # Requests wait for as long as they need to for a free connection, as
+        # they do with HubClient
+        self.session = httpx.AsyncClient(
+            base_url=client.host,
+            headers={"Accept": "application/json"},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None),
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+        )
+
+    async def request(self, method, path):
+        """
+        Send a request to the hub, and return a requests.Response. Errors are
+        raised as the same exceptions that HubClient raises.
+        """
+        endpoint = f"{method} {self.client._pod_path.sub('/pods/<name>', path)}"
+        breaker = self.client.breaker
+        if breaker is not None and not breaker.allow_request():
+            self.client._record(endpoint, 0.0, True)
+            raise HubUnavailable(f"Hub {self.client.host} is unavailable")
+
+        start = time.monotonic()
+        error = True
+        failed = True
+        try:
+            try:
+                reply = await self.session.request(method, path)
+            except httpx.TimeoutException as ex:
+                raise requests.Timeout(f"Hub request {method} {path} timed out") from ex
+            except httpx.TransportError as ex:
+                raise requests.ConnectionError(f"Hub request {method} {path}: {ex}")
+
+            # Errors are raised in the same way as by HubClient
+            failed = reply.status_code >= 500
+            response = requests.Response()
+            response.status_code = reply.status_code
+            response.url = f"{self.client.host}{path}"
+            response._content = reply.content
+            response.raise_for_status()
+            error = False
+            return response
+        finally:
+            elapsed = time.monotonic() - start
+            self.client._record(endpoint, elapsed, error)
+            if breaker is not None:
+                breaker.record(failed)
+
+    async def get_pod(self, name):
+        return (await self.request("GET", f"/pods/{name}")).json()
+
+    async def close(self):
+        await self.session.aclose()
+
+
+# Clients for each backend, for every running event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+async def close_async_clients():
+    """
+    Close the connections held open by the clients for the current event
+    loop. This should be awaited before the loop is closed.
+    """
+    for client in _async_clients.pop(asyncio.get_running_loop(), {}).values():
+        await client.close()
+
+
+def get_async_client(backend=None):
+    """
+    Return the AsyncHubClient for a backend in the current event loop,
+    creating it if necessary.
+    """
+    name = get_backend(backend).name
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = AsyncHubClient(
+            get_client(name), pool_size=settings.HUB_API_ASYNC_POOL_SIZE
+        )
+    return clients[name]
+
+
+class AsyncSingleFlight:
+    """
+    Coalesce concurrent coroutines that share the same key, so that only one
+    of them does any work; see labs.status.SingleFlight.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func):
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.ensure_future(func())
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+
+"""
+---------------------------------------------------
+Pod status application
+---------------------------------------------------
+"""
+
+
+def cached_statuses(names):
+    """
+    Return the statuses of whichever of a group of pods are cached (or all of
+    them, if pod states are kept in the PodState table).
+    """
+    if settings.LAB_POD_STATE_WATCH:
+        return local_pod_statuses(names)
+    keys = {cache_key(name): name for name in names}
+    return {keys[key]: status for (key, status) in cache.get_many(keys).items()}
+
+
+class PodStatusApp:
+    """
+    ASGI application that serves the pod status endpoints natively, and passes
+    every other request on to another ASGI application (normally Django).
+
+    Parameters
+    ----------
+    app
+        The ASGI application that handles every other request.
+
+    Keyword parameters
+    ----------
+    thread_sensitive (bool) (default = False)
+        Whether database queries should be run in the thread that called into
+        the event loop (through async_to_sync), rather than in a thread pool.
+        This is only useful in tests, where the queries need to be run in the
+        test's transaction.
+    """
+
+    def __init__(self, app, thread_sensitive=False):
+        self.app = app
+        self.thread_sensitive = thread_sensitive
+        self.flight = AsyncSingleFlight()
+        self._routes = None
+
+    @property
+    def routes(self):
+        # Resolved lazily, since the URLconf may not be loaded yet when the
+        # application is created.
+        if self._routes is None:
+            self._routes = {
+                reverse("lab_api.pod.pod_status"): self.pod_status,
+                reverse("lab_api.pod.pod_status_batch"): self.pod_status_batch,
+            }
+        return self._routes
+
+    async def __call__(self, scope, receive, send):
+        handler = None
+        if scope["type"] == "http" and scope["method"] == "GET":
+            handler = self.routes.get(scope["path"])
+        if handler is None:
+            return await self.app(scope, receive, send)
+
+        request = ASGIRequest(scope, io.BytesIO())
+        try:
+            request.get_host()
+        except DisallowedHost:
+            return await self.send_json(send, 400, {"err": "Invalid host"})
+
+        try:
+            await handler(send, request)
+        except Exception as ex:
+            logger.exception(f"Error handling {scope['path']}: {ex}")
+            await self.send_json(send, 500, {"err": "Internal server error"})
+
+    """
+    Helpers
+    """
+
+    async def run_sync(self, func, *args):
+        """
+        Run a function that uses the database or the cache without blocking
+        the event loop.
+        """
+
+        def call():
+            close_old_connections()
+            try:
+                return func(*args)
+            finally:
+                close_old_connections()
+
+        return await sync_to_async(call, thread_sensitive=self.thread_sensitive)()
+
+    async def send_response(self, send, response):
+        """
+        Send a (non-streaming) HttpResponse, as Django's ASGI handler would
+        (but with the lowercase header names that ASGI servers expect).
+        """
+        headers = [
+            (name.lower().encode("ascii"), str(value).encode("latin-1"))
+            for (name, value) in response.items()
+        ]
+        for cookie in response.cookies.values():
+            headers.append(
+                (b"set-cookie", cookie.output(header="").encode("ascii").strip())
+            )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": headers,
+            }
+        )
+        await send({"type": "http.response.body", "body": response.content})
+
+    async def send_json(self, send, status, data, headers=None):
+        response = JsonResponse(data, status=status)
+        for (name, value) in (headers or {}).items():
+            response[name] = value
+        await self.send_response(send, response)
+
+    async def send_login_redirect(self, send, request):
+        # The same response as LoginRequiredMixin
+        await self.send_response(send, redirect_to_login(request.get_full_path()))
+
+    async def send_unavailable(self, send):
+        await self.send_json(
+            send,
+            503,
+            {"err": "The lab server is temporarily unavailable"},
+            {"Retry-After": max(math.ceil(hub_retry_after()), 1)},
+        )
+
+    def authenticate(self, request):
+        """
+        Return the user that sent a request, using the same middleware as
+        every other request to Django. This must be run outside of the event
+        loop, since it may look up the session and the user.
+        """
+        SessionMiddleware().process_request(request)
+        AuthenticationMiddleware().process_request(request)
+        # The user is loaded lazily, so it's loaded here rather than in the
+        # event loop
+        request.user.is_authenticated
+        return request.user
+
+    async def fetch(self, name, backend):
+        """
+        Retrieve the status of a pod from the hub and store it in the cache.
+        """
+        status = await get_async_client(backend).get_pod(name)
+        return await self.run_sync(store_pod_status, name, status)
+
+    async def fetch_labs(self, pods, backends, cached):
+        """
+        Retrieve the statuses of a group of labs, fetching the statuses of all
+        of their pods that aren't cached from the hub concurrently, and
+        combining the statuses of multi-machine labs.
+
+        Returns
+        ----------
+        (dict, dict, set)
+            The statuses of the labs, the exceptions raised for the labs whose
+            statuses couldn't be retrieved, and the labs with at least one pod
+            whose status was retrieved from the hub.
+        """
+        missing = {
+            name: backends[conn_name]
+            for (conn_name, names) in pods.items()
+            for name in names
+            if name not in cached
+        }
+        fetched, errors = await self.fetch_many(missing)
+        statuses, lab_errors = combine_lab_statuses(
+            pods, dict(cached, **fetched), errors
+        )
+        fresh = {
+            conn_name
+            for (conn_name, names) in pods.items()
+            if any(name in fetched for name in names)
+        }
+        return statuses, lab_errors, fresh
+
+    async def fetch_many(self, backends):
+        """
+        Retrieve the statuses of a group of pods from the hub concurrently,
+        falling back to their last known statuses if the hub fails.
+
+        Returns
+        ----------
+        (dict, dict)
+            The statuses that were retrieved, and the exceptions raised for
+            the pods whose statuses couldn't be.
+        """
+        names = list(backends)
+        results = await asyncio.gather(
+            *(
+                self.flight.do(name, lambda name=name: self.fetch(name, backends[name]))
+                for name in names
+            ),
+            return_exceptions=True,
+        )
+
+        statuses, errors = {}, {}
+        for (name, result) in zip(names, results):
+            if isinstance(result, Exception):
+                errors[name] = result
+            else:
+                statuses[name] = result
+
+        failed = [name for (name, ex) in errors.items() if is_hub_failure(ex)]
+        if failed:
+            statuses.update(await self.run_sync(stale_statuses, failed))
+        errors = {name: ex for (name, ex) in errors.items() if name not in statuses}
+        return statuses, errors
+
+    """
+    Endpoints
+    """
+
+    async def pod_status(self, send, request):
+        conn_name = request.GET.get("id")
+
+        def lookup():
+            user = self.authenticate(request)
+            if not user.is_authenticated or conn_name is None:
+                return user, None, {}, {}
+            rows = list(
+                GuacamoleConnection.objects.filter(
+                    connection_name=conn_name, primary=None
+                ).values_list("user_id", "hub_backend", "members__connection_name")
+            )
+            if not rows or rows[0][0] != user.id:
+                return user, rows[:1], {}, {}
+            pods = pods_from_rows((conn_name, member) for (_, _, member) in rows)
+            return user, rows[:1], pods, cached_statuses(pods[conn_name])
+
+        user, rows, pods, cached = await self.run_sync(lookup)
+        if not user.is_authenticated:
+            return await self.send_login_redirect(send, request)
+        if conn_name is None:
+            return await self.send_json(
+                send, 422, {"err": "Connection name not provided"}
+            )
+        if not rows:
+            return await self.send_json(
+                send, 422, {"err": f"Connection {conn_name} does not exist"}
+            )
+        owner, backend, _ = rows[0]
+        if owner != user.id:
+            return await self.send_json(
+                send, 403, {"err": f"Cannot delete {conn_name}: permission denied"}
+            )
+
+        statuses, errors, fresh = await self.fetch_labs(
+            pods, {conn_name: backend}, cached
+        )
+        if conn_name in errors:
+            ex = errors[conn_name]
+            logger.error(f"Unable to get status of {conn_name}: {ex}")
+            if not is_hub_failure(ex):
+                return await self.send_json(
+                    send, 502, {"err": f"Unable to get status of {conn_name}"}
+                )
+            return await self.send_unavailable(send)
+        status = statuses[conn_name]
+
+        if is_ready(status) and not status.get("stale"):
+            await self.run_sync(observe_statuses, {conn_name: status})
+        await self.send_json(
+            send, 200, status, {"Retry-After": math.ceil(poll_interval(status))}
+        )
+
+    async def pod_status_batch(self, send, request):
+        conn_names = request.GET.getlist("id")
+
+        def lookup():
+            user = self.authenticate(request)
+            if not user.is_authenticated:
+                return user, {}, {}, {}
+            owned = GuacamoleConnection.objects.filter(user=user, primary=None)
+            if conn_names:
+                owned = owned.filter(connection_name__in=conn_names)
+            rows = list(
+                owned.values_list(
+                    "connection_name", "hub_backend", "members__connection_name"
+                )
+            )
+            backends = {name: backend for (name, backend, _) in rows}
+            pods = pods_from_rows((name, member) for (name, _, member) in rows)
+            names = [name for names in pods.values() for name in names]
+            return user, backends, pods, cached_statuses(names)
+
+        user, backends, pods, cached = await self.run_sync(lookup)
+        if not user.is_authenticated:
+            return await self.send_login_redirect(send, request)
+        names = conn_names or list(backends)
+
+        statuses, errors, fresh = await self.fetch_labs(pods, backends, cached)
+        for (name, ex) in errors.items():
+            logger.error(f"Unable to get status of {name}: {ex}")
+
+        ready = {n: s for (n, s) in statuses.items() if n in fresh and is_ready(s)}
+        if ready:
+            await self.run_sync(observe_statuses, ready)
+
+        results = {}
+        for name in names:
+            if name in statuses:
+                results[name] = statuses[name]
+            elif name in errors:
+                results[name] = {"error": "Unable to get pod status"}
+            else:
+                results[name] = {
+                    "error": f"Connection {name} does not exist or permission denied"
+                }
+
+        await self.send_json(
+            send,
+            200,
+            {"statuses": results},
+            {"Retry-After": math.ceil(batch_poll_interval(statuses, errors))},
+        )
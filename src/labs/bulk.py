@@ -0,0 +1,274 @@
+"""
+Bulk provisioning of labs for an entire class roster.
+
+Rather than having every student click "Start", an instructor can create the
+same lab for a list of users in one go. All of the Guacamole rows for the
+class are created in a single transaction with bulk_create, after which the
+pod creation requests are sent to the hub in parallel.
+
+Every user goes through admission control (see labs.admission) as they would
+when starting the lab themselves: users who are over their quota are skipped,
+and users whose labs don't fit in the cluster join the admission queue. Labs
+whose pods can't be created are released, just like labs whose provisioning
+jobs fail.
+"""
+
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from guacamole.models import (
+    GuacamoleConnection,
+    GuacamoleConnectionParameter,
+    GuacamoleConnectionPermission,
+    GuacamoleEntity,
+)
+from labs.hub import HubUnavailable, get_client, hub_retry_after, run_concurrently
+from labs.leases import new_lease
+from labs.lifecycle import record_pod_created, record_requested
+from labs.models import LabEnvironment, LabLease, ProvisioningJob
+from labs.placement import (
+    backend_loads,
+    choose_hub_backend,
+    choose_node_pool,
+    pool_usage,
+)
+from users.models import User
+
+logger = logging.getLogger("labs")
+
+"""
+---------------------------------------------------
+Helper functions
+---------------------------------------------------
+"""
+
+
+def connection_rows(conn: GuacamoleConnection, lab: LabEnvironment, entity_id):
+    """
+    Return the (unsaved) GuacamoleConnectionParameters and
+    GuacamoleConnectionPermission that need to exist for a user to be able to
+    connect to a lab through Guacamole.
+    """
+    params = [
+        GuacamoleConnectionParameter(
+            connection=conn,
+            parameter_name="hostname",
+            parameter_value=conn.connection_name,
+        ),
+        GuacamoleConnectionParameter(
+            connection=conn, parameter_name="port", parameter_value=lab.port,
+        ),
+    ]
+    perm = GuacamoleConnectionPermission(
+        entity_id=entity_id, connection=conn, permission="READ",
+    )
+    return params, perm
+
+
+"""
+---------------------------------------------------
+Bulk provisioning
+---------------------------------------------------
+"""
+
+
+def provision_labs(lab: LabEnvironment, users, max_workers=None):
+    """
+    Create a lab for every user in a list of users.
+
+    Parameters
+    ----------
+    lab (LabEnvironment)
+        The lab environment to create for each user.
+    users (iterable of User)
+        The users to create the lab for.
+
+    Keyword parameters
+    ----------
+    max_workers (int) (default = None)
+        The maximum number of pod creation requests to send to the hub at
+        once. Defaults to LAB_BULK_CONCURRENCY.
+
+    Returns
+    ----------
+    list of dict
+        A report with one entry per user, giving the result of creating the
+        lab for that user.
+
+    Raises
+    ----------
+    HubUnavailable
+        If every hub backend is unavailable, in which case no labs are
+        created.
+    """
+    # Imported here, since labs.jobs (and through it labs.admission) depends
+    # on this module
+    from labs.admission import (
+        QuotaExceeded,
+        cluster_limited,
+        cluster_usage,
+        request_admission,
+    )
+    from labs.jobs import release_lab
+
+    # Fail fast while every hub is down, rather than creating labs whose pods
+    # can't be created
+    if hub_retry_after() > 0:
+        raise HubUnavailable("Every hub backend is unavailable")
+
+    max_workers = max_workers or settings.LAB_BULK_CONCURRENCY
+    users = list(users)
+    report = {user.username: {"username": user.username} for user in users}
+
+    # Every user needs a GuacamoleEntity in order to be given permission to
+    # connect to their lab.
+    entities = dict(
+        GuacamoleEntity.objects.filter(
+            type="USER", name__in=[user.username for user in users]
+        ).values_list("name", "entity_id")
+    )
+    for user in users:
+        if user.username not in entities:
+            report[user.username].update(
+                status="failed", error="User does not have a Guacamole entity"
+            )
+    users = [user for user in users if user.username in entities]
+
+    # Admit the labs one at a time, counting the capacity used by the labs
+    # that have already been admitted
+    footprint = lab.footprint()
+    cluster = cluster_usage() if cluster_limited() else None
+    admitted = []
+    for user in users:
+        try:
+            ticket = request_admission(lab, user, usage=cluster)
+        except QuotaExceeded as ex:
+            report[user.username].update(status="failed", error=str(ex))
+            continue
+        if ticket is not None:
+            report[user.username].update(status="queued", ticket_id=ticket.id)
+            continue
+        if cluster is not None:
+            cluster = (cluster[0] + footprint[0], cluster[1] + footprint[1])
+        admitted.append(user)
+    users = admitted
+
+    with transaction.atomic():
+        # Assign every lab to a hub backend and a node pool, keeping track of
+        # the capacity used by the labs that have already been placed.
+        usage = pool_usage()
+        loads = backend_loads()
+        conns = []
+        for user in users:
+            conn = GuacamoleConnection(protocol=lab.protocol, lab=lab, user=user)
+            conn.hub_backend = choose_hub_backend(loads)
+            loads[conn.hub_backend] += 1
+            conn.node_pool = choose_node_pool(lab, usage, footprint)
+            if conn.node_pool:
+                cpu, memory = usage.get(conn.node_pool, (0, 0))
+                usage[conn.node_pool] = (cpu + footprint[0], memory + footprint[1])
+            conns.append(conn)
+        GuacamoleConnection.objects.bulk_create(conns)
+
+        # Not every database backend sets primary keys on the objects passed to
+        # bulk_create, so we look up the new connections by name.
+        names = [conn.connection_name for conn in conns]
+        conn_ids = dict(
+            GuacamoleConnection.objects.filter(connection_name__in=names).values_list(
+                "connection_name", "connection_id"
+            )
+        )
+
+        params, perms, jobs, leases = [], [], [], []
+        for (user, conn) in zip(users, conns):
+            conn.connection_id = conn_ids[conn.connection_name]
+            conn_params, perm = connection_rows(conn, lab, entities[user.username])
+            params.extend(conn_params)
+            perms.append(perm)
+            leases.append(new_lease(conn))
+            jobs.append(
+                ProvisioningJob(
+                    connection=conn,
+                    connection_name=conn.connection_name,
+                    lab=lab,
+                    user=user,
+                    state=ProvisioningJob.RUNNING,
+                    attempts=1,
+                )
+            )
+
+        GuacamoleConnectionParameter.objects.bulk_create(params)
+        GuacamoleConnectionPermission.objects.bulk_create(perms)
+        ProvisioningJob.objects.bulk_create(jobs)
+        LabLease.objects.bulk_create(leases)
+        record_requested(conns)
+        User.objects.filter(id__in=[user.id for user in users]).update(
+            n_active_labs=F("n_active_labs") + 1
+        )
+
+    logger.info(f"Creating {len(names)} pods for lab {lab.name!r}")
+    placements = {conn.connection_name: conn for conn in conns}
+    results = run_concurrently(
+        lambda name: get_client(placements[name].hub_backend).create_pod(
+            name,
+            image=lab.pod_image(),
+            ports=[lab.port],
+            resources=lab.resources(),
+            node_pool=placements[name].node_pool,
+        ),
+        names,
+        max_workers,
+    )
+
+    succeeded = [name for (name, ex) in results.items() if ex is None]
+    ProvisioningJob.objects.filter(connection_name__in=succeeded).update(
+        state=ProvisioningJob.SUCCEEDED
+    )
+    record_pod_created(succeeded)
+
+    # Labs whose pods couldn't be created are released, so that their users
+    # aren't left with labs that will never start
+    failed = {name: ex for (name, ex) in results.items() if ex is not None}
+    for job in ProvisioningJob.objects.filter(
+        connection_name__in=failed
+    ).select_related("connection"):
+        job.state = ProvisioningJob.FAILED
+        job.error = str(failed[job.connection_name])[:1000]
+        job.save(update_fields=["state", "error", "date_updated"])
+        release_lab(job)
+
+    for (user, conn) in zip(users, conns):
+        ex = results[conn.connection_name]
+        report[user.username].update(
+            status="created" if ex is None else "failed",
+            conn_name=conn.connection_name,
+        )
+        if ex is not None:
+            report[user.username]["error"] = str(ex)
+
+    return list(report.values())
+
+
+def provision_roster(lab: LabEnvironment, usernames=None, group=None, max_workers=None):
+    """
+    Create a lab for a class roster, given either as a list of usernames or as
+    the name of a group of users. Usernames that don't correspond to a user are
+    reported as failures.
+    """
+    if usernames is not None:
+        users = User.objects.filter(username__in=usernames)
+    elif group is not None:
+        users = User.objects.filter(groups__name=group)
+    else:
+        raise ValueError("Either usernames or group must be specified")
+
+    report = provision_labs(lab, users, max_workers=max_workers)
+
+    missing = set(usernames or []) - {result["username"] for result in report}
+    report += [
+        {"username": name, "status": "failed", "error": "User does not exist"}
+        for name in sorted(missing)
+    ]
+    return report
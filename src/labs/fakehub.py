@@ -0,0 +1,386 @@
+"""
+A fake Lawliet Hub API server, for load and integration testing.
+
+The fake hub implements the parts of the hub's API that Lawliet uses (pods,
+pod listing and watching, and image pulls) on top of an in-memory table of
+pods, without running anything. Its latency, failure rate, and the time that
+pods take to become ready can all be configured, so that benchmarks and CI
+can drive realistic provisioning storms without a cluster.
+
+The fake hub can be run on its own with the run_fake_hub management command,
+or started inside of the current process by setting HUB_API_FAKE=yes, in
+which case get_client() (and therefore every HubAPIView) talks to it instead
+of HUB_API_HOST.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger("labs")
+
+# Number of pod events that are kept around for watches to resume from
+EVENT_HISTORY = 1000
+
+"""
+---------------------------------------------------
+Pod table
+---------------------------------------------------
+"""
+
+
+class FakeHub:
+    """
+    In-memory state of the fake hub.
+
+    Keyword parameters
+    ----------
+    latency (float) (default = 0)
+        Time (in seconds) taken to respond to every request. Each response is
+        delayed by a random amount between half and one and a half times this.
+    failure_rate (float) (default = 0)
+        Fraction of pod creation and deletion requests that fail with a 500
+        error.
+    ready_delay (float) (default = 0)
+        Time (in seconds) after a pod is created before it becomes ready.
+    nodes (list of str) (default = None)
+        Names of the nodes that images are pulled onto.
+    seed (int) (default = None)
+        Seed for the random number generator, for reproducible runs.
+    """
+
+    def __init__(self, latency=0, failure_rate=0, ready_delay=0, nodes=None, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.ready_delay = ready_delay
+        self.nodes = nodes or ["fake-node-0"]
+        self.random = random.Random(seed)
+
+        self.pods = {}
+        self.images = set()
+        self.events = []
+        self.resource_version = 0
+        self.changed = threading.Condition()
+        self.closed = False
+
+    """
+    Fault injection
+    """
+
+    def delay(self):
+        if self.latency > 0:
+            time.sleep(self.latency * self.random.uniform(0.5, 1.5))
+
+    def should_fail(self):
+        return self.random.random() < self.failure_rate
+
+    """
+    Pods
+    """
+
+    def pod_status(self, pod):
+        ready = time.monotonic() >= pod["ready_at"]
+        return {
+            "name": pod["name"],
+            "phase": "Running" if ready else "Pending",
+            "conditions": [{"type": "Ready", "status": "True" if ready else "False"}],
+            "resourceVersion": str(pod["resourceVersion"]),
+        }
+
+    def _emit(self, kind, pod):
+        # Must be called with self.changed held
+        self.resource_version += 1
+        pod["resourceVersion"] = self.resource_version
+        self.events.append((self.resource_version, kind, self.pod_status(pod)))
+        del self.events[:-EVENT_HISTORY]
+        self.changed.notify_all()
+
+    def create_pod(self, name, spec):
+        """
+        Create a pod, returning False if a pod with the same name already
+        exists. The pod becomes ready after ready_delay seconds.
+        """
+        with self.changed:
+            if name in self.pods:
+                return False
+            pod = {
+                "name": name,
+                "spec": spec,
+                "ready_at": time.monotonic() + self.ready_delay,
+            }
+            self.pods[name] = pod
+            self._emit("ADDED", pod)
+
+        timer = threading.Timer(self.ready_delay, self._mark_ready, args=(name,))
+        timer.daemon = True
+        timer.start()
+        return True
+
+    def _mark_ready(self, name):
+        with self.changed:
+            pod = self.pods.get(name)
+            if pod is not None:
+                self._emit("MODIFIED", pod)
+
+    def get_pod(self, name):
+        with self.changed:
+            pod = self.pods.get(name)
+            return None if pod is None else self.pod_status(pod)
+
+    def delete_pod(self, name):
+        with self.changed:
+            pod = self.pods.pop(name, None)
+            if pod is None:
+                return False
+            self._emit("DELETED", pod)
+            return True
+
+    def list_pods(self, limit=None, after=None):
+        """
+        List the pods in order of their names, starting after the given name.
+        If limit is given, at most that many pods are returned, along with the
+        name to continue from (or None if there are no more pods).
+        """
+        with self.changed:
+            names = sorted(name for name in self.pods if after is None or name > after)
+            next_name = None
+            if limit is not None and len(names) > limit:
+                names = names[:limit]
+                next_name = names[-1]
+            return (
+                [self.pod_status(self.pods[name]) for name in names],
+                str(self.resource_version),
+                next_name,
+            )
+
+    def events_since(self, resource_version, timeout):
+        """
+        Wait up to timeout seconds for events after the given resource version.
+        Returns None if the resource version is too old to resume from.
+        """
+        with self.changed:
+            if self.events and resource_version < self.events[0][0] - 1:
+                return None
+            if self.resource_version <= resource_version:
+                self.changed.wait(timeout)
+            return [event for event in self.events if event[0] > resource_version]
+
+    def close(self):
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    """
+    Images
+    """
+
+    def pull_image(self, image):
+        self.images.add(image)
+        return {node: "Ready" for node in self.nodes}
+
+    def image_pulls(self, image):
+        state = "Ready" if image in self.images else "Pulling"
+        return {node: state for node in self.nodes}
+
+
+"""
+---------------------------------------------------
+HTTP server
+---------------------------------------------------
+"""
+
+
+class FakeHubHandler(BaseHTTPRequestHandler):
+    """
+    Serves the hub API for the FakeHub in self.server.hub.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"Fake hub: {format % args}")
+
+    @property
+    def hub(self):
+        return self.server.hub
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def route(self):
+        url = urlsplit(self.path)
+        return url.path.rstrip("/").split("/")[1:], parse_qs(url.query)
+
+    def do_PUT(self):
+        parts, _ = self.route()
+        # The body is always read, so that the connection can be reused
+        spec = self.read_json()
+        self.hub.delay()
+        if len(parts) != 2 or parts[0] != "pods":
+            return self.send_json(404, {"message": "Not found"})
+        if self.hub.should_fail():
+            return self.send_json(500, {"message": "Injected failure"})
+
+        if not self.hub.create_pod(parts[1], spec):
+            return self.send_json(409, {"message": f"Pod {parts[1]} already exists"})
+        self.send_json(201, self.hub.get_pod(parts[1]))
+
+    def do_GET(self):
+        parts, query = self.route()
+        if parts == ["pods", "watch"]:
+            return self.watch(query)
+
+        self.hub.delay()
+        if parts == ["pods"]:
+            # Pages are requested in the same way as from the Kubernetes API
+            limit = int(query["limit"][0]) if "limit" in query else None
+            after = query.get("continue", [None])[0]
+            items, resource_version, next_name = self.hub.list_pods(limit, after)
+            data = {"items": items, "resourceVersion": resource_version}
+            if next_name is not None:
+                data["continue"] = next_name
+            return self.send_json(200, data)
+        if len(parts) == 2 and parts[0] == "pods":
+            status = self.hub.get_pod(parts[1])
+            if status is None:
+                return self.send_json(404, {"message": f"Pod {parts[1]} not found"})
+            return self.send_json(200, status)
+        if parts == ["images", "pulls"]:
+            image = query.get("image", [""])[0]
+            return self.send_json(200, {"nodes": self.hub.image_pulls(image)})
+        self.send_json(404, {"message": "Not found"})
+
+    def do_DELETE(self):
+        parts, _ = self.route()
+        self.hub.delay()
+        if len(parts) != 2 or parts[0] != "pods":
+            return self.send_json(404, {"message": "Not found"})
+        if self.hub.should_fail():
+            return self.send_json(500, {"message": "Injected failure"})
+        if not self.hub.delete_pod(parts[1]):
+            return self.send_json(404, {"message": f"Pod {parts[1]} not found"})
+        self.send_json(200, {})
+
+    def do_POST(self):
+        parts, _ = self.route()
+        body = self.read_json()
+        self.hub.delay()
+        if parts != ["images", "pulls"]:
+            return self.send_json(404, {"message": "Not found"})
+        image = body.get("image", "")
+        self.send_json(200, {"nodes": self.hub.pull_image(image)})
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def watch(self, query):
+        """
+        Stream pod events, one JSON object per line, until timeoutSeconds have
+        passed or the server is shut down. Every batch of events is sent as its
+        own chunk, so that clients see events as soon as they happen.
+        """
+        resource_version = int(query.get("resourceVersion", ["0"])[0] or 0)
+        deadline = time.monotonic() + float(query.get("timeoutSeconds", ["60"])[0])
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            while not self.hub.closed and time.monotonic() < deadline:
+                events = self.hub.events_since(resource_version, timeout=1)
+                if events is None:
+                    error = {"type": "ERROR", "object": {"message": "Too old"}}
+                    self.write_chunk(json.dumps(error).encode("utf-8") + b"\n")
+                    break
+
+                lines = [b"\n"] if not events else []
+                for (resource_version, kind, pod) in events:
+                    event = {"type": kind, "object": pod}
+                    lines.append(json.dumps(event).encode("utf-8") + b"\n")
+                self.write_chunk(b"".join(lines))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class FakeHubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, hub):
+        super().__init__(address, FakeHubHandler)
+        self.hub = hub
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def shutdown(self):
+        self.hub.close()
+        super().shutdown()
+
+
+"""
+---------------------------------------------------
+Running the fake hub
+---------------------------------------------------
+"""
+
+
+def start_fake_hub(host="127.0.0.1", port=0, **options):
+    """
+    Start a fake hub in a background thread. Any keyword parameters other than
+    host and port are passed to FakeHub. By default, the server listens on a
+    random free port; its address is available as server.url.
+
+    Returns
+    ----------
+    FakeHubServer
+        The running server. Call server.shutdown() to stop it.
+    """
+    server = FakeHubServer((host, port), FakeHub(**options))
+    thread = threading.Thread(target=server.serve_forever, name="fake-hub", daemon=True)
+    thread.start()
+    logger.info(f"Started fake hub at {server.url}")
+    return server
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_fake_hub():
+    """
+    Return the fake hub for the current process (used when HUB_API_FAKE is
+    enabled), starting it if necessary.
+    """
+    global _server
+
+    with _server_lock:
+        if _server is None:
+            _server = start_fake_hub(
+                latency=settings.HUB_FAKE_LATENCY,
+                failure_rate=settings.HUB_FAKE_FAILURE_RATE,
+                ready_delay=settings.HUB_FAKE_READY_DELAY,
+            )
+
+    return _server
@@ -3,11 +3,16 @@ Forms for handling labs (creation, deletion, etc.)
 """
 
 from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
 from django.utils.translation import gettext as _
 
 from lawliet.widgets import URLTextInput
-from labs.models import LabEnvironment
+from labs.lifecycle import latency_report
+from labs.models import LabEnvironment, LabService
+from labs.prepull import start_prepull
 
 """
 ---------------------------------------------------
@@ -22,12 +27,28 @@ class LabUploadForm(forms.ModelForm):
     to Lawliet.
     """
 
+    # Resource fields, which fall back to the model's defaults if they're left
+    # empty.
+    resource_fields = ("cpu_request", "cpu_limit", "memory_request", "memory_limit")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        for field in self.resource_fields:
+            self.fields[field].required = False
 
     class Meta:
         model = LabEnvironment
-        fields = ["name", "description", "url", "protocol", "category"]
+        fields = [
+            "name",
+            "description",
+            "url",
+            "protocol",
+            "category",
+            "cpu_request",
+            "cpu_limit",
+            "memory_request",
+            "memory_limit",
+        ]
         widgets = {
             "name": forms.TextInput(
                 attrs={
@@ -59,10 +80,25 @@ class LabUploadForm(forms.ModelForm):
                     (protocol.lower(), protocol) for protocol in ("SSH", "VNC", "RDP")
                 ]
             ),
+            **{
+                field: forms.NumberInput(
+                    attrs={"class": "uk-input uk-form-width-small"}
+                )
+                for field in (
+                    "cpu_request",
+                    "cpu_limit",
+                    "memory_request",
+                    "memory_limit",
+                )
+            },
         }
 
         labels = {
             "url": "Docker image",
+            "cpu_request": "CPU request (millicores)",
+            "cpu_limit": "CPU limit (millicores)",
+            "memory_request": "Memory request (MiB)",
+            "memory_limit": "Memory limit (MiB)",
         }
 
         help_texts = {
@@ -71,6 +107,11 @@ class LabUploadForm(forms.ModelForm):
                 "to the container."
             ),
             "url": "What Docker image should be run by this lab?",
+            "cpu_request": (
+                "How much CPU each instance of the lab needs. 1000 millicores "
+                "is one CPU core."
+            ),
+            "memory_request": "How much memory each instance of the lab needs.",
         }
 
     def clean(self):
@@ -91,9 +132,135 @@ class LabUploadForm(forms.ModelForm):
                 )
                 self.add_error("protocol", error)
 
+        # Fill in default resources, and make sure that no request is larger
+        # than its limit.
+        for field in self.resource_fields:
+            if cleaned_data.get(field) is None:
+                cleaned_data[field] = LabEnvironment._meta.get_field(field).default
+        for resource in ("cpu", "memory"):
+            if cleaned_data[f"{resource}_limit"] < cleaned_data[f"{resource}_request"]:
+                error = forms.ValidationError(
+                    _("The limit must be at least as large as the request."),
+                    code="bad_limit",
+                )
+                self.add_error(f"{resource}_limit", error)
+
         print(f"CLEANED_DATA: {cleaned_data}")
         return cleaned_data
 
 
+class LabServiceInline(admin.TabularInline):
+    """
+    The other machines in a multi-machine lab (see labs.topology).
+    """
+
+    model = LabService
+    extra = 0
+    fields = (
+        "name",
+        "url",
+        "protocol",
+        "port",
+        "cpu_request",
+        "memory_request",
+        "cpu_limit",
+        "memory_limit",
+    )
+
+
 class LabEnvironmentAdmin(admin.ModelAdmin):
     form = LabUploadForm
+    inlines = [LabServiceInline]
+    readonly_fields = ("image_digest", "date_digest_resolved", "startup_latency")
+    fieldsets = (
+        (None, {"fields": LabUploadForm.Meta.fields}),
+        (
+            "Image digest",
+            {
+                "fields": ("image_digest", "date_digest_resolved"),
+                "description": (
+                    "Pods are created from the digest that the lab's image "
+                    'pointed to when it was last resolved. Use the "Refresh '
+                    'image digests" action to pick up a new version of the image.'
+                ),
+            },
+        ),
+        (
+            "Warm pool",
+            {
+                "fields": ("warm_pool_size", "warm_pool_off_hours_size"),
+                "description": (
+                    "Number of idle pods to keep running for this lab during "
+                    "and outside of class hours."
+                ),
+            },
+        ),
+        (
+            "Idle labs",
+            {
+                "fields": ("idle_timeout",),
+                "description": (
+                    "Minutes without a connection after which a user's lab is "
+                    "deleted. Leave blank to use the site default, or set to 0 "
+                    "to never delete idle labs."
+                ),
+            },
+        ),
+        (
+            "Startup latency",
+            {
+                "fields": ("startup_latency",),
+                "description": (
+                    "Time (in seconds) taken for this lab's pods to be created "
+                    "and become ready, and for users to first connect to them, "
+                    f"over the last {settings.LAB_METRICS_WINDOW:g} days."
+                ),
+            },
+        ),
+    )
+
+    actions = ["prepull_images", "refresh_digests"]
+
+    def startup_latency(self, obj):
+        if obj.pk is None:
+            return "-"
+        report = latency_report(labs=[obj]).get(obj.name)
+        if report is None:
+            return "No labs have been started recently"
+
+        rows = []
+        for (stage, stats) in report.items():
+            if stats["count"] == 0:
+                continue
+            rows.append(
+                f"{stage.replace('_', ' ')}: p50 {stats['p50']:.1f}, "
+                f"p95 {stats['p95']:.1f}, p99 {stats['p99']:.1f} "
+                f"({stats['count']} labs)"
+            )
+        return format_html_join(mark_safe("<br>"), "{}", ((row,) for row in rows))
+
+    def save_model(self, request, obj, form, change):
+        # The old digest doesn't belong to a new image
+        if "url" in form.changed_data:
+            obj.image_digest = ""
+        super().save_model(request, obj, form, change)
+
+        # Pin the lab to its image's digest, and pull the image onto every node
+        # ahead of time, whenever a lab is added or its image is changed. Both
+        # are done in the background.
+        if not change or "url" in form.changed_data:
+            start_prepull(obj, pin=True)
+
+    def prepull_images(self, request, queryset):
+        for lab in queryset:
+            start_prepull(lab)
+        self.message_user(request, f"Started pre-pulling {len(queryset)} images.")
+
+    prepull_images.short_description = "Pre-pull images onto every node"
+
+    def refresh_digests(self, request, queryset):
+        for lab in queryset:
+            start_prepull(lab, pin=True)
+        self.message_user(request, f"Started refreshing {len(queryset)} digests.")
+
+    refresh_digests.short_description = "Refresh image digests"
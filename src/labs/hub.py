@@ -0,0 +1,611 @@
+"""
+Client for the Lawliet Hub API server, which creates, inspects, and deletes
+the pods that run lab environments.
+
+Labs can be spread across several hubs (one per cluster), which are
+configured as backends with HUB_API_BACKENDS. Every process shares a single
+HubClient per backend (see get_client()), which keeps a pool of persistent
+connections to its hub so that we don't have to open a new TCP connection for
+every request. The backend that each lab was created on is stored on its
+GuacamoleConnection, so that later requests for the lab go to the same hub.
+"""
+
+import logging
+import os
+import random
+import re
+import requests
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("labs")
+
+"""
+---------------------------------------------------
+Latency statistics
+---------------------------------------------------
+"""
+
+
+class EndpointStats:
+    """
+    Running latency statistics for a single hub endpoint.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "max_ms": 1000 * self.max,
+        }
+
+
+"""
+---------------------------------------------------
+Circuit breaker
+---------------------------------------------------
+"""
+
+
+class HubUnavailable(requests.ConnectionError):
+    """
+    Raised instead of sending a request to a hub whose circuit breaker is
+    open.
+    """
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker guarding the requests sent to a single hub.
+
+    Every request that the hub fails to answer (because it couldn't be
+    reached, it timed out, or it returned a 5xx status) counts as a failure.
+    Once failure_threshold requests in a row have failed, the breaker opens
+    and requests fail immediately with HubUnavailable instead of waiting on
+    the hub. After retry_interval seconds the breaker is half-open: a single
+    probe request is let through, and the breaker closes again if it succeeds
+    or re-opens if it fails.
+
+    Parameters
+    ----------
+    failure_threshold (int)
+        Number of consecutive failures after which the breaker opens.
+    retry_interval (float)
+        Time (in seconds) that the breaker stays open before probing the hub.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold, retry_interval):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.retry_interval = retry_interval
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.retry_interval:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    @property
+    def healthy(self):
+        """
+        Whether or not requests can currently be sent to the hub.
+        """
+        return self.state != self.OPEN
+
+    def retry_after(self):
+        """
+        Return the number of seconds until the breaker lets a probe through.
+        """
+        if self.opened_at is None:
+            return 0.0
+        return max(self.opened_at + self.retry_interval - time.monotonic(), 0.0)
+
+    def allow_request(self):
+        """
+        Return whether or not a request should be sent to the hub. While the
+        breaker is half-open, only one request at a time is allowed through.
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.OPEN or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, failed):
+        """
+        Record the outcome of a request that was allowed through.
+        """
+        with self._lock:
+            self.probing = False
+            if not failed:
+                if self.opened_at is not None:
+                    logger.info("Hub circuit breaker closed")
+                self.failures = 0
+                self.opened_at = None
+                return
+
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(
+                        f"Hub circuit breaker opened after {self.failures} failures"
+                    )
+                self.opened_at = time.monotonic()
+
+    def as_dict(self):
+        return {
+            "healthy": self.healthy,
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": self.retry_after(),
+        }
+
+
+"""
+---------------------------------------------------
+HubClient
+---------------------------------------------------
+"""
+
+
+class HubClient:
+    """
+    A pooled, keep-alive HTTP client for the Lawliet Hub API.
+
+    Parameters
+    ----------
+    host (str)
+        Base URL of the hub, e.g. "http://lawliet-k8s-api-server".
+    connect_timeout (float)
+        Maximum time (in seconds) to wait when opening a connection.
+    read_timeout (float)
+        Maximum time (in seconds) to wait for the hub to respond.
+    pool_size (int)
+        Maximum number of connections to keep open to the hub.
+
+    Keyword parameters
+    ----------
+    breaker (CircuitBreaker) (default = None)
+        Circuit breaker that guards every request to the hub.
+    """
+
+    # Regular expression used to group requests for individual pods under a
+    # single endpoint when recording latencies.
+    _pod_path = re.compile(r"^/pods/(?!watch$)[^/]+")
+
+    def __init__(self, host, connect_timeout, read_timeout, pool_size, breaker=None):
+        self.host = host.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request to the hub and record how long it took. Raises
+        requests.RequestException if the request fails or if the hub returns
+        an error status code, and HubUnavailable (without sending anything)
+        if the hub's circuit breaker is open.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = f"{method} {self._pod_path.sub('/pods/<name>', path)}"
+
+        if self.breaker is not None and not self.breaker.allow_request():
+            self._record(endpoint, 0.0, True)
+            raise HubUnavailable(f"Hub {self.host} is unavailable")
+
+        start = time.monotonic()
+        error = True
+        # Client errors (e.g. a 404 for a pod that doesn't exist) mean that
+        # the hub is working, so they don't trip the circuit breaker.
+        failed = True
+        try:
+            response = self.session.request(method, f"{self.host}{path}", **kwargs)
+            failed = response.status_code >= 500
+            response.raise_for_status()
+            error = False
+            return response
+        finally:
+            elapsed = time.monotonic() - start
+            self._record(endpoint, elapsed, error)
+            if self.breaker is not None:
+                self.breaker.record(failed)
+            logger.debug(f"Hub request {method} {path} took {1000 * elapsed:.1f}ms")
+
+    def _record(self, endpoint, elapsed, error):
+        with self._stats_lock:
+            self._stats.setdefault(endpoint, EndpointStats()).record(elapsed, error)
+
+    def latency_report(self):
+        """
+        Return a dictionary mapping every endpoint that has been called to its
+        latency statistics.
+        """
+        with self._stats_lock:
+            return {endpoint: s.as_dict() for (endpoint, s) in self._stats.items()}
+
+    """
+    Pod API
+    """
+
+    def create_pod(self, name, image, ports, resources=None, node_pool=None):
+        spec = {"image": image, "ports": ports}
+        if resources is not None:
+            spec["resources"] = resources
+        if node_pool:
+            spec["nodePool"] = node_pool
+        return self.request("PUT", f"/pods/{name}", json=spec)
+
+    def get_pod(self, name):
+        return self.request("GET", f"/pods/{name}").json()
+
+    def delete_pod(self, name):
+        return self.request("DELETE", f"/pods/{name}")
+
+    """
+    Image API
+    """
+
+    def pull_image(self, image):
+        """
+        Ask the hub to start pulling an image onto every node, and return a
+        dictionary mapping each node to the state of its pull.
+        """
+        return self.request("POST", "/images/pulls", json={"image": image}).json()[
+            "nodes"
+        ]
+
+    def get_image_pulls(self, image):
+        """
+        Return a dictionary mapping each node to the state of its pull of an
+        image ("Pulling", "Ready", or "Failed").
+        """
+        return self.request("GET", "/images/pulls", params={"image": image}).json()[
+            "nodes"
+        ]
+
+    """
+    Pod watch API
+    """
+
+    def list_pods(self):
+        """
+        Return a list of all of the pods running on the hub, and the resource
+        version at which the list was taken.
+        """
+        data = self.request("GET", "/pods").json()
+        return data.get("items", []), data.get("resourceVersion")
+
+    def iter_pods(self, page_size=500):
+        """
+        Yield every pod running on the hub, listing them page_size pods at a
+        time so that no single response has to hold all of them.
+        """
+        params = {"limit": page_size}
+        while True:
+            data = self.request("GET", "/pods", params=params).json()
+            yield from data.get("items", [])
+            if not data.get("continue"):
+                return
+            params["continue"] = data["continue"]
+
+    def watch_pods(self, resource_version=None):
+        """
+        Open a stream of pod events, starting after the given resource version,
+        and return an iterator over its lines. Each line is a JSON-encoded
+        event. The stream is held open indefinitely, so there's no read
+        timeout.
+        """
+        params = (
+            {} if resource_version is None else {"resourceVersion": resource_version}
+        )
+        response = self.request(
+            "GET",
+            "/pods/watch",
+            params=params,
+            stream=True,
+            timeout=(self.timeout[0], None),
+        )
+        return response.iter_lines(decode_unicode=True)
+
+
+"""
+---------------------------------------------------
+Backends
+---------------------------------------------------
+"""
+
+# Name of the backend that is used when HUB_API_BACKENDS isn't set
+DEFAULT_BACKEND = "default"
+
+
+class HubBackend:
+    """
+    A hub that labs can be created on.
+
+    Parameters
+    ----------
+    name (str)
+        Name of the backend, which is stored on the GuacamoleConnection of
+        every lab created on it.
+    url (str)
+        Base URL of the backend's hub.
+
+    Keyword parameters
+    ----------
+    weight (float) (default = 1)
+        Relative share of new labs that are sent to the backend. Backends with
+        a weight of zero don't receive any new labs unless every other backend
+        is unavailable (e.g. while they're being drained).
+    capacity (int) (default = 0)
+        Maximum number of labs that should run on the backend, or zero if
+        there's no limit.
+    """
+
+    def __init__(self, name, url, weight=1, capacity=0):
+        self.name = name
+        self.url = url
+        self.weight = max(float(weight), 0.0)
+        self.capacity = max(int(capacity or 0), 0)
+        self.breaker = CircuitBreaker(
+            settings.HUB_BACKEND_FAILURE_THRESHOLD, settings.HUB_BACKEND_RETRY_INTERVAL
+        )
+
+    @property
+    def healthy(self):
+        return self.breaker.healthy
+
+    def has_room(self, n_labs):
+        return self.capacity == 0 or n_labs < self.capacity
+
+    def as_dict(self):
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "capacity": self.capacity,
+            **self.breaker.as_dict(),
+        }
+
+
+def configured_backends():
+    """
+    Create a HubBackend for every backend in HUB_API_BACKENDS, or a single
+    backend for HUB_API_HOST if none are configured.
+    """
+    backends = [
+        HubBackend(
+            b["name"], b["url"], weight=b.get("weight", 1), capacity=b.get("capacity")
+        )
+        for b in settings.HUB_API_BACKENDS
+    ]
+    return backends or [HubBackend(DEFAULT_BACKEND, settings.HUB_API_HOST)]
+
+
+def choose_backend(backends, loads, rng=random):
+    """
+    Choose the backend that a new lab should be created on.
+
+    Backends are chosen at random, in proportion to their weight scaled by
+    the fraction of their capacity that is still free, from among the healthy
+    backends that have room for another lab. If there aren't any, we fall back
+    to the backends with room (whether or not they're healthy), and then to
+    every backend; admission control, rather than the backend capacities, is
+    what ultimately limits the number of labs.
+
+    Parameters
+    ----------
+    backends (list of HubBackend)
+        The backends to choose between.
+    loads (dict)
+        A dictionary mapping backend names to the number of labs running on
+        them.
+
+    Keyword parameters
+    ----------
+    rng (random.Random) (default = random)
+        Random number generator used to make the choice.
+
+    Returns
+    ----------
+    HubBackend
+    """
+    if len(backends) == 1:
+        return backends[0]
+
+    with_room = [b for b in backends if b.has_room(loads.get(b.name, 0))]
+    candidates = [b for b in with_room if b.healthy] or with_room or backends
+
+    weights = []
+    for backend in candidates:
+        weight = backend.weight
+        if backend.capacity:
+            free = backend.capacity - loads.get(backend.name, 0)
+            weight *= max(free, 0) / backend.capacity
+        weights.append(weight)
+
+    if sum(weights) <= 0:
+        return rng.choice(candidates)
+    return rng.choices(candidates, weights=weights)[0]
+
+
+"""
+---------------------------------------------------
+Per-process clients
+---------------------------------------------------
+"""
+
+_backends = None
+_clients = {}
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def _load_backends():
+    # Must be called with _client_lock held
+    global _backends, _clients, _client_pid
+
+    if _backends is None or _client_pid != os.getpid():
+        _backends = {backend.name: backend for backend in configured_backends()}
+        _clients = {}
+        _client_pid = os.getpid()
+    return _backends
+
+
+def get_backends():
+    """
+    Return a list of the hub backends for the current process, in the order
+    in which they're configured. The first backend is the default one.
+    """
+    with _client_lock:
+        return list(_load_backends().values())
+
+
+def get_backend(name=None):
+    """
+    Return the hub backend with the given name. Labs that were created before
+    their backend was recorded (or whose backend has since been removed) are
+    assumed to be on the default backend.
+    """
+    with _client_lock:
+        backends = _load_backends()
+        if name and name not in backends:
+            logger.warning(f"Unknown hub backend {name!r}; using the default")
+        return backends.get(name) or next(iter(backends.values()))
+
+
+def get_client(backend=None):
+    """
+    Return the HubClient for a backend (by default, the default backend) in
+    the current process, creating it if necessary. If HUB_API_FAKE is
+    enabled, the client talks to a fake hub running inside of the process.
+
+    Keyword parameters
+    ----------
+    backend (str) (default = None)
+        The name of the backend, usually taken from the hub_backend of a
+        GuacamoleConnection.
+    """
+    backend = get_backend(backend)
+
+    with _client_lock:
+        client = _clients.get(backend.name)
+        if client is None:
+            host = backend.url
+            if settings.HUB_API_FAKE:
+                # Imported here so that the fake hub is never loaded in
+                # production.
+                from labs.fakehub import get_fake_hub
+
+                host = get_fake_hub().url
+
+            client = _clients[backend.name] = HubClient(
+                host,
+                connect_timeout=settings.HUB_API_CONNECT_TIMEOUT,
+                read_timeout=settings.HUB_API_READ_TIMEOUT,
+                pool_size=settings.HUB_API_POOL_SIZE,
+                breaker=backend.breaker,
+            )
+
+    return client
+
+
+def reset_client():
+    """
+    Discard the current process's backends and HubClients, so that the next
+    call to get_client() creates new ones from the current settings.
+    """
+    global _backends, _clients, _client_pid
+
+    with _client_lock:
+        _backends = None
+        _clients = {}
+        _client_pid = None
+
+
+def hub_retry_after():
+    """
+    Return zero if any of the hub backends is accepting requests, or otherwise
+    the number of seconds until the first of their circuit breakers lets a
+    probe request through.
+    """
+    return min(backend.breaker.retry_after() for backend in get_backends())
+
+
+"""
+---------------------------------------------------
+Helper functions
+---------------------------------------------------
+"""
+
+
+def is_hub_failure(ex):
+    """
+    Return whether or not an exception raised by a HubClient means that the
+    hub itself failed, rather than rejecting the request (e.g. with a 404).
+    """
+    if isinstance(ex, requests.HTTPError):
+        return ex.response is None or ex.response.status_code >= 500
+    return isinstance(ex, requests.RequestException)
+
+
+def run_concurrently(func, items, max_workers):
+    """
+    Call func(item) for every item, running up to max_workers calls at once.
+    This is meant for fanning out requests to the hub; func should not touch
+    the database, since it runs outside of the calling thread.
+
+    Returns
+    ----------
+    dict
+        A dictionary mapping each item to the exception raised by func(item),
+        or to None if the call succeeded.
+    """
+
+    def call(item):
+        try:
+            func(item)
+        except Exception as ex:
+            logger.error(f"Hub request for {item} failed: {ex}")
+            return ex
+
+    items = list(items)
+    if not items:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        return dict(zip(items, pool.map(call, items)))
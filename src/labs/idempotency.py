@@ -0,0 +1,178 @@
+"""
+Idempotency keys for requests that start or delete labs.
+
+Users double-click, and browsers retry requests, so the same lab can be
+requested more than once. Clients can send an Idempotency-Key header with a
+request; the first request with a given key is handled as normal and its
+response is stored, and any repeats of the request (with the same key) get the
+stored response back without doing anything.
+
+Keys are stored in the IdempotencyKey table with a uniqueness constraint on
+(user, key), so that two copies of a request that arrive at the same time
+can't both be handled. Keys expire after LAB_IDEMPOTENCY_KEY_TTL hours.
+
+While the first request is being handled, repeats of it are answered with a
+409 and asked to try again shortly. If the process handling it dies, its key
+would be stuck in that state, so keys that are still in progress after
+LAB_IDEMPOTENCY_CLAIM_TIMEOUT seconds can be claimed by another request.
+"""
+
+import logging
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from labs.models import IdempotencyKey
+
+logger = logging.getLogger("labs")
+
+# Name of the header that clients send idempotency keys in
+HEADER = "Idempotency-Key"
+
+# Maximum length of an idempotency key
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+
+
+def expiry_cutoff(now=None):
+    """
+    Return the time before which idempotency keys are considered expired.
+    """
+    now = now or timezone.now()
+    return now - timedelta(hours=settings.LAB_IDEMPOTENCY_KEY_TTL)
+
+
+def abandoned_cutoff(now=None):
+    """
+    Return the time before which idempotency keys whose requests are still
+    being handled are considered abandoned.
+    """
+    now = now or timezone.now()
+    return now - timedelta(seconds=settings.LAB_IDEMPOTENCY_CLAIM_TIMEOUT)
+
+
+def claim_key(user, key, request):
+    """
+    Claim an idempotency key for a request.
+
+    Returns
+    ----------
+    (IdempotencyKey, bool)
+        The row for the key, and whether or not it was newly claimed (in which
+        case the caller should handle the request and then call
+        store_response()). If the key was claimed by an earlier request, the
+        row for that request is returned instead, unless it has expired or its
+        request was abandoned.
+    """
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return (
+                    IdempotencyKey.objects.create(user=user, key=key, request=request),
+                    True,
+                )
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if existing is None:
+                # The other request failed and released the key
+                continue
+            if existing.status_code is None:
+                if existing.date_created >= abandoned_cutoff():
+                    return existing, False
+            elif existing.date_created >= expiry_cutoff():
+                return existing, False
+
+            # Expired and abandoned keys can be reused. The row is only deleted
+            # if it hasn't changed, in case its request has just finished.
+            IdempotencyKey.objects.filter(
+                id=existing.id, status_code=existing.status_code
+            ).delete()
+
+    raise IntegrityError(f"Unable to claim idempotency key {key!r}")
+
+
+def store_response(claim: IdempotencyKey, response):
+    """
+    Store the response to the request that claimed an idempotency key.
+    """
+    claim.status_code = response.status_code
+    claim.response = response.content.decode("utf-8")
+    claim.content_type = response.get("Content-Type", "")
+    claim.save(update_fields=["status_code", "response", "content_type"])
+
+
+def replay_response(claim: IdempotencyKey):
+    """
+    Return a copy of the response to the request that claimed an idempotency
+    key.
+    """
+    response = HttpResponse(
+        claim.response, status=claim.status_code, content_type=claim.content_type
+    )
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def purge_expired_keys(now=None):
+    """
+    Delete every idempotency key that has expired, and return the number of
+    keys that were deleted.
+    """
+    n_deleted, _ = IdempotencyKey.objects.filter(
+        date_created__lt=expiry_cutoff(now)
+    ).delete()
+    return n_deleted
+
+
+class IdempotentPostMixin:
+    """
+    Mixin for views whose POST requests should only be handled once for each
+    idempotency key sent by the client. Requests without an Idempotency-Key
+    header are handled as normal.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if request.method != "POST" or not key or not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse(
+                {"err": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"},
+                status=422,
+            )
+
+        description = f"{request.method} {request.get_full_path()}"[:512]
+        claim, claimed = claim_key(request.user, key, description)
+
+        if not claimed:
+            if claim.request != description:
+                return JsonResponse(
+                    {"err": f"{HEADER} {key!r} was used for a different request"},
+                    status=422,
+                )
+            if claim.status_code is None:
+                response = JsonResponse(
+                    {"err": "The original request is still being processed"},
+                    status=409,
+                )
+                response["Retry-After"] = 1
+                return response
+            logger.info(f"Replaying response for {description} (key: {key!r})")
+            return replay_response(claim)
+
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except Exception:
+            # Let the client retry the request with the same key
+            claim.delete()
+            raise
+
+        if response.status_code >= 500:
+            # Server errors (e.g. while the hub is unavailable) aren't
+            # replayed, so that the client can retry with the same key.
+            claim.delete()
+        else:
+            store_response(claim, response)
+        return response
@@ -0,0 +1,369 @@
+"""
+Background queue for provisioning lab environments on the Lawliet Hub.
+
+Creating a pod on the hub can take a long time, so rather than making the
+request inside of a view we record a ProvisioningJob and hand it off to a
+bounded pool of worker threads. The workers send the pod creation request,
+retry it if it fails, and record the state of the job as they go.
+"""
+
+import logging
+import os
+import threading
+import requests
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django import db
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from guacamole.models import (
+    GuacamoleConnection,
+    GuacamoleConnectionParameter,
+    GuacamoleEntity,
+)
+from labs.bulk import connection_rows
+from labs.hub import get_backend, get_client, run_concurrently
+from labs.leases import new_lease
+from labs.lifecycle import record_deleted, record_pod_created, record_requested
+from labs.models import LabEnvironment, ProvisioningJob
+from labs.placement import choose_hub_backend, choose_node_pool
+from labs.teardown import decrement_active_labs, delete_pod
+from labs.topology import (
+    create_group,
+    create_lab_pods,
+    create_member_connections,
+    delete_groups,
+    lab_pods,
+    member_pod_name,
+)
+from labs.warm_pool import claim_pod
+from users.models import User
+
+logger = logging.getLogger("labs")
+
+"""
+---------------------------------------------------
+Worker pool
+---------------------------------------------------
+"""
+
+# The executor is created lazily, and is re-created if we find ourselves in
+# a new process (e.g. after gunicorn forks its workers).
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Return the ThreadPoolExecutor used to run provisioning jobs in the
+    current process.
+    """
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.LAB_PROVISIONING_WORKERS,
+                thread_name_prefix="lab-provisioner",
+            )
+            _executor_pid = os.getpid()
+
+    return _executor
+
+
+def submit_job(job: ProvisioningJob):
+    """
+    Queue up a ProvisioningJob to be run by the worker pool. If
+    LAB_PROVISIONING_WORKERS is zero, the job is run immediately in the
+    calling thread instead.
+
+    The workers use their own database connections, so jobs are only handed
+    to them once the current transaction has been committed (otherwise they
+    wouldn't be able to see the job). If the job can't be handed off, the lab
+    is released.
+    """
+    if settings.LAB_PROVISIONING_WORKERS <= 0:
+        run_job(job.id)
+        return
+
+    def submit():
+        try:
+            get_executor().submit(run_job, job.id, close_connection=True)
+        except Exception as ex:
+            logger.error(f"Unable to submit job for lab {job.connection_name}: {ex}")
+            ProvisioningJob.objects.filter(id=job.id).update(
+                state=ProvisioningJob.FAILED, error=str(ex)[:1000]
+            )
+            release_lab(job)
+
+    transaction.on_commit(submit)
+
+
+"""
+---------------------------------------------------
+Running jobs
+---------------------------------------------------
+"""
+
+
+def create_pod(job: ProvisioningJob):
+    """
+    Ask the hub to create the pod for a job, along with the pods for all of
+    the lab's services if it's a multi-machine lab. Raises an exception if any
+    of the requests fail.
+    """
+    lab = job.lab
+    conn = job.connection
+    members = lab_pods([conn])[conn.connection_name][1:]
+    if members:
+        # Only the services that the lab was started with are created
+        specs = {
+            member_pod_name(conn.connection_name, service.name): service
+            for service in lab.services.all()
+        }
+        missing = [name for name in members if name not in specs]
+        if missing:
+            raise LookupError(f"The services for {', '.join(missing)} were removed")
+        results = create_lab_pods(conn, lab, [specs[name] for name in members])
+        errors = [ex for ex in results.values() if ex is not None]
+        if errors:
+            raise errors[0]
+        return
+
+    try:
+        get_client(conn.hub_backend).create_pod(
+            job.connection_name,
+            image=lab.pod_image(),
+            ports=[lab.port],
+            resources=lab.resources(),
+            node_pool=conn.node_pool,
+        )
+    except requests.HTTPError as ex:
+        # The pod was already created by an earlier attempt whose response
+        # never made it back to us
+        if ex.response is None or ex.response.status_code != 409:
+            raise
+
+
+def lab_deleted(job: ProvisioningJob):
+    """
+    Return whether or not the lab that a job is creating a pod for has been
+    deleted (e.g. because the user deleted it, or its lease expired, while the
+    job was waiting to run).
+    """
+    return (
+        job.connection_id is None
+        or not GuacamoleConnection.objects.filter(pk=job.connection_id).exists()
+    )
+
+
+def cancel_job(job: ProvisioningJob):
+    """
+    Mark a job whose lab has been deleted as failed, without creating its pod.
+    Everything else belonging to the lab was cleaned up when it was deleted.
+    """
+    logger.info(f"Lab {job.connection_name} was deleted before its pod was created")
+    job.state = ProvisioningJob.FAILED
+    job.error = "The lab was deleted before its pod was created"
+    job.save(update_fields=["state", "attempts", "error", "date_updated"])
+    return job
+
+
+def abort_job(job_id, ex):
+    """
+    Mark a job that ran into an unexpected error as failed and release its
+    lab, so that the job isn't left running forever (which would stop
+    reconcile_labs from repairing the lab).
+    """
+    try:
+        ProvisioningJob.objects.filter(id=job_id).update(
+            state=ProvisioningJob.FAILED, error=str(ex)[:1000]
+        )
+        job = ProvisioningJob.objects.select_related("connection").get(id=job_id)
+        release_lab(job)
+    except Exception as ex:
+        logger.exception(f"Unable to release lab for provisioning job {job_id}: {ex}")
+
+
+def run_job(job_id, close_connection=False):
+    """
+    Run a ProvisioningJob, retrying it up to LAB_PROVISIONING_MAX_ATTEMPTS
+    times before marking it as failed. Jobs whose lab has been deleted are
+    marked as failed without creating a pod.
+
+    Parameters
+    ----------
+    job_id
+        The id of the ProvisioningJob that should be run.
+
+    Keyword parameters
+    ----------
+    close_connection (bool) (default = False)
+        Whether or not to close the thread's database connection once the job
+        is finished. This should be True when the job is run in a worker
+        thread, since those threads outlive the request that created the job.
+    """
+    try:
+        job = ProvisioningJob.objects.select_related("lab", "connection").get(id=job_id)
+        max_attempts = max(settings.LAB_PROVISIONING_MAX_ATTEMPTS, 1)
+        delay = settings.LAB_PROVISIONING_RETRY_DELAY
+        if job.connection is None:
+            return cancel_job(job)
+
+        job.state = ProvisioningJob.RUNNING
+        job.save(update_fields=["state", "date_updated"])
+
+        while job.attempts < max_attempts:
+            # The lab may have been deleted while we waited to retry
+            if job.attempts > 0 and lab_deleted(job):
+                return cancel_job(job)
+            job.attempts += 1
+            try:
+                create_pod(job)
+            except Exception as ex:
+                logger.error(
+                    f"API error creating lab {job.connection_name} "
+                    f"(attempt {job.attempts}/{max_attempts}): {ex}"
+                )
+                job.error = str(ex)[:1000]
+                job.save(update_fields=["attempts", "error", "date_updated"])
+                if job.attempts < max_attempts:
+                    time.sleep(delay * 2 ** (job.attempts - 1))
+            else:
+                job.state = ProvisioningJob.SUCCEEDED
+                job.error = ""
+                job.save(update_fields=["state", "attempts", "error", "date_updated"])
+                record_pod_created([job.connection_name])
+                logger.info(f"Created pod for lab {job.connection_name}")
+                return job
+
+        job.state = ProvisioningJob.FAILED
+        job.save(update_fields=["state", "date_updated"])
+        release_lab(job)
+        return job
+
+    except Exception as ex:
+        logger.exception(f"Unexpected error running provisioning job {job_id}: {ex}")
+        abort_job(job_id, ex)
+
+    finally:
+        if close_connection:
+            db.connection.close()
+
+
+def release_lab(job: ProvisioningJob):
+    """
+    Undo the creation of a lab whose pod couldn't be created, so that the user
+    isn't left with a lab that will never start (and that counts against their
+    quota). The job itself is kept, so that the user can see why it failed.
+    """
+    # The hub may have created some of the lab's pods (or its only pod) even
+    # though it reported an error, so they're deleted on a best-effort basis
+    pods = lab_pods([job.connection])[job.connection_name] if job.connection else []
+    if pods:
+        backend = job.connection.hub_backend
+        errors = run_concurrently(
+            lambda name: delete_pod(name, backend), pods, settings.LAB_BULK_CONCURRENCY
+        )
+        for (name, ex) in errors.items():
+            if ex is not None:
+                logger.warning(f"Unable to delete pod {name} of failed lab: {ex}")
+
+    with transaction.atomic():
+        record_deleted([job.connection_name])
+        if len(pods) > 1:
+            # The connections to the lab's other machines are deleted first,
+            # so that only the lab itself is counted below.
+            GuacamoleConnection.objects.filter(
+                primary__connection_name=job.connection_name
+            ).delete()
+        _, deleted = GuacamoleConnection.objects.filter(
+            connection_name=job.connection_name
+        ).delete()
+        n_deleted = deleted.get(GuacamoleConnection._meta.label, 0)
+        if n_deleted:
+            decrement_active_labs({job.user_id: n_deleted})
+        if len(pods) > 1:
+            delete_groups([job.connection_name])
+
+    logger.info(f"Released lab {job.connection_name} after its pod failed to start")
+
+
+"""
+---------------------------------------------------
+Starting labs
+---------------------------------------------------
+"""
+
+
+def start_lab(lab: LabEnvironment, user, requested_at=None):
+    """
+    Create all of the rows for a new lab in a single transaction, and either
+    bind it to a pod from the lab's warm pool or queue a job to create a new
+    pod for it. The pod is only requested once the rows have been committed.
+
+    Keyword parameters
+    ----------
+    requested_at (datetime) (default = None)
+        The time at which the user asked for the lab, if it was earlier than
+        now (e.g. because the request had to wait in the admission queue).
+
+    Returns
+    ----------
+    (GuacamoleConnection, ProvisioningJob, LabLease)
+        The new connection, the job creating its pod, and its lease.
+    """
+    with transaction.atomic():
+        # Create a new GuacamoleConnection to the container. If there's an idle
+        # pod in the lab's warm pool, we bind the connection to that pod
+        # instead of creating a new one. Warm pools are kept on the default
+        # hub backend, and only hold single-machine labs.
+        services = list(lab.services.all())
+        conn = GuacamoleConnection(protocol=lab.protocol, lab=lab, user=user)
+        pod_name = claim_pod(lab) if not services else None
+        if pod_name is not None:
+            conn.connection_name = pod_name
+            conn.hub_backend = get_backend().name
+        else:
+            conn.hub_backend = choose_hub_backend()
+            conn.node_pool = choose_node_pool(lab)
+        if services:
+            create_group(conn)
+        conn.save()
+
+        # Give the user permission to connect to the container, and to each
+        # of the lab's other machines
+        entity_id = GuacamoleEntity.objects.values_list("entity_id", flat=True).get(
+            name=user.username, type="USER"
+        )
+        params, perm = connection_rows(conn, lab, entity_id)
+        GuacamoleConnectionParameter.objects.bulk_create(params)
+        perm.save()
+        if services:
+            create_member_connections(conn, services, entity_id)
+        lease = new_lease(conn)
+        lease.save()
+        record_requested([conn], now=requested_at, pod_created=pod_name is not None)
+
+        # Pods claimed from the warm pool already exist, so their jobs are
+        # finished as soon as they're created.
+        job = ProvisioningJob(
+            connection=conn, connection_name=conn.connection_name, lab=lab, user=user,
+        )
+        if pod_name is not None:
+            job.state = ProvisioningJob.SUCCEEDED
+        job.save()
+
+        # Increment the number of active labs that the user has. This is done
+        # in the database, so that concurrent requests can't lose an update.
+        User.objects.filter(id=user.id).update(n_active_labs=F("n_active_labs") + 1)
+        user.n_active_labs += 1
+
+    # Hand the pod creation request off to the provisioning queue
+    if pod_name is None:
+        submit_job(job)
+
+    return conn, job, lease
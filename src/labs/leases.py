@@ -0,0 +1,145 @@
+"""
+Leases that bound how long a lab can run for.
+
+Every lab is created with a LabLease that expires LAB_LEASE_DURATION minutes
+later. Users can extend their leases from the dashboard (up to a total
+lifetime of LAB_LEASE_MAX_DURATION minutes), and labs whose leases have
+expired are deleted by expire_leases(), which is run by the expire_leases
+management command.
+"""
+
+import logging
+
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from labs.models import LabLease
+from labs.teardown import teardown_labs
+
+logger = logging.getLogger("labs")
+
+"""
+---------------------------------------------------
+Creating and extending leases
+---------------------------------------------------
+"""
+
+
+def new_lease(conn, now=None):
+    """
+    Return a new (unsaved) LabLease for a connection.
+    """
+    now = now or timezone.now()
+    return LabLease(
+        connection=conn,
+        expires_at=now + timedelta(minutes=settings.LAB_LEASE_DURATION),
+        date_created=now,
+    )
+
+
+def max_expiry(lease: LabLease):
+    """
+    Return the latest time that a lease can be extended to, or None if there is
+    no limit on how long a lab can run.
+    """
+    if settings.LAB_LEASE_MAX_DURATION <= 0:
+        return None
+    return lease.date_created + timedelta(minutes=settings.LAB_LEASE_MAX_DURATION)
+
+
+def extend_lease(lease: LabLease, now=None):
+    """
+    Extend a lease by LAB_LEASE_EXTENSION minutes, without letting it run past
+    its maximum lifetime.
+
+    Returns
+    ----------
+    bool
+        Whether or not the lease was extended.
+    """
+    now = now or timezone.now()
+    expires_at = max(lease.expires_at, now) + timedelta(
+        minutes=settings.LAB_LEASE_EXTENSION
+    )
+
+    limit = max_expiry(lease)
+    if limit is not None:
+        expires_at = min(expires_at, limit)
+    if expires_at <= lease.expires_at:
+        return False
+
+    lease.expires_at = expires_at
+    lease.extensions += 1
+    lease.save(update_fields=["expires_at", "extensions"])
+    return True
+
+
+"""
+---------------------------------------------------
+Expiring leases
+---------------------------------------------------
+"""
+
+
+def expire_leases(now=None, batch_size=None):
+    """
+    Delete the labs for every lease that has expired, in order of expiry, in
+    batches of batch_size labs (by default, LAB_REAPER_BATCH_SIZE).
+
+    Returns
+    ----------
+    list of str
+        The connection names of the labs that were deleted.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.LAB_REAPER_BATCH_SIZE
+
+    # This only reads the expired range of the expires_at index. We fetch all
+    # of the expired leases up front so that labs that fail to be deleted are
+    # retried on the next run, rather than being fetched again in this one.
+    conns = [
+        lease.connection
+        for lease in LabLease.objects.filter(expires_at__lte=now)
+        .order_by("expires_at")
+        .select_related("connection")
+        .only(
+            "connection__connection_name",
+            "connection__user_id",
+            "connection__lab_id",
+            "connection__hub_backend",
+        )
+    ]
+
+    expired = []
+    for ii in range(0, len(conns), batch_size):
+        results = teardown_labs(conns[ii : ii + batch_size])
+        expired += [name for (name, ex) in results.items() if ex is None]
+
+    if conns:
+        logger.info(f"Expired {len(expired)} of {len(conns)} leases")
+    return expired
+
+
+def next_expiry(now=None):
+    """
+    Return the time at which the next lease that hasn't expired yet expires,
+    or None if there aren't any such leases. Leases that have expired but
+    whose labs couldn't be deleted are ignored (see has_expired_leases).
+    """
+    now = now or timezone.now()
+    return (
+        LabLease.objects.filter(expires_at__gt=now)
+        .order_by("expires_at")
+        .values_list("expires_at", flat=True)
+        .first()
+    )
+
+
+def has_expired_leases(now=None):
+    """
+    Return whether there are any leases that have expired but haven't been
+    deleted yet, e.g. because the hub was unavailable when their labs were
+    torn down.
+    """
+    now = now or timezone.now()
+    return LabLease.objects.filter(expires_at__lte=now).exists()
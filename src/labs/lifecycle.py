@@ -0,0 +1,207 @@
+"""
+Timestamps for every stage of a lab's lifecycle, and latency statistics
+computed from them.
+
+A LabLifecycle is recorded for each lab when it is requested, and is updated
+when its pod is created, when a status check first sees it ready, when the
+user first connects to it through Guacamole, and when it is deleted. The
+distribution of each of these latencies for a lab environment tells us which
+labs would benefit from a warm pool or a smaller image.
+
+First sessions are copied out of Guacamole's connection history by the
+sync_lifecycles command, which should be run alongside the other periodic
+commands (and is also done whenever a lab is deleted).
+"""
+
+import math
+import threading
+
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+from guacamole.models import GuacamoleConnectionHistory
+from labs.models import LabLifecycle
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600)
+
+# The longest window (in days) that latency reports can cover
+MAX_METRICS_WINDOW = 3650
+
+# The labs that this process has already recorded as ready. Ready labs keep
+# being polled by their dashboards, so this saves a write for every status
+# check after the first. The set is cleared once it holds MAX_READY labs.
+MAX_READY = 10000
+_ready = set()
+_ready_lock = threading.Lock()
+
+"""
+---------------------------------------------------
+Recording timestamps
+---------------------------------------------------
+"""
+
+
+def record_requested(conns, now=None, pod_created=False):
+    """
+    Record that a group of labs have just been requested. If pod_created is
+    True, their pods already exist (e.g. because they were taken from a warm
+    pool).
+    """
+    pod_created_at = timezone.now() if pod_created else None
+    LabLifecycle.objects.bulk_create(
+        [
+            LabLifecycle(
+                connection_name=conn.connection_name,
+                lab_id=conn.lab_id,
+                requested_at=now or timezone.now(),
+                pod_created_at=pod_created_at,
+            )
+            for conn in conns
+        ]
+    )
+
+
+def record_event(field, conn_names, now=None):
+    """
+    Record the time at which a stage of the lifecycle was reached for a group
+    of labs. Only the first time that a stage is reached is recorded.
+    """
+    conn_names = list(conn_names)
+    if not conn_names:
+        return
+    LabLifecycle.objects.filter(
+        connection_name__in=conn_names, **{f"{field}__isnull": True}
+    ).update(**{field: now or timezone.now()})
+
+
+def record_pod_created(conn_names, now=None):
+    record_event("pod_created_at", conn_names, now=now)
+
+
+def record_ready(conn_names, now=None):
+    """
+    Record the time at which a group of labs were first seen to be ready.
+    Labs that this process has already seen to be ready are skipped without
+    going to the database.
+    """
+    with _ready_lock:
+        new = [name for name in conn_names if name not in _ready]
+    if not new:
+        return
+
+    record_event("ready_at", new, now=now)
+    with _ready_lock:
+        if len(_ready) + len(new) > MAX_READY:
+            _ready.clear()
+        _ready.update(new)
+
+
+def sync_first_sessions(conn_names=None):
+    """
+    Copy the start of the first Guacamole session for each lab from the
+    connection history. This needs to be done before a lab is deleted, since
+    its history is deleted along with it.
+    """
+    pending = LabLifecycle.objects.filter(
+        first_session_at__isnull=True, deleted_at__isnull=True
+    )
+    if conn_names is not None:
+        pending = pending.filter(connection_name__in=list(conn_names))
+
+    first_sessions = (
+        GuacamoleConnectionHistory.objects.filter(
+            connection_name__in=pending.values("connection_name")
+        )
+        .values("connection_name")
+        .annotate(first=Min("start_date"))
+    )
+    for row in first_sessions:
+        LabLifecycle.objects.filter(connection_name=row["connection_name"]).update(
+            first_session_at=row["first"]
+        )
+
+
+def record_deleted(conn_names, now=None):
+    conn_names = list(conn_names)
+    sync_first_sessions(conn_names)
+    record_event("deleted_at", conn_names, now=now)
+
+
+"""
+---------------------------------------------------
+Latency statistics
+---------------------------------------------------
+"""
+
+
+def percentile(values, p):
+    """
+    Return the p-th percentile of a sorted list of values, using the
+    nearest-rank method.
+    """
+    if not values:
+        return None
+    rank = max(math.ceil(p / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(latencies):
+    """
+    Summarize a list of latencies (in seconds) with its percentiles and a
+    histogram.
+    """
+    latencies = sorted(latencies)
+    histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for latency in latencies:
+        bucket = sum(latency > bound for bound in HISTOGRAM_BUCKETS)
+        histogram[bucket] += 1
+
+    return {
+        "count": len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "histogram": dict(
+            zip([f"le_{b}" for b in HISTOGRAM_BUCKETS] + ["gt_600"], histogram)
+        ),
+    }
+
+
+def latency_report(labs=None, days=None):
+    """
+    Return latency statistics for the labs requested in the last `days` days
+    (by default, LAB_METRICS_WINDOW).
+
+    Returns
+    ----------
+    dict
+        A dictionary mapping each lab's name to statistics (in seconds) for
+        the time taken after a lab was requested for its pod to be created
+        ("pod_created"), for it to become ready ("ready"), and for the user to
+        first connect to it ("first_session").
+    """
+    days = settings.LAB_METRICS_WINDOW if days is None else days
+    lifecycles = LabLifecycle.objects.filter(
+        requested_at__gte=timezone.now() - timedelta(days=days)
+    )
+    if labs is not None:
+        lifecycles = lifecycles.filter(lab__in=labs)
+
+    stages = ("pod_created", "ready", "first_session")
+    latencies = defaultdict(lambda: {stage: [] for stage in stages})
+    rows = lifecycles.values_list(
+        "lab__name", "requested_at", *(f"{stage}_at" for stage in stages)
+    )
+    for (name, requested_at, *times) in rows:
+        lab = latencies[name]
+        for (stage, time) in zip(stages, times):
+            if time is not None:
+                lab[stage].append((time - requested_at).total_seconds())
+
+    return {
+        name: {stage: summarize(values) for (stage, values) in lab.items()}
+        for (name, lab) in latencies.items()
+    }
@@ -0,0 +1,436 @@
+"""
+Load testing of lab provisioning, simulating a class all starting their labs
+at once.
+
+Every simulated user runs in its own thread, and repeatedly starts a lab,
+polls its status until it's ready, uses it for a while, and deletes it, with
+random think times in between. Requests are sent through Django's test client
+(so the whole request/response cycle runs, including middleware), and the
+latency and number of database queries of every request are recorded by
+endpoint.
+
+This is normally run against the fake hub (see labs.fakehub) with the
+loadtest_labs management command.
+
+The status benchmark compares serving pod statuses through the WSGI
+application (lawliet.wsgi) with the native async handling under ASGI (see
+labs.asgi and the benchmark_status management command).
+"""
+
+import asyncio
+import io
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django import db
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from guacamole.models import GuacamoleEntity
+from labs.asgi import close_async_clients
+from labs.lifecycle import percentile
+from labs.models import LabEnvironment
+from labs.status import is_ready
+from users.models import User
+
+logger = logging.getLogger("labs")
+
+"""
+---------------------------------------------------
+Statistics
+---------------------------------------------------
+"""
+
+
+class RequestStats:
+    """
+    Latencies, query counts, and errors for every request made to a single
+    endpoint.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.queries = []
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, elapsed, n_queries, error):
+        with self.lock:
+            self.latencies.append(elapsed)
+            self.queries.append(n_queries)
+            self.errors += int(error)
+
+    def as_dict(self, duration):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "throughput": count / duration if duration > 0 else 0.0,
+            "p50_ms": 1000 * (percentile(latencies, 50) or 0),
+            "p95_ms": 1000 * (percentile(latencies, 95) or 0),
+            "p99_ms": 1000 * (percentile(latencies, 99) or 0),
+            "mean_queries": sum(self.queries) / count if count else 0.0,
+            "max_queries": max(self.queries, default=0),
+        }
+
+
+"""
+---------------------------------------------------
+Load test
+---------------------------------------------------
+"""
+
+
+class LabLoadTest:
+    """
+    A classroom's worth of simulated users starting, using, and deleting labs.
+
+    Parameters
+    ----------
+    lab (LabEnvironment)
+        The lab environment that every user starts.
+
+    Keyword parameters
+    ----------
+    n_users (int) (default = 30)
+        Number of simulated users.
+    cycles (int) (default = 1)
+        Number of times that each user starts and deletes a lab.
+    think_time (float) (default = 1)
+        Average time (in seconds) that users wait between actions. Think times
+        are exponentially distributed.
+    ramp_up (float) (default = 0)
+        Time (in seconds) over which the users' start times are spread out. By
+        default, every user starts at once.
+    ready_timeout (float) (default = 60)
+        Maximum time (in seconds) that a user waits for their lab to become
+        ready before giving up and deleting it.
+    seed (int) (default = None)
+        Seed for the random number generator, for reproducible runs.
+    """
+
+    password = "loadtest-password"
+
+    def __init__(
+        self,
+        lab: LabEnvironment,
+        n_users=30,
+        cycles=1,
+        think_time=1,
+        ramp_up=0,
+        ready_timeout=60,
+        seed=None,
+    ):
+        self.lab = lab
+        self.n_users = n_users
+        self.cycles = cycles
+        self.think_time = think_time
+        self.ramp_up = ramp_up
+        self.ready_timeout = ready_timeout
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.stats = defaultdict(RequestStats)
+        self.ready_times = []
+        self.timeouts = 0
+        self.users = []
+
+    """
+    Users
+    """
+
+    def create_users(self):
+        """
+        Create the simulated users through UserManager.create_user, so that
+        they have all of the Guacamole rows that real users have.
+        """
+        run_id = uuid.uuid4().hex[:6]
+        self.users = [
+            User.objects.create_user(
+                f"lt-{run_id}-{i}", f"lt-{run_id}-{i}@loadtest.invalid", self.password,
+            )
+            for i in range(self.n_users)
+        ]
+
+    def delete_users(self):
+        usernames = [user.username for user in self.users]
+        User.objects.filter(username__in=usernames).delete()
+        GuacamoleEntity.objects.filter(name__in=usernames, type="USER").delete()
+        self.users = []
+
+    """
+    Requests
+    """
+
+    def think(self, mean=None):
+        mean = self.think_time if mean is None else mean
+        if mean > 0:
+            with self.lock:
+                delay = self.random.expovariate(1 / mean)
+            time.sleep(delay)
+
+    def request(self, client, method, endpoint, url):
+        """
+        Send a request through the test client, recording its latency and the
+        number of queries that it made under the given endpoint name.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            start = time.monotonic()
+            response = getattr(client, method)(url)
+            elapsed = time.monotonic() - start
+        self.stats[endpoint].record(
+            elapsed, len(queries.captured_queries), response.status_code >= 400
+        )
+        return response
+
+    def wait_until_ready(self, client, conn_name):
+        """
+        Poll the status of a lab until it's ready, waiting between polls for as
+        long as the server asks us to.
+        """
+        url = f"{reverse('lab_api.pod.pod_status')}?id={conn_name}"
+        start = time.monotonic()
+        while time.monotonic() - start < self.ready_timeout:
+            response = self.request(client, "get", "pod/status", url)
+            if response.status_code == 200 and is_ready(response.json()):
+                with self.lock:
+                    self.ready_times.append(time.monotonic() - start)
+                return True
+            time.sleep(float(response.get("Retry-After", 1)))
+
+        with self.lock:
+            self.timeouts += 1
+        return False
+
+    def simulate_user(self, user, delay):
+        # Server errors are recorded as failed requests, rather than raised
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+        generate_url = f"{reverse('lab_api.generate')}?create={self.lab.id}"
+
+        try:
+            time.sleep(delay)
+            for _ in range(self.cycles):
+                response = self.request(client, "post", "generate", generate_url)
+                conn_name = None
+                if response.status_code == 202:
+                    conn_name = response.json().get("conn_name")
+                if conn_name is None:
+                    # The request failed, or was queued by admission control
+                    self.think()
+                    continue
+
+                self.think()
+                if self.wait_until_ready(client, conn_name):
+                    # "Use" the lab for a while before deleting it
+                    self.think()
+
+                self.request(
+                    client,
+                    "post",
+                    "delete",
+                    f"{reverse('lab_api.delete')}?id={conn_name}",
+                )
+                self.think()
+        except Exception as ex:
+            logger.exception(f"Simulated user {user.username} failed: {ex}")
+
+    def user_thread(self, user, delay):
+        try:
+            self.simulate_user(user, delay)
+        finally:
+            # Each thread has its own database connection
+            db.connection.close()
+
+    """
+    Running the test
+    """
+
+    def run(self):
+        """
+        Run the load test, and return a report of the latency, throughput, and
+        query counts of every endpoint.
+        """
+        if not self.users:
+            self.create_users()
+
+        threads = [
+            threading.Thread(
+                target=self.user_thread,
+                args=(user, self.ramp_up * i / max(self.n_users - 1, 1)),
+                name=f"loadtest-{i}",
+            )
+            for (i, user) in enumerate(self.users)
+        ]
+
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.monotonic() - start
+
+        ready_times = sorted(self.ready_times)
+        return {
+            "users": self.n_users,
+            "cycles": self.cycles,
+            "duration": duration,
+            "endpoints": {
+                endpoint: stats.as_dict(duration)
+                for (endpoint, stats) in sorted(self.stats.items())
+            },
+            "time_to_ready": {
+                "count": len(ready_times),
+                "timeouts": self.timeouts,
+                "p50": percentile(ready_times, 50),
+                "p95": percentile(ready_times, 95),
+                "p99": percentile(ready_times, 99),
+            },
+        }
+
+
+"""
+---------------------------------------------------
+Status benchmark
+---------------------------------------------------
+"""
+
+BENCHMARK_HOST = "testserver"
+
+
+def wsgi_get(app, path, query_string="", cookie=""):
+    """
+    Send a GET request straight to a WSGI application, and return the status
+    code of its response.
+    """
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "QUERY_STRING": query_string,
+        "SCRIPT_NAME": "",
+        "SERVER_NAME": BENCHMARK_HOST,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": BENCHMARK_HOST,
+        "HTTP_COOKIE": cookie,
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(int(status.split(" ", 1)[0]))
+        return lambda data: None
+
+    result = app(environ, start_response)
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return statuses[0]
+
+
+async def asgi_get(app, path, query_string="", cookie=""):
+    """
+    Send a GET request straight to an ASGI application, and return the status
+    code of its response.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("latin-1"),
+        "query_string": query_string.encode("latin-1"),
+        "root_path": "",
+        "headers": [
+            (b"host", BENCHMARK_HOST.encode("latin-1")),
+            (b"cookie", cookie.encode("latin-1")),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": (BENCHMARK_HOST, 80),
+    }
+    status = None
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def latency_summary(stats, duration):
+    report = stats.as_dict(duration)
+    del report["mean_queries"], report["max_queries"]
+    return report
+
+
+def benchmark_wsgi(app, urls, n_requests, threads, cookie=""):
+    """
+    Send n_requests GET requests to a WSGI application from a pool of threads
+    (as a threaded WSGI server would), cycling through a list of
+    (path, query string) pairs, and return a summary of their latencies.
+    """
+    stats = RequestStats()
+
+    def get(ii):
+        path, query_string = urls[ii % len(urls)]
+        start = time.monotonic()
+        status = wsgi_get(app, path, query_string, cookie)
+        stats.record(time.monotonic() - start, 0, status >= 400)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(get, range(n_requests)))
+    return latency_summary(stats, time.monotonic() - start)
+
+
+def benchmark_asgi(app, urls, n_requests, concurrency, cookie=""):
+    """
+    Send n_requests GET requests to an ASGI application from a single event
+    loop, with up to concurrency requests in flight at once, and return a
+    summary of their latencies.
+    """
+    stats = RequestStats()
+
+    async def run():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def get(ii):
+            path, query_string = urls[ii % len(urls)]
+            async with slots:
+                start = time.monotonic()
+                status = await asgi_get(app, path, query_string, cookie)
+                stats.record(time.monotonic() - start, 0, status >= 400)
+
+        start = time.monotonic()
+        try:
+            await asyncio.gather(*(get(ii) for ii in range(n_requests)))
+        finally:
+            await close_async_clients()
+        return time.monotonic() - start
+
+    duration = asyncio.run(run())
+    return latency_summary(stats, duration)
@@ -0,0 +1,151 @@
+"""
+Compare the pod status endpoints under WSGI and under ASGI.
+"""
+
+import json
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from guacamole.models import GuacamoleConnection, GuacamoleEntity
+from labs.fakehub import start_fake_hub
+from labs.hub import reset_client
+from labs.loadtest import BENCHMARK_HOST, benchmark_asgi, benchmark_wsgi
+from labs.models import LabEnvironment
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the pod status endpoints through the WSGI application "
+        "(lawliet.wsgi) and the ASGI application (lawliet.asgi), against a fake "
+        "hub, and report the latency and throughput of each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("lab", help="Name of the lab environment to use.")
+        parser.add_argument(
+            "--labs", type=int, default=20, help="Number of labs to poll.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=2000,
+            help="Number of status requests to send to each application.",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=16,
+            help="Number of threads serving the WSGI application.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=500,
+            help="Number of requests in flight at once under ASGI.",
+        )
+        parser.add_argument(
+            "--batch",
+            action="store_true",
+            help="Benchmark the batch status endpoint instead, polling every lab.",
+        )
+        parser.add_argument(
+            "--hub-latency",
+            type=float,
+            default=0.05,
+            help="Average response time (in seconds) of the fake hub.",
+        )
+        parser.add_argument(
+            "--cache-ttl",
+            type=float,
+            default=0,
+            help=(
+                "Time (in seconds) for which pod statuses are cached. By default "
+                "every request goes to the hub."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        try:
+            lab = LabEnvironment.objects.get(name=options["lab"])
+        except LabEnvironment.DoesNotExist:
+            raise CommandError(f"Lab {options['lab']!r} does not exist")
+
+        # Imported here, since each of these sets up its own application
+        from lawliet.asgi import application as asgi_application
+        from lawliet.wsgi import application as wsgi_application
+
+        # Statuses are requested from the fake hub, rather than from any of the
+        # configured backends
+        server = start_fake_hub(latency=options["hub_latency"])
+        overrides = override_settings(
+            HUB_API_HOST=server.url,
+            HUB_API_BACKENDS=[],
+            HUB_API_FAKE=False,
+            HUB_API_POOL_SIZE=options["threads"],
+            HUB_API_ASYNC_POOL_SIZE=options["concurrency"],
+            LAB_POD_STATUS_CACHE_TTL=options["cache_ttl"],
+            ALLOWED_HOSTS=settings.ALLOWED_HOSTS + [BENCHMARK_HOST],
+        )
+
+        run_id = uuid.uuid4().hex[:6]
+        user = User.objects.create_user(
+            f"bs-{run_id}", f"bs-{run_id}@loadtest.invalid", uuid.uuid4().hex
+        )
+        try:
+            names = []
+            for _ in range(options["labs"]):
+                conn = GuacamoleConnection.objects.create(
+                    protocol=lab.protocol, lab=lab, user=user
+                )
+                server.hub.create_pod(conn.connection_name, {"image": lab.pod_image()})
+                names.append(conn.connection_name)
+
+            client = Client()
+            client.force_login(user)
+            cookie_name = settings.SESSION_COOKIE_NAME
+            cookie = f"{cookie_name}={client.cookies[cookie_name].value}"
+
+            if options["batch"]:
+                urls = [(reverse("lab_api.pod.pod_status_batch"), "")]
+            else:
+                path = reverse("lab_api.pod.pod_status")
+                urls = [(path, f"id={name}") for name in names]
+
+            with overrides:
+                reset_client()
+                wsgi = benchmark_wsgi(
+                    wsgi_application,
+                    urls,
+                    options["requests"],
+                    options["threads"],
+                    cookie,
+                )
+                reset_client()
+                asgi = benchmark_asgi(
+                    asgi_application,
+                    urls,
+                    options["requests"],
+                    options["concurrency"],
+                    cookie,
+                )
+
+        finally:
+            reset_client()
+            User.objects.filter(id=user.id).delete()
+            GuacamoleEntity.objects.filter(name=user.username, type="USER").delete()
+            server.shutdown()
+            server.server_close()
+
+        report = {
+            "requests": options["requests"],
+            "labs": options["labs"],
+            "hub_latency": options["hub_latency"],
+            "wsgi": dict(wsgi, threads=options["threads"]),
+            "asgi": dict(asgi, concurrency=options["concurrency"]),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,56 @@
+"""
+Delete labs whose leases have expired, along with expired idempotency keys.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from labs.idempotency import purge_expired_keys
+from labs.leases import expire_leases, has_expired_leases, next_expiry
+
+# Minimum time (in seconds) to wait between checks
+MIN_DELAY = 1
+
+
+class Command(BaseCommand):
+    help = "Delete the labs for all expired leases, in order of expiry."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Expire leases a single time and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.LAB_LEASE_CHECK_INTERVAL,
+            help="Maximum time (in seconds) to wait between checks.",
+        )
+
+    def handle(self, *args, **options):
+        failures = 0
+        while True:
+            now = timezone.now()
+            for name in expire_leases(now=now):
+                self.stdout.write(name)
+            purge_expired_keys()
+            if options["once"]:
+                break
+
+            # Sleep until the next lease expires, but wake up periodically to
+            # pick up leases that have been created or extended in the meantime.
+            delay = options["interval"]
+            expiry = next_expiry(now)
+            if expiry is not None:
+                delay = min(delay, (expiry - timezone.now()).total_seconds())
+
+            # Labs that couldn't be deleted (e.g. because the hub is down) are
+            # retried with an exponential back-off, rather than right away.
+            if has_expired_leases(now):
+                failures += 1
+                backoff = settings.LAB_LEASE_RETRY_DELAY * 2 ** (failures - 1)
+                delay = min(delay, backoff, options["interval"])
+            else:
+                failures = 0
+            time.sleep(max(MIN_DELAY, delay))
@@ -0,0 +1,64 @@
+"""
+Show the query plans for the hot lookups on the Guacamole tables, before and
+after the migrations that index them.
+"""
+
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from labs.query_plans import MIGRATIONS_BEFORE_INDEXES, explain_lookups, populate
+
+
+class Command(BaseCommand):
+    help = (
+        "Create a scratch test database with the given number of labs, and "
+        "report the query plan and median time of each of the hot lookups on "
+        "the Guacamole tables, both before and after the migrations that add "
+        "indexes for them. Your own database is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--connections", type=int, default=100000, help="Number of labs to create.",
+        )
+        parser.add_argument(
+            "--users", type=int, default=1000, help="Number of users owning the labs.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=10,
+            help="Number of times to run each lookup.",
+        )
+
+    def migrate(self, targets=None):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets or executor.loader.graph.leaf_nodes())
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            # The sample data is created before the indexes are, just as it
+            # would be in a database being migrated.
+            self.migrate(MIGRATIONS_BEFORE_INDEXES)
+            sample = populate(options["connections"], options["users"])
+            before = explain_lookups(sample, options["repeat"])
+            self.migrate()
+            after = explain_lookups(sample, options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            "connections": options["connections"],
+            "users": options["users"],
+            "database": connection.vendor,
+            "lookups": {
+                name: {"before": before[name], "after": after[name]} for name in after
+            },
+        }
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,132 @@
+"""
+Load test lab provisioning with a burst of simulated users.
+"""
+
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from labs.fakehub import start_fake_hub
+from labs.hub import reset_client
+from labs.loadtest import LabLoadTest
+from labs.models import LabEnvironment
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate a class of users starting, polling, and deleting labs, and "
+        "report the latency, throughput, and query counts of each endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("lab", help="Name of the lab environment to start.")
+        parser.add_argument(
+            "--users", type=int, default=30, help="Number of simulated users.",
+        )
+        parser.add_argument(
+            "--cycles",
+            type=int,
+            default=1,
+            help="Number of labs that each user starts and deletes.",
+        )
+        parser.add_argument(
+            "--think-time",
+            type=float,
+            default=1,
+            help="Average time (in seconds) that users wait between actions.",
+        )
+        parser.add_argument(
+            "--ramp-up",
+            type=float,
+            default=0,
+            help="Time (in seconds) over which users' start times are spread.",
+        )
+        parser.add_argument(
+            "--ready-timeout",
+            type=float,
+            default=60,
+            help="Time (in seconds) to wait for a lab to become ready.",
+        )
+        parser.add_argument(
+            "--seed", type=int, help="Seed for the random number generator.",
+        )
+        parser.add_argument(
+            "--hub-url",
+            help=(
+                "URL of the hub to send requests to. By default, a fake hub is "
+                "started inside of this process."
+            ),
+        )
+        parser.add_argument(
+            "--hub-latency",
+            type=float,
+            default=settings.HUB_FAKE_LATENCY,
+            help="Average response time (in seconds) of the fake hub.",
+        )
+        parser.add_argument(
+            "--hub-failure-rate",
+            type=float,
+            default=settings.HUB_FAKE_FAILURE_RATE,
+            help="Fraction of pod creations and deletions that the fake hub fails.",
+        )
+        parser.add_argument(
+            "--hub-ready-delay",
+            type=float,
+            default=settings.HUB_FAKE_READY_DELAY,
+            help="Time (in seconds) that the fake hub's pods take to become ready.",
+        )
+        parser.add_argument(
+            "--keep-users",
+            action="store_true",
+            help="Don't delete the simulated users afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            lab = LabEnvironment.objects.get(name=options["lab"])
+        except LabEnvironment.DoesNotExist:
+            raise CommandError(f"Lab {options['lab']!r} does not exist")
+
+        server = None
+        hub_url = options["hub_url"]
+        if hub_url is None:
+            server = start_fake_hub(
+                latency=options["hub_latency"],
+                failure_rate=options["hub_failure_rate"],
+                ready_delay=options["hub_ready_delay"],
+                seed=options["seed"],
+            )
+            hub_url = server.url
+
+        test = LabLoadTest(
+            lab,
+            n_users=options["users"],
+            cycles=options["cycles"],
+            think_time=options["think_time"],
+            ramp_up=options["ramp_up"],
+            ready_timeout=options["ready_timeout"],
+            seed=options["seed"],
+        )
+
+        # The test client sends requests to "testserver". Every lab is created
+        # on the hub under test, rather than on any of the configured backends.
+        overrides = override_settings(
+            HUB_API_HOST=hub_url,
+            HUB_API_BACKENDS=[],
+            HUB_API_FAKE=False,
+            ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ["testserver"],
+        )
+        try:
+            with overrides:
+                reset_client()
+                report = test.run()
+        finally:
+            reset_client()
+            if not options["keep_users"]:
+                test.delete_users()
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,38 @@
+"""
+Pull lab images onto every node ahead of time.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from labs.models import LabEnvironment
+from labs.prepull import run_prepull
+
+
+class Command(BaseCommand):
+    help = (
+        "Pull the images for some or all labs onto every node, and wait for the "
+        "pulls to finish. Run this ahead of a workshop so that the first "
+        "students to start a lab don't have to wait for its image."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "labs", nargs="*", help="Names of the labs to pull. Defaults to every lab."
+        )
+
+    def handle(self, *args, **options):
+        labs = LabEnvironment.objects.order_by("name")
+        if options["labs"]:
+            labs = labs.filter(name__in=options["labs"])
+            missing = set(options["labs"]) - {lab.name for lab in labs}
+            if missing:
+                raise CommandError(f"Unknown labs: {', '.join(sorted(missing))}")
+
+        failed = False
+        for lab in labs:
+            done = run_prepull(lab.id)
+            states = dict(lab.image_pulls.values_list("node", "state"))
+            self.stdout.write(f"{lab.name}: {lab.url} {states}")
+            failed = failed or not done or "failed" in states.values()
+
+        if failed:
+            raise CommandError("Some images could not be pulled")
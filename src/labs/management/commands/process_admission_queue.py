@@ -0,0 +1,34 @@
+"""
+Start labs for requests waiting in the admission queue.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from labs.admission import admit_waiting
+
+
+class Command(BaseCommand):
+    help = "Admit waiting lab requests as cluster capacity becomes available."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process the queue a single time and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.LAB_ADMISSION_INTERVAL,
+            help="Time (in seconds) to wait between attempts to admit requests.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            for ticket in admit_waiting():
+                self.stdout.write(str(ticket.id))
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,57 @@
+"""
+Create a lab for every student in a class roster.
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from labs.bulk import provision_roster
+from labs.hub import HubUnavailable
+from labs.models import LabEnvironment
+
+
+class Command(BaseCommand):
+    help = "Create a lab environment for a list of users, or for a group of users."
+
+    def add_arguments(self, parser):
+        parser.add_argument("lab", help="Name of the lab environment to create.")
+        users = parser.add_mutually_exclusive_group(required=True)
+        users.add_argument(
+            "--users", nargs="+", metavar="USERNAME", help="Users to create labs for."
+        )
+        users.add_argument(
+            "--group", help="Name of a group of users to create labs for."
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help="Maximum number of pods to create at once.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            lab = LabEnvironment.objects.get(name=options["lab"])
+        except LabEnvironment.DoesNotExist:
+            raise CommandError(f"Lab {options['lab']!r} does not exist")
+
+        try:
+            report = provision_roster(
+                lab,
+                usernames=options["users"],
+                group=options["group"],
+                max_workers=options["concurrency"],
+            )
+        except HubUnavailable as ex:
+            raise CommandError(str(ex))
+        self.stdout.write(json.dumps(report, indent=2))
+
+        n_failed = sum(1 for result in report if result["status"] == "failed")
+        if n_failed > 0:
+            self.stderr.write(f"Failed to create {n_failed} of {len(report)} labs")
+        n_queued = sum(1 for result in report if result["status"] == "queued")
+        if n_queued > 0:
+            self.stderr.write(
+                f"{n_queued} labs are waiting for room in the cluster "
+                "(see process_admission_queue)"
+            )
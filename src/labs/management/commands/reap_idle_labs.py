@@ -0,0 +1,46 @@
+"""
+Delete labs that nobody has connected to in a while.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from labs.reaper import reap_idle_labs
+
+
+class Command(BaseCommand):
+    help = "Delete the pods and connections for idle labs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Run the reaper once and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.LAB_REAPER_INTERVAL,
+            help="Time (in seconds) to wait between runs of the reaper.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.LAB_REAPER_BATCH_SIZE,
+            help="Number of labs to delete in each batch.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="List the idle labs without deleting them.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            reaped = reap_idle_labs(
+                batch_size=options["batch_size"], dry_run=options["dry_run"]
+            )
+            for name in reaped:
+                self.stdout.write(name)
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
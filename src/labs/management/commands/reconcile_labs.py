@@ -0,0 +1,57 @@
+"""
+Repair labs and pods that have drifted out of sync with each other.
+"""
+
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from labs.reconcile import reconcile_labs
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete pods that don't belong to any lab and labs whose pods no longer "
+        "exist, and recompute every user's number of active labs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Run the reconciler once and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.LAB_RECONCILE_INTERVAL,
+            help="Time (in seconds) to wait between runs of the reconciler.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.LAB_REAPER_BATCH_SIZE,
+            help="Number of pods or labs to delete in each batch.",
+        )
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=settings.LAB_RECONCILE_PAGE_SIZE,
+            help="Number of pods to request from the hub at a time.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what is out of sync without repairing it.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            report = reconcile_labs(
+                batch_size=options["batch_size"],
+                page_size=options["page_size"],
+                dry_run=options["dry_run"],
+            )
+            self.stdout.write(json.dumps(report))
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,33 @@
+"""
+Keep the warm pod pools for every lab topped up.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from labs.warm_pool import refill_all
+
+
+class Command(BaseCommand):
+    help = "Refill the warm pod pools for every lab environment."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Refill the pools a single time and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.LAB_WARM_POOL_REFILL_INTERVAL,
+            help="Time (in seconds) to wait between refills.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            refill_all()
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
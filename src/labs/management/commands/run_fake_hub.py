@@ -0,0 +1,64 @@
+"""
+Run a fake Lawliet Hub API server for load and integration testing.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from labs.fakehub import FakeHub, FakeHubServer
+
+
+class Command(BaseCommand):
+    help = "Serve a fake hub API that keeps its pods in memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--host", default="127.0.0.1", help="Address to listen on.",
+        )
+        parser.add_argument(
+            "--port", type=int, default=8001, help="Port to listen on.",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=settings.HUB_FAKE_LATENCY,
+            help="Average time (in seconds) taken to respond to a request.",
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=settings.HUB_FAKE_FAILURE_RATE,
+            help="Fraction of pod creations and deletions that fail.",
+        )
+        parser.add_argument(
+            "--ready-delay",
+            type=float,
+            default=settings.HUB_FAKE_READY_DELAY,
+            help="Time (in seconds) that pods take to become ready.",
+        )
+        parser.add_argument(
+            "--nodes",
+            type=int,
+            default=1,
+            help="Number of nodes that images are pulled onto.",
+        )
+        parser.add_argument(
+            "--seed", type=int, help="Seed for the random number generator.",
+        )
+
+    def handle(self, *args, **options):
+        hub = FakeHub(
+            latency=options["latency"],
+            failure_rate=options["failure_rate"],
+            ready_delay=options["ready_delay"],
+            nodes=[f"fake-node-{i}" for i in range(options["nodes"])],
+            seed=options["seed"],
+        )
+        server = FakeHubServer((options["host"], options["port"]), hub)
+        self.stdout.write(f"Serving fake hub at {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.hub.close()
+            server.server_close()
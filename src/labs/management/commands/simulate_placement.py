@@ -0,0 +1,73 @@
+"""
+Compare how densely lab pods are packed onto nodes by different placement
+strategies.
+"""
+
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+from labs.models import LabEnvironment
+from labs.placement import pack
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate placing a class's labs onto a group of nodes, and report how "
+        "many students fit per node when pods are spread out or bin-packed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--students", type=int, default=100, help="Number of students."
+        )
+        parser.add_argument(
+            "--nodes", type=int, default=10, help="Number of nodes in the cluster."
+        )
+        parser.add_argument(
+            "--node-cpu",
+            type=int,
+            default=4000,
+            help="CPU capacity of each node, in millicores.",
+        )
+        parser.add_argument(
+            "--node-memory",
+            type=int,
+            default=16384,
+            help="Memory capacity of each node, in mebibytes.",
+        )
+        parser.add_argument(
+            "--labs",
+            nargs="+",
+            help=(
+                "Names of the labs to simulate. Students are assigned to labs "
+                "round-robin. Defaults to every lab."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        labs = LabEnvironment.objects.order_by("name")
+        if options["labs"]:
+            labs = labs.filter(name__in=options["labs"])
+        labs = list(labs)
+        if not labs:
+            raise CommandError("No lab environments to simulate")
+
+        pods = [
+            (lab.cpu_request, lab.memory_request)
+            for lab in itertools.islice(itertools.cycle(labs), options["students"])
+        ]
+        nodes = [(options["node_cpu"], options["node_memory"])] * options["nodes"]
+
+        self.stdout.write(
+            f"{len(pods)} students, {len(labs)} labs, {len(nodes)} nodes "
+            f"({options['node_cpu']}m CPU, {options['node_memory']}Mi memory each)"
+        )
+        for strategy in ("spread", "binpack"):
+            counts, unplaced = pack(pods, nodes, strategy=strategy)
+            used = [n for n in counts if n > 0]
+            per_node = sum(used) / len(used) if used else 0
+            self.stdout.write(
+                f"{strategy:>8}: {sum(used)} placed, {unplaced} unplaced, "
+                f"{len(used)} nodes used, {per_node:.1f} students per node "
+                f"(max {max(counts)})"
+            )
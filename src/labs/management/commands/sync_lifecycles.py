@@ -0,0 +1,34 @@
+"""
+Copy the first session of each lab out of Guacamole's connection history.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from labs.lifecycle import sync_first_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        "Record the time at which users first connected to each of their labs, "
+        "for the startup latency statistics."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Sync the lifecycles once and exit.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.LAB_LIFECYCLE_SYNC_INTERVAL,
+            help="Time (in seconds) to wait between syncs.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sync_first_sessions()
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
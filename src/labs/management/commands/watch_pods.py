@@ -0,0 +1,29 @@
+"""
+Maintain a local copy of the state of every pod on the hub.
+"""
+
+from django.core.management.base import BaseCommand
+from labs.watch import watch
+
+
+class Command(BaseCommand):
+    help = "Consume the hub's pod event stream and update the PodState table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reconnect-delay",
+            type=float,
+            default=1,
+            help="Time (in seconds) to wait before reconnecting to the hub.",
+        )
+        parser.add_argument(
+            "--backend",
+            default=None,
+            help=(
+                "Name of the hub backend to watch (default: the first backend in "
+                "HUB_API_BACKENDS). Run one command per backend."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        watch(backend=options["backend"], reconnect_delay=options["reconnect_delay"])
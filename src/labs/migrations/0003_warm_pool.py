@@ -0,0 +1,67 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import guacamole.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0002_provisioningjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="labenvironment",
+            name="warm_pool_off_hours_size",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="labenvironment",
+            name="warm_pool_size",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="WarmPod",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        default=guacamole.models.gen_connection_name,
+                        max_length=128,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[("pending", "Pending"), ("idle", "Idle")],
+                        default="pending",
+                        max_length=16,
+                    ),
+                ),
+                (
+                    "date_created",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "lab",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="labs.LabEnvironment",
+                    ),
+                ),
+            ],
+        ),
+    ]
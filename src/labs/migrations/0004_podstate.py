@@ -0,0 +1,25 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0003_warm_pool"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PodState",
+            fields=[
+                (
+                    "connection_name",
+                    models.CharField(max_length=128, primary_key=True, serialize=False),
+                ),
+                ("phase", models.CharField(blank=True, default="", max_length=32)),
+                ("conditions", models.TextField(default="[]")),
+                ("date_updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
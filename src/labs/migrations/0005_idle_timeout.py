@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0004_podstate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="labenvironment",
+            name="idle_timeout",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
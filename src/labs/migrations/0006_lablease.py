@@ -0,0 +1,44 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("guacamole", "0003_connection_date_created"),
+        ("labs", "0005_idle_timeout"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LabLease",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("expires_at", models.DateTimeField(db_index=True)),
+                ("extensions", models.PositiveSmallIntegerField(default=0)),
+                (
+                    "date_created",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "connection",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lease",
+                        to="guacamole.GuacamoleConnection",
+                    ),
+                ),
+            ],
+        ),
+    ]
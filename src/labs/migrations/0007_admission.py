@@ -0,0 +1,78 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("labs", "0006_lablease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="labenvironment",
+            name="cpu_request",
+            field=models.PositiveIntegerField(default=500),
+        ),
+        migrations.AddField(
+            model_name="labenvironment",
+            name="memory_request",
+            field=models.PositiveIntegerField(default=512),
+        ),
+        migrations.CreateModel(
+            name="AdmissionTicket",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[("waiting", "Waiting"), ("admitted", "Admitted")],
+                        default="waiting",
+                        max_length=16,
+                    ),
+                ),
+                (
+                    "date_created",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("date_admitted", models.DateTimeField(blank=True, null=True)),
+                (
+                    "job",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="labs.ProvisioningJob",
+                    ),
+                ),
+                (
+                    "lab",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="labs.LabEnvironment",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0007_admission"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="labenvironment",
+            name="cpu_limit",
+            field=models.PositiveIntegerField(default=1000),
+        ),
+        migrations.AddField(
+            model_name="labenvironment",
+            name="memory_limit",
+            field=models.PositiveIntegerField(default=1024),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.0.3 on 2026-10-18 13:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0008_resource_limits"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImagePullStatus",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("node", models.CharField(max_length=128)),
+                ("image", models.CharField(max_length=200)),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("pulling", "Pulling"),
+                            ("ready", "Ready"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pulling",
+                        max_length=16,
+                    ),
+                ),
+                ("error", models.CharField(blank=True, default="", max_length=1000)),
+                ("date_updated", models.DateTimeField(auto_now=True)),
+                (
+                    "lab",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="image_pulls",
+                        to="labs.LabEnvironment",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("lab", "node")},},
+        ),
+    ]
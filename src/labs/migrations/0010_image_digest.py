@@ -0,0 +1,23 @@
+# Generated by Django 3.0.3 on 2026-10-18 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0009_imagepullstatus"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="labenvironment",
+            name="date_digest_resolved",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="labenvironment",
+            name="image_digest",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.0.3 on 2026-10-18 14:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0010_image_digest"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LabLifecycle",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("connection_name", models.CharField(max_length=128, unique=True)),
+                (
+                    "requested_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                ("pod_created_at", models.DateTimeField(blank=True, null=True)),
+                ("ready_at", models.DateTimeField(blank=True, null=True)),
+                ("first_session_at", models.DateTimeField(blank=True, null=True)),
+                ("deleted_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "lab",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lifecycles",
+                        to="labs.LabEnvironment",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.0.3 on 2026-10-18 14:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0012_idempotencykey"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LabService",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.SlugField(max_length=30)),
+                ("url", models.CharField(default=None, max_length=200)),
+                ("protocol", models.CharField(blank=True, default="", max_length=32)),
+                ("port", models.PositiveIntegerField(blank=True, null=True)),
+                ("cpu_request", models.PositiveIntegerField(default=500)),
+                ("memory_request", models.PositiveIntegerField(default=512)),
+                ("cpu_limit", models.PositiveIntegerField(default=1000)),
+                ("memory_limit", models.PositiveIntegerField(default=1024)),
+                (
+                    "lab",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="services",
+                        to="labs.LabEnvironment",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("lab", "name")},},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 14:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0013_labservice"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="provisioningjob",
+            name="connection_name",
+            field=models.CharField(db_index=True, max_length=128),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:14
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0014_provisioningjob_connection_name_index"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="labservice",
+            name="name",
+            field=models.CharField(
+                max_length=14,
+                validators=[
+                    django.core.validators.RegexValidator(
+                        "^[a-z0-9]([-a-z0-9]*[a-z0-9])?$",
+                        "Service names may only contain lowercase letters, digits, and hyphens, and must start and end with a letter or digit.",
+                    )
+                ],
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("labs", "0015_labservice_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="warmpod",
+            name="image",
+            field=models.CharField(blank=True, default="", max_length=300),
+        ),
+    ]
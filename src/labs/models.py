@@ -1,8 +1,12 @@
+import json
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.images import ImageFile
+from django.core.validators import RegexValidator
 from django.db import models
 from django.utils import timezone
+from guacamole.models import gen_connection_name
 from users.models import User
 from uuid import uuid4
 
@@ -13,6 +17,20 @@ LabEnvironment
 """
 
 
+def pod_resources(spec):
+    """
+    Return the resource requests and limits of a LabEnvironment or LabService
+    in the format used by Kubernetes pod specs.
+    """
+    return {
+        "requests": {
+            "cpu": f"{spec.cpu_request}m",
+            "memory": f"{spec.memory_request}Mi",
+        },
+        "limits": {"cpu": f"{spec.cpu_limit}m", "memory": f"{spec.memory_limit}Mi"},
+    }
+
+
 class LabEnvironment(models.Model):
     # A unique identifier for the lab
     id = models.UUIDField(primary_key=True, default=uuid4, unique=True)
@@ -31,6 +49,13 @@ class LabEnvironment(models.Model):
     # if we try to save a LabEnvironment to the database without a url.
     url = models.CharField(max_length=200, blank=False, default=None)
 
+    # Immutable digest (e.g. "sha256:...") that the image's tag pointed to when
+    # it was last resolved, and the time at which it was resolved. Pods are
+    # created from the digest when one is available, so that nodes don't have
+    # to check the registry for a newer image every time a lab starts.
+    image_digest = models.CharField(max_length=100, blank=True, default="")
+    date_digest_resolved = models.DateTimeField(blank=True, null=True)
+
     # Protocol used by Guacamole to connect to the lab
     protocol = models.CharField(max_length=32, blank=False)
 
@@ -39,3 +64,383 @@ class LabEnvironment(models.Model):
 
     # Date when the lab was uploaded
     date_uploaded = models.DateTimeField(default=timezone.now)
+
+    # Number of idle pods to keep running for the lab, both during class hours
+    # and outside of them (see LAB_CLASS_HOURS and LAB_CLASS_DAYS).
+    warm_pool_size = models.PositiveSmallIntegerField(default=0)
+    warm_pool_off_hours_size = models.PositiveSmallIntegerField(default=0)
+
+    # Number of minutes that a lab can go without anyone connecting to it
+    # before it is deleted by the idle lab reaper. If this is blank then
+    # LAB_IDLE_TIMEOUT is used instead; if it is zero, the lab is never reaped.
+    idle_timeout = models.PositiveIntegerField(blank=True, null=True)
+
+    # Resources requested by each pod running the lab, in millicores of CPU
+    # and mebibytes of memory. These are used to decide whether the cluster
+    # has room for another instance of the lab. The limits are the most that a
+    # pod is allowed to use.
+    cpu_request = models.PositiveIntegerField(default=500)
+    memory_request = models.PositiveIntegerField(default=512)
+    cpu_limit = models.PositiveIntegerField(default=1000)
+    memory_limit = models.PositiveIntegerField(default=1024)
+
+    def pod_image(self):
+        """
+        Return the image reference that pods for the lab should be created
+        from, which is pinned to the image's digest if it has been resolved.
+        """
+        if not self.image_digest or "@" in self.url:
+            return self.url
+
+        # Strip the tag from the image (being careful not to mistake a
+        # registry's port for a tag) before adding the digest.
+        name = self.url
+        if ":" in name.rsplit("/", 1)[-1]:
+            name = name.rsplit(":", 1)[0]
+        return f"{name}@{self.image_digest}"
+
+    def resources(self):
+        """
+        Return the resource requests and limits for the lab's pods, in the
+        format used by Kubernetes pod specs.
+        """
+        return pod_resources(self)
+
+    def footprint(self):
+        """
+        Return the CPU (in millicores) and memory (in mebibytes) requested by
+        all of the pods of a new lab: the lab's own pod, and one pod for each
+        of its services.
+        """
+        services = self.services.aggregate(
+            cpu=models.Sum("cpu_request"), memory=models.Sum("memory_request")
+        )
+        return (
+            self.cpu_request + (services["cpu"] or 0),
+            self.memory_request + (services["memory"] or 0),
+        )
+
+    def get_idle_timeout(self):
+        """
+        Return the number of minutes after which an idle lab is deleted, or
+        zero if idle labs are never deleted.
+        """
+        if self.idle_timeout is None:
+            return settings.LAB_IDLE_TIMEOUT
+        return self.idle_timeout
+
+
+"""
+---------------------------------------------------
+LabService
+---------------------------------------------------
+"""
+
+
+# Pods are named after a lab's connection name followed by a hyphen and the
+# name of the service, and pod names are limited to 63 characters
+MAX_SERVICE_NAME_LENGTH = 63 - len(gen_connection_name()) - 1
+
+
+class LabService(models.Model):
+    # The lab environment that the service belongs to. Every lab runs the lab
+    # environment's own image as its primary machine; services are the other
+    # machines that make up a multi-machine lab (e.g. the targets in an
+    # attack-defend exercise). Labs with services don't use warm pools.
+    lab = models.ForeignKey(
+        LabEnvironment, on_delete=models.CASCADE, related_name="services"
+    )
+
+    # Name of the service, which is appended to the lab's connection name to
+    # name the service's pod. The pod's name has to be a valid DNS label
+    # (lowercase letters, digits, and hyphens, at most 63 characters long).
+    name = models.CharField(
+        max_length=MAX_SERVICE_NAME_LENGTH,
+        validators=[
+            RegexValidator(
+                r"^[a-z0-9]([-a-z0-9]*[a-z0-9])?$",
+                "Service names may only contain lowercase letters, digits, and "
+                "hyphens, and must start and end with a letter or digit.",
+            )
+        ],
+    )
+
+    # URL of the Docker image for the service
+    url = models.CharField(max_length=200, blank=False, default=None)
+
+    # Protocol and port used by Guacamole to connect to the service. Services
+    # without a protocol (e.g. a database used by the lab's other machines)
+    # aren't given a Guacamole connection.
+    protocol = models.CharField(max_length=32, blank=True, default="")
+    port = models.PositiveIntegerField(blank=True, null=True)
+
+    # Resources requested by the service's pod, as for LabEnvironment
+    cpu_request = models.PositiveIntegerField(default=500)
+    memory_request = models.PositiveIntegerField(default=512)
+    cpu_limit = models.PositiveIntegerField(default=1000)
+    memory_limit = models.PositiveIntegerField(default=1024)
+
+    class Meta:
+        unique_together = (("lab", "name"),)
+
+    @property
+    def reachable(self):
+        return bool(self.protocol) and self.port is not None
+
+    def pod_image(self):
+        return self.url
+
+    def resources(self):
+        return pod_resources(self)
+
+
+"""
+---------------------------------------------------
+ProvisioningJob
+---------------------------------------------------
+"""
+
+
+class ProvisioningJob(models.Model):
+    # Possible states for a job
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    # A unique identifier for the job. This is the job id that is returned
+    # to the user when they request a new lab.
+    id = models.UUIDField(primary_key=True, default=uuid4, unique=True)
+
+    # The Guacamole connection that the pod is being created for. We keep a
+    # copy of the connection name so that the job remains meaningful after
+    # the connection has been deleted.
+    connection = models.ForeignKey(
+        "guacamole.GuacamoleConnection",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+    )
+    connection_name = models.CharField(max_length=128, db_index=True)
+
+    # The lab environment being provisioned, and the user that requested it
+    lab = models.ForeignKey(LabEnvironment, on_delete=models.CASCADE)
+    user = models.ForeignKey("users.User", on_delete=models.CASCADE)
+
+    # Current state of the job, the number of attempts that have been made
+    # to run it, and the last error that was encountered (if any).
+    state = models.CharField(max_length=16, choices=STATES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=1000, blank=True, default="")
+
+    date_created = models.DateTimeField(default=timezone.now)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    @property
+    def finished(self):
+        return self.state in (self.SUCCEEDED, self.FAILED)
+
+
+"""
+---------------------------------------------------
+WarmPod
+---------------------------------------------------
+"""
+
+
+class WarmPod(models.Model):
+    # Possible states for a pod in the warm pool
+    PENDING = "pending"
+    IDLE = "idle"
+    STATES = [(PENDING, "Pending"), (IDLE, "Idle")]
+
+    # Name of the pod on the hub. When the pod is claimed this becomes the
+    # name of the new GuacamoleConnection.
+    name = models.CharField(max_length=128, unique=True, default=gen_connection_name)
+
+    # The lab environment that the pod is running
+    lab = models.ForeignKey(LabEnvironment, on_delete=models.CASCADE)
+
+    # Whether the pod is still starting up, or whether it is ready and
+    # waiting to be claimed.
+    state = models.CharField(max_length=16, choices=STATES, default=PENDING)
+
+    # The image that the pod was created from (see LabEnvironment.pod_image).
+    # Pods running an image other than the lab's current one are drained.
+    image = models.CharField(max_length=300, blank=True, default="")
+
+    date_created = models.DateTimeField(default=timezone.now)
+
+
+"""
+---------------------------------------------------
+PodState
+---------------------------------------------------
+"""
+
+
+class PodState(models.Model):
+    # Name of the pod on the hub, which is the connection_name of the
+    # GuacamoleConnection that the pod was created for.
+    connection_name = models.CharField(max_length=128, primary_key=True)
+
+    # The pod's phase (e.g. "Pending" or "Running") and its conditions, stored
+    # as a JSON-encoded list.
+    phase = models.CharField(max_length=32, blank=True, default="")
+    conditions = models.TextField(default="[]")
+
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def as_status(self):
+        """
+        Return the pod's state in the same format as the hub's pod status API.
+        """
+        return {"phase": self.phase, "conditions": json.loads(self.conditions)}
+
+
+"""
+---------------------------------------------------
+LabLease
+---------------------------------------------------
+"""
+
+
+class LabLease(models.Model):
+    # The Guacamole connection for the lab that the lease belongs to
+    connection = models.OneToOneField(
+        "guacamole.GuacamoleConnection", on_delete=models.CASCADE, related_name="lease"
+    )
+
+    # Time at which the lab is deleted, unless the lease is extended first.
+    # This is indexed so that the leases that are about to expire can be found
+    # without scanning the entire table.
+    expires_at = models.DateTimeField(db_index=True)
+
+    # Number of times that the user has extended the lease
+    extensions = models.PositiveSmallIntegerField(default=0)
+
+    date_created = models.DateTimeField(default=timezone.now)
+
+
+"""
+---------------------------------------------------
+AdmissionTicket
+---------------------------------------------------
+"""
+
+
+class AdmissionTicket(models.Model):
+    # Possible states for a ticket
+    WAITING = "waiting"
+    ADMITTED = "admitted"
+    STATES = [(WAITING, "Waiting"), (ADMITTED, "Admitted")]
+
+    # A unique identifier for the ticket, which is returned to the user so
+    # that they can check on their place in the queue.
+    id = models.UUIDField(primary_key=True, default=uuid4, unique=True)
+
+    # The lab environment that the user asked to start
+    lab = models.ForeignKey(LabEnvironment, on_delete=models.CASCADE)
+    user = models.ForeignKey("users.User", on_delete=models.CASCADE)
+
+    state = models.CharField(max_length=16, choices=STATES, default=WAITING)
+
+    # The job that was created for the lab once the ticket was admitted
+    job = models.ForeignKey(
+        ProvisioningJob, on_delete=models.SET_NULL, blank=True, null=True
+    )
+
+    date_created = models.DateTimeField(default=timezone.now)
+    date_admitted = models.DateTimeField(blank=True, null=True)
+
+
+"""
+---------------------------------------------------
+ImagePullStatus
+---------------------------------------------------
+"""
+
+
+class ImagePullStatus(models.Model):
+    # Possible states for an image pull
+    PULLING = "pulling"
+    READY = "ready"
+    FAILED = "failed"
+    STATES = [(PULLING, "Pulling"), (READY, "Ready"), (FAILED, "Failed")]
+
+    # The lab environment whose image is being pulled, and the node that it's
+    # being pulled onto.
+    lab = models.ForeignKey(
+        LabEnvironment, on_delete=models.CASCADE, related_name="image_pulls"
+    )
+    node = models.CharField(max_length=128)
+
+    # The image that was pulled. If the lab's image changes, the lab is
+    # warming again until the new image has been pulled.
+    image = models.CharField(max_length=200)
+
+    state = models.CharField(max_length=16, choices=STATES, default=PULLING)
+    error = models.CharField(max_length=1000, blank=True, default="")
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("lab", "node"),)
+
+
+"""
+---------------------------------------------------
+LabLifecycle
+---------------------------------------------------
+"""
+
+
+class LabLifecycle(models.Model):
+    # Name of the lab's Guacamole connection. The connection itself isn't
+    # referenced, since we keep the lifecycle after the lab has been deleted.
+    connection_name = models.CharField(max_length=128, unique=True)
+
+    lab = models.ForeignKey(
+        LabEnvironment, on_delete=models.CASCADE, related_name="lifecycles"
+    )
+
+    # Times at which the lab was requested, its pod was created, it was first
+    # seen to be ready, the user first connected to it, and it was deleted.
+    requested_at = models.DateTimeField(default=timezone.now, db_index=True)
+    pod_created_at = models.DateTimeField(blank=True, null=True)
+    ready_at = models.DateTimeField(blank=True, null=True)
+    first_session_at = models.DateTimeField(blank=True, null=True)
+    deleted_at = models.DateTimeField(blank=True, null=True)
+
+
+"""
+---------------------------------------------------
+IdempotencyKey
+---------------------------------------------------
+"""
+
+
+class IdempotencyKey(models.Model):
+    # Key sent by the client in the Idempotency-Key header. Keys only have to
+    # be unique for each user.
+    user = models.ForeignKey("users.User", on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+
+    # The request that the key was first used for (e.g. "POST /labs/generate?...")
+    request = models.CharField(max_length=512)
+
+    # The response to the original request. The status code is null while the
+    # original request is still being handled.
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response = models.TextField(blank=True, default="")
+    content_type = models.CharField(max_length=64, blank=True, default="")
+
+    date_created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = (("user", "key"),)
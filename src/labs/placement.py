@@ -0,0 +1,207 @@
+"""
+Placement of lab pods onto node pools.
+
+When LAB_NODE_POOLS is configured, every new lab is assigned to a node pool
+before its pod is created. Pools are chosen by best fit: the pod goes to the
+pool that would be left with the least free capacity, so that pods are packed
+densely onto as few pools as possible and the rest can be scaled down.
+
+Labs are also spread across hub backends (clusters) when more than one is
+configured in HUB_API_BACKENDS; see choose_hub_backend().
+
+pack() applies the same idea to individual nodes, and is used by the
+simulate_placement command to compare bin-packing against spreading pods
+evenly across nodes (the default behavior of the Kubernetes scheduler).
+"""
+
+from collections import Counter
+from django.conf import settings
+from django.db.models import Count, Sum
+from guacamole.models import GuacamoleConnection
+from labs.hub import choose_backend, get_backends
+from labs.models import LabEnvironment
+from labs.topology import member_usage
+
+"""
+---------------------------------------------------
+Node pools
+---------------------------------------------------
+"""
+
+
+def pool_usage():
+    """
+    Return a dictionary mapping each node pool to the CPU and memory
+    requested by the labs that are running on it, including the member pods
+    of multi-machine labs.
+    """
+    rows = (
+        GuacamoleConnection.objects.filter(primary=None)
+        .exclude(node_pool="")
+        .values("node_pool")
+        .annotate(cpu=Sum("lab__cpu_request"), memory=Sum("lab__memory_request"))
+    )
+    usage = {row["node_pool"]: (row["cpu"] or 0, row["memory"] or 0) for row in rows}
+    for (node_pool, cpu, memory) in member_usage():
+        if node_pool:
+            used = usage.get(node_pool, (0, 0))
+            usage[node_pool] = (used[0] + cpu, used[1] + memory)
+    return usage
+
+
+def remaining_fraction(capacity, used, request):
+    """
+    Return the fraction of a bin's capacity that would be left after adding a
+    request to it, using whichever resource would be the most full. Returns
+    None if the request doesn't fit.
+    """
+    left = [c - u - r for (c, u, r) in zip(capacity, used, request)]
+    if any(l < 0 for l in left):
+        return None
+    return min(l / c for (l, c) in zip(left, capacity))
+
+
+def choose_node_pool(lab: LabEnvironment, usage=None, footprint=None):
+    """
+    Choose the node pool that the pods for a new lab should be placed on. All
+    of a multi-machine lab's pods are placed on the same pool.
+
+    Keyword parameters
+    ----------
+    usage (dict) (default = None)
+        The current usage of each pool, as returned by pool_usage(). This is
+        looked up if it isn't provided.
+    footprint ((int, int)) (default = None)
+        The CPU and memory requested by the lab's pods, as returned by
+        LabEnvironment.footprint(). This is looked up if it isn't provided.
+
+    Returns
+    ----------
+    str
+        The name of the chosen pool, or an empty string if no pools are
+        configured or none of them have room for the pod.
+    """
+    pools = settings.LAB_NODE_POOLS
+    if not pools:
+        return ""
+    if usage is None:
+        usage = pool_usage()
+
+    request = footprint or lab.footprint()
+    best, best_fraction = "", None
+    for pool in pools:
+        capacity = (pool["nodes"] * pool["cpu"], pool["nodes"] * pool["memory"])
+        fraction = remaining_fraction(
+            capacity, usage.get(pool["name"], (0, 0)), request
+        )
+        if fraction is not None and (best_fraction is None or fraction < best_fraction):
+            best, best_fraction = pool["name"], fraction
+    return best
+
+
+"""
+---------------------------------------------------
+Hub backends
+---------------------------------------------------
+"""
+
+
+def backend_loads():
+    """
+    Return a Counter mapping each hub backend to the number of labs running
+    on it. Labs without a backend are counted against the default backend.
+    """
+    default = get_backends()[0].name
+    rows = (
+        GuacamoleConnection.objects.filter(primary=None)
+        .values("hub_backend")
+        .annotate(n=Count("connection_id"))
+    )
+
+    loads = Counter()
+    for row in rows:
+        loads[row["hub_backend"] or default] += row["n"]
+    return loads
+
+
+def choose_hub_backend(loads=None):
+    """
+    Choose the hub backend that a new lab should be created on (see
+    labs.hub.choose_backend).
+
+    Keyword parameters
+    ----------
+    loads (dict) (default = None)
+        The number of labs running on each backend, as returned by
+        backend_loads(). This is looked up if it isn't provided and there's
+        more than one backend to choose from.
+
+    Returns
+    ----------
+    str
+        The name of the chosen backend.
+    """
+    backends = get_backends()
+    if len(backends) > 1 and loads is None:
+        loads = backend_loads()
+    return choose_backend(backends, loads or {}).name
+
+
+"""
+---------------------------------------------------
+Simulation
+---------------------------------------------------
+"""
+
+
+def pack(pods, nodes, strategy="binpack"):
+    """
+    Place pods onto nodes.
+
+    Parameters
+    ----------
+    pods (list of (int, int))
+        The (cpu, memory) requests of the pods to place.
+    nodes (list of (int, int))
+        The (cpu, memory) capacity of each node.
+
+    Keyword parameters
+    ----------
+    strategy (str) (default = "binpack")
+        Either "binpack", which places the largest pods first onto the node
+        that they fit most tightly, or "spread", which places pods in order
+        onto the least-allocated node.
+
+    Returns
+    ----------
+    (list of int, int)
+        The number of pods placed on each node, and the number of pods that
+        couldn't be placed anywhere.
+    """
+    if strategy not in ("binpack", "spread"):
+        raise ValueError(f"Unknown placement strategy {strategy!r}")
+
+    used = [(0, 0) for _ in nodes]
+    counts = [0 for _ in nodes]
+    unplaced = 0
+
+    if strategy == "binpack":
+        pods = sorted(pods, key=lambda pod: pod, reverse=True)
+
+    for pod in pods:
+        fractions = [
+            remaining_fraction(capacity, u, pod) for (capacity, u) in zip(nodes, used)
+        ]
+        candidates = [ii for (ii, f) in enumerate(fractions) if f is not None]
+        if not candidates:
+            unplaced += 1
+            continue
+
+        if strategy == "binpack":
+            ii = min(candidates, key=lambda ii: fractions[ii])
+        else:
+            ii = max(candidates, key=lambda ii: fractions[ii])
+        used[ii] = (used[ii][0] + pod[0], used[ii][1] + pod[1])
+        counts[ii] += 1
+
+    return counts, unplaced
@@ -0,0 +1,210 @@
+"""
+Pre-pulling lab images onto every node.
+
+Lab images can be several gigabytes, so the first pod started for a lab on
+each node spends most of its startup time pulling the image. When a lab is
+uploaded (or its image is changed) we ask the hub to pull the image onto
+every node ahead of time, and record the state of the pull on each node in
+ImagePullStatus. Until every node has the image, the lab is shown as
+"warming" on the dashboard.
+
+When there are several hub backends the image is pulled on every one of
+them, and nodes are recorded as "<backend>/<node>".
+
+Pulls are started in the background by a small worker pool of their own, so
+that waiting on a slow pull never ties up the workers that start labs (see
+labs.jobs). They can also be run ahead of a workshop with the prepull_images
+management command.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django import db
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from labs.hub import get_backends, get_client
+from labs.models import ImagePullStatus, LabEnvironment
+from labs.registry import pin_image
+
+logger = logging.getLogger("labs")
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# Map from the states reported by the hub to ImagePullStatus states
+HUB_STATES = {
+    "Pulling": ImagePullStatus.PULLING,
+    "Ready": ImagePullStatus.READY,
+    "Failed": ImagePullStatus.FAILED,
+}
+
+"""
+---------------------------------------------------
+Recording pull status
+---------------------------------------------------
+"""
+
+
+def record_pulls(lab: LabEnvironment, nodes):
+    """
+    Record the state of a lab's image pull on each node, as reported by the
+    hub.
+
+    Returns
+    ----------
+    bool
+        Whether or not the pull has finished (successfully or not) on every
+        node.
+    """
+    existing = {pull.node: pull for pull in lab.image_pulls.all()}
+    lab.image_pulls.exclude(node__in=list(nodes)).delete()
+
+    new, updated = [], []
+    for (node, hub_state) in nodes.items():
+        state = HUB_STATES.get(hub_state, ImagePullStatus.PULLING)
+        pull = existing.get(node)
+        if pull is None:
+            new.append(ImagePullStatus(lab=lab, node=node, image=lab.url, state=state))
+        elif (pull.state, pull.image) != (state, lab.url):
+            pull.state, pull.image = state, lab.url
+            updated.append(pull)
+
+    ImagePullStatus.objects.bulk_create(new)
+    ImagePullStatus.objects.bulk_update(updated, ["state", "image"])
+    return all(HUB_STATES.get(s) != ImagePullStatus.PULLING for s in nodes.values())
+
+
+def warming_labs():
+    """
+    Return the ids of all of the labs whose current images haven't yet been
+    pulled onto every node.
+    """
+    pulls = ImagePullStatus.objects.filter(
+        Q(state=ImagePullStatus.PULLING) | ~Q(image=F("lab__url"))
+    )
+    return set(pulls.values_list("lab_id", flat=True))
+
+
+"""
+---------------------------------------------------
+Pulling images
+---------------------------------------------------
+"""
+
+
+def node_states(clients, func):
+    """
+    Call func(client) for the HubClient of every hub backend, and merge the
+    dictionaries of node states that it returns.
+    """
+    if len(clients) == 1:
+        return func(next(iter(clients.values())))
+    return {
+        f"{name}/{node}": state
+        for (name, client) in clients.items()
+        for (node, state) in func(client).items()
+    }
+
+
+def run_prepull(lab_id, close_connection=False, pin=False):
+    """
+    Pull a lab's image onto every node, and wait (for up to
+    LAB_IMAGE_PULL_TIMEOUT seconds) for the pulls to finish.
+
+    Keyword parameters
+    ----------
+    close_connection (bool) (default = False)
+        Whether or not to close the thread's database connection once the
+        pull is finished. This should be True when the pull is run in a worker
+        thread.
+    pin (bool) (default = False)
+        Whether or not to pin the lab to its image's current digest (see
+        labs.registry) before pulling it.
+
+    Returns
+    ----------
+    bool
+        Whether or not the pulls finished before the timeout.
+    """
+    try:
+        lab = LabEnvironment.objects.get(id=lab_id)
+        if pin:
+            pin_image(lab)
+        clients = {b.name: get_client(b.name) for b in get_backends()}
+        deadline = time.monotonic() + settings.LAB_IMAGE_PULL_TIMEOUT
+
+        # Pull the image that pods will actually be created from, which is
+        # pinned to a digest if one has been resolved.
+        image = lab.pod_image()
+        logger.info(f"Pre-pulling image {image} for lab {lab.name!r}")
+        done = record_pulls(lab, node_states(clients, lambda h: h.pull_image(image)))
+        while not done and time.monotonic() < deadline:
+            time.sleep(settings.LAB_IMAGE_PULL_POLL_INTERVAL)
+            done = record_pulls(
+                lab, node_states(clients, lambda h: h.get_image_pulls(image))
+            )
+
+        if not done:
+            logger.warning(f"Timed out pre-pulling image {image}")
+        return done
+
+    except Exception as ex:
+        logger.exception(f"Error pre-pulling image for lab {lab_id}: {ex}")
+        lab_pulls = ImagePullStatus.objects.filter(
+            lab_id=lab_id, state=ImagePullStatus.PULLING
+        )
+        lab_pulls.update(state=ImagePullStatus.FAILED, error=str(ex)[:1000])
+        return False
+
+    finally:
+        if close_connection:
+            db.connection.close()
+
+
+def get_executor():
+    """
+    Return the ThreadPoolExecutor used to run image pulls in the current
+    process.
+    """
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.LAB_IMAGE_PULL_WORKERS,
+                thread_name_prefix="lab-prepull",
+            )
+            _executor_pid = os.getpid()
+
+    return _executor
+
+
+def start_prepull(lab: LabEnvironment, pin=False):
+    """
+    Start pre-pulling a lab's image in the background. If
+    LAB_IMAGE_PULL_WORKERS is zero, the image is pulled immediately in the
+    calling thread instead.
+
+    If pin is True, the lab is first pinned to its image's current digest.
+    This is done by the same worker, so that requests never wait on the
+    registry.
+
+    As with provisioning jobs, the pull is only handed to the workers once the
+    current transaction has been committed, so that they can see the lab and
+    don't pull an image that was never saved.
+    """
+    if settings.LAB_IMAGE_PULL_WORKERS <= 0:
+        run_prepull(lab.id, pin=pin)
+        return
+
+    transaction.on_commit(
+        lambda: get_executor().submit(
+            run_prepull, lab.id, close_connection=True, pin=pin
+        )
+    )
@@ -0,0 +1,233 @@
+"""
+Query plans for the hottest lookups on the Guacamole tables.
+
+Every request for a lab's status or deletion looks its connection up by name,
+the lab listing looks up a user's connections, and the idle lab reaper and
+the lifecycle records read the connection history. populate() fills the
+tables with a realistic number of labs, and explain_lookups() reports the
+database's query plan and the time taken by each of these lookups, so that
+the indexes they rely on can be checked at scale (see the explain_lookups
+management command).
+"""
+
+import statistics
+import time
+import uuid
+
+from datetime import timedelta
+from django.db import connection
+from django.db.models import Min
+from django.utils import timezone
+from guacamole.models import (
+    GuacamoleConnection,
+    GuacamoleConnectionHistory,
+    GuacamoleEntity,
+    GuacamoleUser,
+    GuacamoleUserHistory,
+)
+from labs.models import LabEnvironment, ProvisioningJob
+from labs.reaper import find_idle_labs
+from users.models import User
+
+# The last migrations before the indexes for these lookups were added
+MIGRATIONS_BEFORE_INDEXES = [
+    ("guacamole", "0006_connection_primary"),
+    ("labs", "0013_labservice"),
+]
+
+"""
+---------------------------------------------------
+Sample data
+---------------------------------------------------
+"""
+
+
+def populate(connections=100000, users=1000, batch_size=500, now=None):
+    """
+    Create a lab environment with a number of labs spread across a number of
+    users, along with a provisioning job and a finished session for every lab
+    and a few logins for every user.
+
+    Returns
+    ----------
+    dict
+        The lab environment, and the values to look up in explain_lookups().
+    """
+    now = now or timezone.now()
+    run_id = uuid.uuid4().hex[:6]
+    lab = LabEnvironment.objects.create(
+        name=f"qp-{run_id}",
+        description="Lab environment for query plans",
+        url=f"query-plans/{run_id}",
+        protocol="ssh",
+        port=22,
+        idle_timeout=60,
+    )
+
+    names = [f"qp-{run_id}-{ii}" for ii in range(users)]
+    User.objects.bulk_create(
+        [User(username=name, email=f"{name}@query-plans.invalid") for name in names],
+        batch_size=batch_size,
+    )
+    GuacamoleEntity.objects.bulk_create(
+        [GuacamoleEntity(name=name, type="USER") for name in names],
+        batch_size=batch_size,
+    )
+    entities = GuacamoleEntity.objects.filter(
+        name__startswith=f"qp-{run_id}-", type="USER"
+    )
+    GuacamoleUser.objects.bulk_create(
+        [GuacamoleUser(entity=entity, password_hash=b"") for entity in entities],
+        batch_size=batch_size,
+    )
+    user_ids = list(
+        User.objects.filter(username__startswith=f"qp-{run_id}-").values_list(
+            "id", flat=True
+        )
+    )
+    guac_user_ids = list(
+        GuacamoleUser.objects.filter(entity__in=entities).values_list(
+            "user_id", flat=True
+        )
+    )
+
+    # Labs were created over the past month, and each was used once
+    conns = [
+        GuacamoleConnection(
+            protocol="ssh",
+            lab=lab,
+            user_id=user_ids[ii % len(user_ids)],
+            date_created=now - timedelta(minutes=ii % (30 * 24 * 60)),
+        )
+        for ii in range(connections)
+    ]
+    GuacamoleConnection.objects.bulk_create(conns, batch_size=batch_size)
+    rows = list(
+        GuacamoleConnection.objects.filter(lab=lab).values_list(
+            "connection_id", "connection_name", "user_id", "date_created"
+        )
+    )
+    ProvisioningJob.objects.bulk_create(
+        [
+            ProvisioningJob(
+                connection_id=conn_id,
+                connection_name=name,
+                lab=lab,
+                user_id=user_id,
+                state=ProvisioningJob.SUCCEEDED,
+            )
+            for (conn_id, name, user_id, _) in rows
+        ],
+        batch_size=batch_size,
+    )
+    GuacamoleConnectionHistory.objects.bulk_create(
+        [
+            GuacamoleConnectionHistory(
+                connection_id=conn_id,
+                connection_name=name,
+                username="",
+                start_date=created + timedelta(minutes=1),
+                end_date=created + timedelta(minutes=30),
+            )
+            for (conn_id, name, _, created) in rows
+        ],
+        batch_size=batch_size,
+    )
+    GuacamoleUserHistory.objects.bulk_create(
+        [
+            GuacamoleUserHistory(
+                user_id=guac_user_id,
+                username="",
+                start_date=now - timedelta(days=day),
+                end_date=now - timedelta(days=day) + timedelta(hours=1),
+            )
+            for guac_user_id in guac_user_ids
+            for day in range(10)
+        ],
+        batch_size=batch_size,
+    )
+
+    (conn_id, conn_name, user_id, _) = rows[len(rows) // 2]
+    return {
+        "lab": lab,
+        "conn_id": conn_id,
+        "conn_name": conn_name,
+        "conn_names": [row[1] for row in rows[:100]],
+        "user_id": user_id,
+        "guac_user_id": guac_user_ids[len(guac_user_ids) // 2],
+        "now": now,
+    }
+
+
+"""
+---------------------------------------------------
+Lookups
+---------------------------------------------------
+"""
+
+
+def hot_lookups(sample):
+    """
+    Return a dictionary mapping a description of each of the hot lookups on
+    the Guacamole tables to the QuerySet for it, using the values returned by
+    populate().
+    """
+    return {
+        # DeleteLabView, PodStatusView, LabInfoView (by name), ...
+        "lab by name": GuacamoleConnection.objects.filter(
+            connection_name=sample["conn_name"], primary=None
+        ),
+        # LabInfoView
+        "labs of user": GuacamoleConnection.objects.filter(
+            user_id=sample["user_id"], primary=None
+        ),
+        # labs.bulk and labs.reconcile
+        "jobs by name": ProvisioningJob.objects.filter(
+            connection_name__in=sample["conn_names"]
+        ),
+        # labs.reaper
+        "idle labs": find_idle_labs(sample["lab"], sample["now"]),
+        "open sessions": GuacamoleConnectionHistory.objects.filter(
+            connection_id=sample["conn_id"], end_date__isnull=True
+        ),
+        # labs.lifecycle.sync_first_sessions
+        "first sessions": GuacamoleConnectionHistory.objects.filter(
+            connection_name__in=sample["conn_names"]
+        )
+        .values("connection_name")
+        .annotate(first=Min("start_date")),
+        # Guacamole's own history of a user's logins
+        "recent logins": GuacamoleUserHistory.objects.filter(
+            user_id=sample["guac_user_id"]
+        ).order_by("-start_date")[:10],
+    }
+
+
+def explain_lookups(sample, repeat=10):
+    """
+    Run each of the hot lookups repeat times, and ask the database for its
+    plan for each of them.
+
+    Returns
+    ----------
+    dict
+        A dictionary mapping the description of each lookup to its query plan
+        and the median time (in milliseconds) that it took.
+    """
+    report = {}
+    for (name, queryset) in hot_lookups(sample).items():
+        # The query is run directly, so that the time spent building model
+        # instances from its rows isn't counted
+        sql, params = queryset.query.sql_with_params()
+        times = []
+        with connection.cursor() as cursor:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                times.append(1000 * (time.perf_counter() - start))
+        report[name] = {
+            "plan": queryset.explain(),
+            "median_ms": round(statistics.median(times), 3),
+        }
+    return report
@@ -0,0 +1,87 @@
+"""
+Deletion of labs that nobody is using.
+
+Labs keep running until their owner deletes them, so forgotten labs take up
+cluster capacity that is needed by other users. A lab is considered idle once
+nobody has been connected to it (according to Guacamole's connection history)
+for longer than its lab environment's idle timeout. Labs that have never been
+connected to are idle once they are older than the timeout.
+
+Idle labs are deleted by reap_idle_labs(), which is run periodically by the
+reap_idle_labs management command.
+"""
+
+import logging
+
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from guacamole.models import GuacamoleConnection
+from labs.models import LabEnvironment
+from labs.teardown import teardown_labs
+
+logger = logging.getLogger("labs")
+
+
+def find_idle_labs(lab: LabEnvironment, now=None):
+    """
+    Return a QuerySet of the connections for a lab environment that have been
+    idle for longer than the lab's idle timeout.
+    """
+    timeout = lab.get_idle_timeout()
+    if timeout <= 0:
+        return GuacamoleConnection.objects.none()
+
+    now = now or timezone.now()
+    cutoff = now - timedelta(minutes=timeout)
+
+    return (
+        GuacamoleConnection.objects.filter(
+            lab=lab, primary=None, date_created__lt=cutoff
+        )
+        .annotate(
+            last_disconnect=Max("guacamoleconnectionhistory__end_date"),
+            open_sessions=Count(
+                "guacamoleconnectionhistory",
+                filter=Q(guacamoleconnectionhistory__end_date__isnull=True),
+            ),
+        )
+        .filter(open_sessions=0)
+        .filter(Q(last_disconnect__isnull=True) | Q(last_disconnect__lt=cutoff))
+    )
+
+
+def reap_idle_labs(now=None, batch_size=None, dry_run=False):
+    """
+    Delete every idle lab, in batches of batch_size labs (by default,
+    LAB_REAPER_BATCH_SIZE). The pods in each batch are deleted in parallel.
+
+    Returns
+    ----------
+    list of str
+        The connection names of the labs that were deleted (or that would have
+        been deleted, if dry_run is True).
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.LAB_REAPER_BATCH_SIZE
+
+    idle = []
+    for lab in LabEnvironment.objects.all():
+        conns = list(
+            find_idle_labs(lab, now).only(
+                "connection_name", "user_id", "lab_id", "hub_backend"
+            )
+        )
+        if conns:
+            logger.info(f"Found {len(conns)} idle labs for lab {lab.name!r}")
+        idle += conns
+
+    if dry_run:
+        return [conn.connection_name for conn in idle]
+
+    reaped = []
+    for ii in range(0, len(idle), batch_size):
+        results = teardown_labs(idle[ii : ii + batch_size])
+        reaped += [name for (name, ex) in results.items() if ex is None]
+    return reaped
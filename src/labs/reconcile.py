@@ -0,0 +1,322 @@
+"""
+Reconciliation of the Guacamole tables with the pods running on the hubs.
+
+The database and the hubs can drift apart: a pod can outlive its lab if the
+request to delete it was lost, and a lab can outlive its pods if they were
+evicted or a hub was rebuilt. reconcile_labs() lists every pod on each hub
+backend a page at a time, and diffs the pod names against the pods that the
+labs in the database expect to have:
+
+- pods that don't belong to any lab (or to the warm pool) are deleted, once
+  they've been checked again against the database just before deleting;
+- labs that are missing any of their pods are torn down, once they're older
+  than LAB_RECONCILE_GRACE_PERIOD and nothing is still creating their pods;
+- every user's n_active_labs is recomputed from the labs that remain.
+
+Both sides are repaired in batches, and reconcile_labs() is run periodically
+by the reconcile_labs management command.
+"""
+
+import logging
+import requests
+
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from guacamole.models import GuacamoleConnection
+from labs.hub import get_backends, get_client, run_concurrently
+from labs.models import ProvisioningJob, WarmPod
+from labs.teardown import delete_pod, teardown_labs
+from labs.topology import pods_from_rows
+from users.models import User
+
+logger = logging.getLogger("labs")
+
+"""
+---------------------------------------------------
+Diffing
+---------------------------------------------------
+"""
+
+
+def list_hub_pods(page_size=None):
+    """
+    Return a dictionary mapping the name of each hub backend that could be
+    reached to the set of names of the pods running on it. Backends that
+    couldn't be listed completely are left out, so that none of their labs
+    are mistaken for orphans.
+    """
+    page_size = page_size or settings.LAB_RECONCILE_PAGE_SIZE
+
+    pods = {}
+    for backend in get_backends():
+        try:
+            pods[backend.name] = {
+                pod["name"] for pod in get_client(backend.name).iter_pods(page_size)
+            }
+        except requests.RequestException as ex:
+            logger.error(f"Unable to list the pods on {backend.name!r}: {ex}")
+    return pods
+
+
+def expected_pods():
+    """
+    Return a dictionary mapping the name of each hub backend to a dictionary
+    from the connection name of each lab on that backend to the names of its
+    pods. Labs without a known backend are assigned to the default one.
+    """
+    backends = [backend.name for backend in get_backends()]
+    rows = GuacamoleConnection.objects.filter(primary=None).values_list(
+        "hub_backend", "connection_name", "members__connection_name"
+    )
+
+    by_backend = {name: [] for name in backends}
+    for (backend, conn_name, member) in rows:
+        backend = backend if backend in by_backend else backends[0]
+        by_backend[backend].append((conn_name, member))
+
+    return {name: pods_from_rows(rows) for (name, rows) in by_backend.items()}
+
+
+def diff_pods(hub_pods, labs, protected=()):
+    """
+    Diff the pods running on a hub against the pods that its labs expect.
+
+    Parameters
+    ----------
+    hub_pods (set of str)
+        Names of the pods running on the hub.
+    labs (dict)
+        A dictionary mapping the connection name of each lab on the hub to the
+        names of its pods, as returned by labs.topology.pods_from_rows.
+
+    Keyword parameters
+    ----------
+    protected (iterable of str) (default = ())
+        Names of pods that should be left alone even though they don't belong
+        to any lab (e.g. the pods in the warm pool).
+
+    Returns
+    ----------
+    (set of str, set of str)
+        The names of the orphaned pods, and the connection names of the labs
+        that are missing at least one of their pods.
+    """
+    expected = {name for pods in labs.values() for name in pods}
+    orphan_pods = hub_pods - expected - set(protected)
+    missing = expected - hub_pods
+    broken_labs = {
+        conn_name for (conn_name, pods) in labs.items() if not missing.isdisjoint(pods)
+    }
+    return orphan_pods, broken_labs
+
+
+"""
+---------------------------------------------------
+Repairs
+---------------------------------------------------
+"""
+
+
+def settled_labs(conn_names, now=None):
+    """
+    Return the subset of a group of labs whose pods should exist by now: labs
+    that are older than LAB_RECONCILE_GRACE_PERIOD, and that don't have a
+    provisioning job that is still pending or running.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.LAB_RECONCILE_GRACE_PERIOD)
+    conn_names = set(conn_names)
+    if not conn_names:
+        return set()
+
+    in_progress = ProvisioningJob.objects.filter(
+        connection_name__in=conn_names,
+        state__in=(ProvisioningJob.PENDING, ProvisioningJob.RUNNING),
+    ).values_list("connection_name", flat=True)
+    old = GuacamoleConnection.objects.filter(
+        connection_name__in=conn_names, date_created__lt=cutoff
+    ).values_list("connection_name", flat=True)
+    return set(old) - set(in_progress)
+
+
+def still_orphaned(pods):
+    """
+    Return the subset of a group of orphaned pods that still don't belong to
+    any lab or to the warm pool. Labs can be started (and warm pods claimed)
+    while the hubs are being listed, so this is checked again just before the
+    pods are deleted.
+
+    Parameters
+    ----------
+    pods (dict)
+        A dictionary mapping the name of each pod to the hub backend that it's
+        running on.
+    """
+    names = list(pods)
+    claimed = set(
+        GuacamoleConnection.objects.filter(connection_name__in=names).values_list(
+            "connection_name", flat=True
+        )
+    )
+    claimed |= set(
+        WarmPod.objects.filter(name__in=names).values_list("name", flat=True)
+    )
+    return {name: backend for (name, backend) in pods.items() if name not in claimed}
+
+
+def delete_orphan_pods(pods, batch_size=None):
+    """
+    Delete pods that don't belong to any lab, in batches of batch_size pods.
+
+    Parameters
+    ----------
+    pods (dict)
+        A dictionary mapping the name of each pod to the hub backend that it's
+        running on.
+
+    Returns
+    ----------
+    list of str
+        The names of the pods that were deleted.
+    """
+    batch_size = batch_size or settings.LAB_REAPER_BATCH_SIZE
+    names = sorted(pods)
+
+    deleted = []
+    for ii in range(0, len(names), batch_size):
+        results = run_concurrently(
+            lambda name: delete_pod(name, pods[name]),
+            names[ii : ii + batch_size],
+            settings.LAB_BULK_CONCURRENCY,
+        )
+        deleted += [name for (name, ex) in results.items() if ex is None]
+    return deleted
+
+
+def delete_broken_labs(conn_names, batch_size=None):
+    """
+    Tear down labs that are missing some of their pods, in batches of
+    batch_size labs. Whatever pods the labs still have are deleted with them.
+
+    Returns
+    ----------
+    list of str
+        The connection names of the labs that were deleted.
+    """
+    batch_size = batch_size or settings.LAB_REAPER_BATCH_SIZE
+    conns = list(
+        GuacamoleConnection.objects.filter(
+            connection_name__in=list(conn_names), primary=None
+        )
+        .only("connection_name", "user_id", "lab_id", "hub_backend")
+        .order_by("connection_name")
+    )
+
+    deleted = []
+    for ii in range(0, len(conns), batch_size):
+        results = teardown_labs(conns[ii : ii + batch_size])
+        deleted += [name for (name, ex) in results.items() if ex is None]
+    return deleted
+
+
+def active_lab_counts():
+    """
+    Return an expression for the number of labs that each user actually has,
+    to be used in a query over users.
+    """
+    labs_per_user = (
+        GuacamoleConnection.objects.filter(user=OuterRef("pk"), primary=None)
+        .order_by()
+        .values("user")
+        .annotate(n=Count("connection_id"))
+        .values("n")
+    )
+    return Coalesce(Subquery(labs_per_user, output_field=IntegerField()), 0)
+
+
+def recount_active_labs(dry_run=False):
+    """
+    Set n_active_labs to the number of labs that each user actually has, in a
+    single UPDATE statement.
+
+    Returns
+    ----------
+    int
+        The number of users whose count was wrong.
+    """
+    actual = active_lab_counts()
+    wrong = User.objects.exclude(n_active_labs=actual)
+    if dry_run:
+        return wrong.count()
+    return wrong.update(n_active_labs=actual)
+
+
+"""
+---------------------------------------------------
+Reconciliation
+---------------------------------------------------
+"""
+
+
+def reconcile_labs(now=None, batch_size=None, page_size=None, dry_run=False):
+    """
+    Bring the Guacamole tables and the pods on the hubs back in line with
+    each other.
+
+    Keyword parameters
+    ----------
+    now (datetime) (default = None)
+        The current time, used to apply the grace period for new labs.
+    batch_size (int) (default = None)
+        The number of pods or labs to delete in each batch. Defaults to
+        LAB_REAPER_BATCH_SIZE.
+    page_size (int) (default = None)
+        The number of pods to request from the hub at a time. Defaults to
+        LAB_RECONCILE_PAGE_SIZE.
+    dry_run (bool) (default = False)
+        If True, report what would be repaired without changing anything.
+
+    Returns
+    ----------
+    dict
+        The names of the orphaned pods and labs that were deleted (or that
+        would have been deleted), and the number of users whose active lab
+        count was corrected.
+    """
+    # The pods are listed before the database is read, so that any pod that
+    # is listed for a lab created in the meantime is still matched to it. The
+    # warm pool is read before the labs, since a pod that is claimed in
+    # between moves from the one to the other.
+    hub_pods = list_hub_pods(page_size)
+    warm_pods = set(WarmPod.objects.values_list("name", flat=True))
+    labs = expected_pods()
+
+    orphan_pods, broken_labs = {}, set()
+    for (backend, names) in hub_pods.items():
+        pods, broken = diff_pods(names, labs[backend], protected=warm_pods)
+        orphan_pods.update((name, backend) for name in pods)
+        broken_labs |= broken
+    orphan_pods = still_orphaned(orphan_pods)
+    broken_labs = settled_labs(broken_labs, now)
+
+    if orphan_pods or broken_labs:
+        logger.warning(
+            f"Found {len(orphan_pods)} orphaned pods and {len(broken_labs)} labs "
+            "with missing pods"
+        )
+
+    if dry_run:
+        return {
+            "orphan_pods": sorted(orphan_pods),
+            "orphan_labs": sorted(broken_labs),
+            "recounted_users": recount_active_labs(dry_run=True),
+        }
+
+    return {
+        "orphan_pods": delete_orphan_pods(orphan_pods, batch_size),
+        "orphan_labs": delete_broken_labs(broken_labs, batch_size),
+        "recounted_users": recount_active_labs(),
+    }
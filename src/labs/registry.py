@@ -0,0 +1,159 @@
+"""
+Resolving lab images to immutable digests.
+
+Lab images are usually given by tag (e.g. wshand/cutter:latest), and a tag
+can be moved to a new image at any time, so nodes may check the registry
+every time a pod is started. Instead, if LAB_PIN_IMAGE_DIGESTS is turned on,
+we look up the digest that the tag points to when a lab is uploaded (using
+the Docker Registry HTTP API v2), and create pods from that digest. Digests
+are resolved in the background, just before the image is pre-pulled (see
+labs.prepull), and can be refreshed from the admin interface.
+
+Failing to resolve a digest is never fatal: the lab simply keeps using its
+tag (or the digest that it was last pinned to).
+"""
+
+import logging
+import re
+import requests
+
+from django.conf import settings
+from django.utils import timezone
+from labs.models import LabEnvironment
+
+logger = logging.getLogger("labs")
+
+# Manifest types that we accept. Multi-architecture images are resolved to
+# the digest of their manifest list, which is what `docker pull` uses.
+MANIFEST_TYPES = ", ".join(
+    [
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.oci.image.manifest.v1+json",
+    ]
+)
+
+
+class RegistryError(Exception):
+    """
+    Raised when an image's digest can't be resolved.
+    """
+
+
+"""
+---------------------------------------------------
+Resolving digests
+---------------------------------------------------
+"""
+
+
+def parse_image(image):
+    """
+    Split an image reference into the base URL of its registry, its repository,
+    and its tag (or digest).
+
+    >>> parse_image("wshand/cutter:latest")
+    ('https://registry-1.docker.io', 'wshand/cutter', 'latest')
+    """
+    name, _, digest = image.partition("@")
+    parts = name.split("/")
+
+    # The first component of the name is a registry if it looks like a host
+    if len(parts) > 1 and re.search(r"[.:]|^localhost$", parts[0]):
+        registry = f"https://{parts[0]}"
+        path = "/".join(parts[1:])
+    else:
+        registry = settings.LAB_REGISTRY_URL.rstrip("/")
+        path = "/".join(parts)
+        if len(parts) == 1:
+            # Official images live under library/ on Docker Hub
+            path = f"library/{path}"
+
+    tag = "latest"
+    if ":" in path.rsplit("/", 1)[-1]:
+        path, tag = path.rsplit(":", 1)
+
+    return registry, path, digest or tag
+
+
+def get_token(challenge, repository):
+    """
+    Request an anonymous bearer token from a registry's token server, given
+    the WWW-Authenticate header that the registry responded with.
+    """
+    params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    realm = params.pop("realm", None)
+    if realm is None:
+        raise RegistryError(f"Unsupported authentication challenge {challenge!r}")
+    params.setdefault("scope", f"repository:{repository}:pull")
+
+    response = requests.get(realm, params=params, timeout=settings.LAB_REGISTRY_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    return data.get("token") or data.get("access_token")
+
+
+def resolve_digest(image):
+    """
+    Return the digest of the manifest that an image reference points to.
+    Raises RegistryError if the digest can't be resolved.
+    """
+    registry, repository, reference = parse_image(image)
+    if reference.startswith("sha256:"):
+        return reference
+
+    url = f"{registry}/v2/{repository}/manifests/{reference}"
+    headers = {"Accept": MANIFEST_TYPES}
+    timeout = settings.LAB_REGISTRY_TIMEOUT
+
+    try:
+        response = requests.head(url, headers=headers, timeout=timeout)
+        challenge = response.headers.get("WWW-Authenticate", "")
+        if response.status_code == 401 and challenge.lower().startswith("bearer"):
+            token = get_token(challenge, repository)
+            headers["Authorization"] = f"Bearer {token}"
+            response = requests.head(url, headers=headers, timeout=timeout)
+        response.raise_for_status()
+    except (requests.RequestException, ValueError) as ex:
+        raise RegistryError(f"Unable to resolve {image}: {ex}") from ex
+
+    digest = response.headers.get("Docker-Content-Digest")
+    if not digest:
+        raise RegistryError(f"Registry did not return a digest for {image}")
+    return digest
+
+
+"""
+---------------------------------------------------
+Pinning labs
+---------------------------------------------------
+"""
+
+
+def pin_image(lab: LabEnvironment):
+    """
+    Resolve the digest of a lab's image and save it on the lab. If
+    LAB_PIN_IMAGE_DIGESTS is disabled, any existing digest is cleared.
+
+    Returns
+    ----------
+    bool
+        Whether or not the lab's digest changed.
+    """
+    if not settings.LAB_PIN_IMAGE_DIGESTS:
+        digest = ""
+    else:
+        try:
+            digest = resolve_digest(lab.url)
+        except RegistryError as ex:
+            logger.warning(f"Keeping current image for lab {lab.name!r}: {ex}")
+            return False
+
+    changed = digest != lab.image_digest
+    lab.image_digest = digest
+    lab.date_digest_resolved = timezone.now() if digest else None
+    lab.save(update_fields=["image_digest", "date_digest_resolved"])
+    if changed:
+        logger.info(f"Pinned lab {lab.name!r} to {lab.pod_image()}")
+    return changed
@@ -0,0 +1,456 @@
+"""
+Cached access to the status of lab pods.
+
+Every open dashboard polls the status of each of its labs, so the same pod
+status is requested many times a second. Statuses are kept in Django's cache
+for LAB_POD_STATUS_CACHE_TTL seconds, and concurrent requests for a status
+that isn't cached share a single request to the hub.
+
+If LAB_POD_EVENTS is turned on, dashboards that support Server-Sent Events
+subscribe to pod_events() instead of polling, and receive an event whenever
+one of their labs becomes ready.
+
+While the hub is failing (e.g. because its circuit breaker is open; see
+labs.hub), dashboards are served the last status that we saw for each pod,
+marked with "stale": true, for up to LAB_POD_STATUS_STALE_TTL seconds.
+
+The status of a multi-machine lab (see labs.topology) combines the statuses
+of all of its pods, and the lab is only ready once all of them are.
+
+If LAB_POD_STATE_WATCH is enabled, statuses are instead read from the PodState
+table, which the watch_pods command keeps up to date (see labs.watch).
+
+The first time that a pod is seen to be ready is recorded in its LabLifecycle
+(see labs.lifecycle).
+"""
+
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from guacamole.models import GuacamoleConnection
+from labs.hub import get_client, is_hub_failure, run_concurrently
+from labs.lifecycle import record_ready
+from labs.models import PodState
+from labs.topology import pods_from_rows
+
+logger = logging.getLogger("labs")
+
+"""
+---------------------------------------------------
+Request coalescing
+---------------------------------------------------
+"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share the same key, so that only one of
+    them does any work and the rest wait for (and share) its result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Call func(), unless there's already a call in progress for the same key,
+        in which case we wait for that call to finish and return its result (or
+        raise its exception).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+_flight = SingleFlight()
+
+"""
+---------------------------------------------------
+Pod statuses
+---------------------------------------------------
+"""
+
+
+def cache_key(conn_name):
+    return f"labs:pod-status:{conn_name}"
+
+
+def stale_cache_key(conn_name):
+    return f"labs:pod-status:last:{conn_name}"
+
+
+def fetch_pod_status(conn_name, backend=None):
+    """
+    Retrieve the status of a pod from the hub backend that it's running on,
+    and store it in the cache.
+    """
+    return store_pod_status(conn_name, get_client(backend).get_pod(conn_name))
+
+
+def store_pod_status(conn_name, status):
+    """
+    Store a pod status retrieved from the hub in the cache, both as its
+    current status and as its last known status.
+    """
+    cache.set(cache_key(conn_name), status, settings.LAB_POD_STATUS_CACHE_TTL)
+    cache.set(stale_cache_key(conn_name), status, settings.LAB_POD_STATUS_STALE_TTL)
+    return status
+
+
+def stale_statuses(conn_names):
+    """
+    Return the last known statuses of a group of pods, for use while the hub
+    is failing. Each status is marked as stale.
+    """
+    keys = {stale_cache_key(name): name for name in conn_names}
+    return {
+        keys[key]: dict(status, stale=True)
+        for (key, status) in cache.get_many(keys).items()
+    }
+
+
+def local_pod_statuses(conn_names):
+    """
+    Return the statuses of a group of pods from the PodState table. Pods that
+    the hub hasn't told us about yet are reported without any conditions.
+    """
+    states = PodState.objects.in_bulk(list(conn_names))
+    return {
+        name: states[name].as_status()
+        if name in states
+        else {"phase": "", "conditions": []}
+        for name in conn_names
+    }
+
+
+def get_pod_status(conn_name, backend=None):
+    """
+    Return the status of a pod, either from the cache or from the hub.
+
+    Keyword parameters
+    ----------
+    backend (str) (default = None)
+        The hub backend that the pod is running on.
+    """
+    if settings.LAB_POD_STATE_WATCH:
+        return local_pod_statuses([conn_name])[conn_name]
+
+    status = cache.get(cache_key(conn_name))
+    if status is not None:
+        return status
+
+    try:
+        return _flight.do(conn_name, lambda: fetch_pod_status(conn_name, backend))
+    except Exception as ex:
+        last = stale_statuses([conn_name]) if is_hub_failure(ex) else {}
+        if conn_name not in last:
+            raise
+        logger.warning(f"Serving last known status of {conn_name}: {ex}")
+        return last[conn_name]
+
+
+def get_pod_statuses(conn_names, backends=None):
+    """
+    Return the statuses of many pods at once. Statuses are read from the cache
+    with a single lookup, and any that aren't cached are requested from the
+    hub concurrently.
+
+    Keyword parameters
+    ----------
+    backends (dict) (default = None)
+        A dictionary mapping connection names to the hub backends that their
+        pods are running on. Pods that aren't in the dictionary are looked up
+        on the default backend.
+
+    Returns
+    ----------
+    (dict, dict)
+        A dictionary mapping connection names to pod statuses, and a dictionary
+        mapping the names of any pods whose status couldn't be retrieved to
+        the exception that was raised.
+    """
+    if settings.LAB_POD_STATE_WATCH:
+        return local_pod_statuses(conn_names), {}
+
+    keys = {cache_key(name): name for name in conn_names}
+    statuses = {keys[key]: status for (key, status) in cache.get_many(keys).items()}
+
+    backends = backends or {}
+
+    def fetch(name):
+        statuses[name] = _flight.do(
+            name, lambda: fetch_pod_status(name, backends.get(name))
+        )
+
+    missing = [name for name in keys.values() if name not in statuses]
+    results = run_concurrently(fetch, missing, settings.LAB_BULK_CONCURRENCY)
+    errors = {name: ex for (name, ex) in results.items() if ex is not None}
+
+    # Fall back to the last known statuses of pods that the hub failed on
+    statuses.update(
+        stale_statuses(name for (name, ex) in errors.items() if is_hub_failure(ex))
+    )
+    errors = {name: ex for (name, ex) in errors.items() if name not in statuses}
+    return statuses, errors
+
+
+"""
+---------------------------------------------------
+Lab statuses
+---------------------------------------------------
+"""
+
+
+def lab_status(statuses):
+    """
+    Combine the statuses of all of the pods in a multi-machine lab into a
+    single status for the lab, which is ready once every pod is ready. The
+    statuses of the individual pods are included under "members".
+
+    Parameters
+    ----------
+    statuses (dict)
+        A dictionary mapping the name of each of the lab's pods to its status.
+    """
+    members = list(statuses.values())
+    ready = all(is_ready(status) for status in members)
+    phases = [status.get("phase") or "" for status in members]
+    status = {
+        "phase": next((p for p in phases if p != "Running"), "Running"),
+        "conditions": [{"type": "Ready", "status": "True" if ready else "False"}],
+        "members": statuses,
+    }
+    if any(s.get("stale") for s in members):
+        status["stale"] = True
+    return status
+
+
+def combine_lab_statuses(pods, statuses, errors):
+    """
+    Combine pod statuses into lab statuses.
+
+    Parameters
+    ----------
+    pods (dict)
+        A dictionary mapping the connection name of each lab to the names of
+        all of its pods (see labs.topology.lab_pods).
+    statuses (dict)
+        A dictionary mapping pod names to their statuses.
+    errors (dict)
+        A dictionary mapping the names of any pods whose statuses couldn't be
+        retrieved to the exception that was raised.
+
+    Returns
+    ----------
+    (dict, dict)
+        A dictionary mapping connection names to lab statuses, and a dictionary
+        mapping the connection names of any labs with a pod whose status
+        couldn't be retrieved to the exception that was raised for it.
+    """
+    lab_statuses, lab_errors = {}, {}
+    for (conn_name, names) in pods.items():
+        failed = [errors[name] for name in names if name in errors]
+        if failed:
+            lab_errors[conn_name] = failed[0]
+        elif all(name in statuses for name in names):
+            lab_statuses[conn_name] = (
+                statuses[conn_name]
+                if len(names) == 1
+                else lab_status({name: statuses[name] for name in names})
+            )
+    return lab_statuses, lab_errors
+
+
+def get_lab_statuses(pods, backends=None):
+    """
+    Return the statuses of many labs at once, in the same way as
+    get_pod_statuses(). Every pod of a multi-machine lab is looked up
+    concurrently, along with the pods of all of the other labs.
+
+    Parameters
+    ----------
+    pods (dict)
+        A dictionary mapping the connection name of each lab to the names of
+        all of its pods.
+
+    Keyword parameters
+    ----------
+    backends (dict) (default = None)
+        A dictionary mapping connection names to the hub backends that their
+        labs are running on.
+    """
+    backends = backends or {}
+    pod_backends = {
+        name: backends.get(conn_name)
+        for (conn_name, names) in pods.items()
+        for name in names
+    }
+    statuses, errors = get_pod_statuses(list(pod_backends), pod_backends)
+    return combine_lab_statuses(pods, statuses, errors)
+
+
+def get_lab_status(conn_name, pods, backend=None):
+    """
+    Return the status of a lab, given the names of all of its pods. Raises the
+    exception for the first pod whose status couldn't be retrieved.
+    """
+    if len(pods) == 1:
+        return get_pod_status(conn_name, backend)
+
+    statuses, errors = get_lab_statuses({conn_name: pods}, {conn_name: backend})
+    if conn_name in errors:
+        raise errors[conn_name]
+    return statuses[conn_name]
+
+
+def is_ready(status):
+    """
+    Return whether or not all of the conditions in a pod's status are true.
+    """
+    conditions = status.get("conditions") or []
+    return len(conditions) > 0 and all(c.get("status") == "True" for c in conditions)
+
+
+def observe_statuses(statuses):
+    """
+    Record the time at which each of the ready pods in a dictionary of pod
+    statuses was first seen to be ready.
+    """
+    record_ready(
+        name
+        for (name, status) in statuses.items()
+        if is_ready(status) and not status.get("stale")
+    )
+
+
+def poll_interval(status):
+    """
+    Return the number of seconds that clients should wait before checking a
+    pod's status again. Pods that are already ready are checked less often,
+    unless their status is stale.
+    """
+    if is_ready(status) and not status.get("stale"):
+        return settings.LAB_POD_STATUS_READY_POLL_INTERVAL
+    return settings.LAB_POD_STATUS_POLL_INTERVAL
+
+
+def batch_poll_interval(statuses, errors=None):
+    """
+    Return the number of seconds that clients should wait before checking the
+    statuses of a group of pods again.
+    """
+    if errors or not statuses:
+        return settings.LAB_POD_STATUS_POLL_INTERVAL
+    return min(poll_interval(status) for status in statuses.values())
+
+
+"""
+---------------------------------------------------
+Readiness event stream
+---------------------------------------------------
+"""
+
+
+def format_event(event, data):
+    """
+    Format a Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def pod_events(user, max_duration=None):
+    """
+    Generate a stream of Server-Sent Events reporting the readiness of all of a
+    user's labs. A "status" event is sent for every lab when the stream starts,
+    and again whenever a lab's readiness changes; a "deleted" event is sent
+    when a lab goes away.
+
+    The stream ends after max_duration seconds (by default,
+    LAB_POD_EVENTS_MAX_DURATION), after which the client is expected to
+    reconnect.
+    """
+    if max_duration is None:
+        max_duration = settings.LAB_POD_EVENTS_MAX_DURATION
+    deadline = time.monotonic() + max_duration
+
+    # Tell the client how long to wait before reconnecting
+    yield f"retry: {int(1000 * settings.LAB_POD_STATUS_POLL_INTERVAL)}\n\n"
+
+    last_ready = {}
+    while True:
+        rows = list(
+            GuacamoleConnection.objects.filter(user=user, primary=None).values_list(
+                "connection_name", "hub_backend", "members__connection_name"
+            )
+        )
+        backends = {name: backend for (name, backend, _) in rows}
+        names = list(backends)
+
+        pods = pods_from_rows((name, member) for (name, _, member) in rows)
+        statuses, errors = get_lab_statuses(pods, backends)
+        for (name, ex) in errors.items():
+            logger.error(f"Unable to get status of {name}: {ex}")
+
+        observe_statuses(
+            {name: s for (name, s) in statuses.items() if not last_ready.get(name)}
+        )
+        interval = batch_poll_interval(statuses, errors)
+        for name in names:
+            if name not in statuses:
+                continue
+
+            status = statuses[name]
+            ready = is_ready(status)
+            if last_ready.get(name) != ready:
+                last_ready[name] = ready
+                yield format_event(
+                    "status",
+                    {
+                        "conn_name": name,
+                        "ready": ready,
+                        "conditions": status.get("conditions", []),
+                    },
+                )
+
+        for name in set(last_ready) - set(names):
+            del last_ready[name]
+            yield format_event("deleted", {"conn_name": name})
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        # Send a comment to keep proxies from closing an idle connection
+        yield ": keep-alive\n\n"
+        time.sleep(min(interval, remaining))
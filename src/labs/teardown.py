@@ -0,0 +1,121 @@
+"""
+Deleting labs in bulk.
+
+teardown_labs() is shared by everything that deletes more than one lab at a
+time (e.g. the idle lab reaper). Pods are deleted through the hub in parallel,
+and the Guacamole rows for the labs whose pods were deleted are then removed
+in a single transaction, along with their owners' active lab counts.
+"""
+
+import logging
+import requests
+
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from guacamole.models import GuacamoleConnection
+from labs.hub import get_client, run_concurrently
+from labs.lifecycle import record_deleted
+from labs.topology import delete_groups, lab_pods
+from users.models import User
+
+logger = logging.getLogger("labs")
+
+
+def delete_pod(name, backend=None):
+    """
+    Delete a pod through the hub backend that it's running on. Pods that no
+    longer exist are treated as having been deleted successfully.
+    """
+    try:
+        get_client(backend).delete_pod(name)
+    except requests.HTTPError as ex:
+        if ex.response is None or ex.response.status_code != 404:
+            raise
+
+
+def decrement_active_labs(counts):
+    """
+    Decrement the number of active labs of a group of users, without letting
+    any count drop below zero.
+
+    Parameters
+    ----------
+    counts (dict)
+        A dictionary mapping user ids to the number of labs that were deleted
+        for that user.
+    """
+    # Users that lost the same number of labs are updated together
+    by_count = defaultdict(list)
+    for (user_id, n) in counts.items():
+        by_count[n].append(user_id)
+
+    for (n, user_ids) in by_count.items():
+        User.objects.filter(id__in=user_ids).update(
+            n_active_labs=Case(
+                When(n_active_labs__gt=n, then=F("n_active_labs") - n),
+                default=Value(0),
+            )
+        )
+
+
+def teardown_labs(conns, max_workers=None):
+    """
+    Delete a group of labs: first their pods, and then the Guacamole rows
+    for every lab whose pods were all successfully deleted. Labs with pods
+    that couldn't be deleted are left in place so that they can be retried
+    later.
+
+    Parameters
+    ----------
+    conns (iterable of GuacamoleConnection)
+        The connections for the labs that should be deleted.
+
+    Keyword parameters
+    ----------
+    max_workers (int) (default = None)
+        The maximum number of pod deletion requests to send to the hub at
+        once. Defaults to LAB_BULK_CONCURRENCY.
+
+    Returns
+    ----------
+    dict
+        A dictionary mapping the connection name of each lab to the exception
+        that was raised while deleting its pod, or to None if the lab was
+        deleted.
+    """
+    conns = list(conns)
+    max_workers = max_workers or settings.LAB_BULK_CONCURRENCY
+
+    # Every pod of a multi-machine lab is deleted alongside the others
+    pods = lab_pods(conns)
+    backends = {
+        name: conn.hub_backend for conn in conns for name in pods[conn.connection_name]
+    }
+    pod_results = run_concurrently(
+        lambda name: delete_pod(name, backends[name]), list(backends), max_workers
+    )
+    results = {
+        conn_name: next(
+            (pod_results[n] for n in names if pod_results[n] is not None), None
+        )
+        for (conn_name, names) in pods.items()
+    }
+
+    deleted = [conn for conn in conns if results[conn.connection_name] is None]
+    with transaction.atomic():
+        record_deleted(conn.connection_name for conn in deleted)
+        # The connections to the labs' other machines are deleted with them
+        GuacamoleConnection.objects.filter(
+            connection_id__in=[conn.connection_id for conn in deleted]
+        ).delete()
+        decrement_active_labs(Counter(conn.user_id for conn in deleted))
+        groups = [
+            c.connection_name for c in deleted if len(pods[c.connection_name]) > 1
+        ]
+        if groups:
+            delete_groups(groups)
+
+    logger.info(f"Deleted {len(deleted)} of {len(conns)} labs")
+    return results
@@ -0,0 +1,115 @@
+"""
+Tests for admission control and the fair-share queue.
+"""
+
+from django.test import tag, override_settings
+from django.urls import reverse
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs.admission import admit_waiting, queue_position, request_admission
+from labs.models import AdmissionTicket, LabEnvironment, LabLease
+from labs.tests.test_views import hub_response
+from lawliet.test_utils import UnitTest, random_docker_image, create_random_user
+from users.models import User
+
+"""
+---------------------------------------------------
+Admission control tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "admission")
+@override_settings(
+    LAB_CLUSTER_CPU=1000, LAB_CLUSTER_MEMORY=0, LAB_PROVISIONING_WORKERS=0,
+)
+@mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+class AdmissionTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+            cpu_request=500,
+        )
+        self.url = f"{reverse('lab_api.generate')}?create={self.lab.id}"
+
+    def new_user(self):
+        return User.objects.create_user(*create_random_user(self.rd))
+
+    def test_requests_are_queued_when_full(self, request):
+        for _ in range(2):
+            self.assertIn("job_id", self.client.post(self.url).json())
+
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        self.assertEqual(data["state"], AdmissionTicket.WAITING)
+        self.assertEqual(data["position"], 1)
+        self.assertEqual(GuacamoleConnection.objects.count(), 2)
+
+        # Asking again shouldn't create a second ticket
+        self.assertEqual(
+            self.client.post(self.url).json()["ticket_id"], data["ticket_id"]
+        )
+        self.assertEqual(AdmissionTicket.objects.count(), 1)
+
+        # The ETA is the time at which the first lease expires
+        lease = LabLease.objects.order_by("expires_at").first()
+        self.assertEqual(data["eta"], lease.expires_at.isoformat())
+
+    def test_fair_share_order(self, request):
+        busy, idle = self.new_user(), self.new_user()
+        busy.n_active_labs = 2
+        busy.save()
+        GuacamoleConnection.objects.create(protocol="ssh", lab=self.lab, user=busy)
+        GuacamoleConnection.objects.create(protocol="ssh", lab=self.lab, user=busy)
+
+        first = request_admission(self.lab, busy)
+        second = request_admission(self.lab, idle)
+        self.assertEqual(queue_position(second), 1)
+        self.assertEqual(queue_position(first), 2)
+
+        # Once a lab is deleted, the user with fewer labs is admitted first
+        GuacamoleConnection.objects.filter(user=busy).first().delete()
+        admitted = admit_waiting()
+        self.assertEqual([t.id for t in admitted], [second.id])
+        self.assertTrue(GuacamoleConnection.objects.filter(user=idle).exists())
+
+        second.refresh_from_db()
+        self.assertEqual(second.state, AdmissionTicket.ADMITTED)
+        self.assertEqual(
+            second.job.connection_name,
+            GuacamoleConnection.objects.get(user=idle).connection_name,
+        )
+
+    @override_settings(LAB_MAX_LABS_PER_USER=1, LAB_CLUSTER_CPU=0)
+    def test_user_quota(self, request):
+        self.assertEqual(self.client.post(self.url).status_code, 202)
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
+
+    def test_ticket_view(self, request):
+        GuacamoleConnection.objects.create(protocol="ssh", lab=self.lab, user=self.user)
+        GuacamoleConnection.objects.create(protocol="ssh", lab=self.lab, user=self.user)
+        ticket_id = self.client.post(self.url).json()["ticket_id"]
+
+        url = f"{reverse('lab_api.queue')}?id={ticket_id}"
+        self.assertEqual(self.client.get(url).json()["position"], 1)
+
+        GuacamoleConnection.objects.first().delete()
+        admit_waiting()
+        data = self.client.get(url).json()
+        self.assertEqual(data["state"], AdmissionTicket.ADMITTED)
+        self.assertIn("conn_name", data)
+
+        self.client.force_login(self.new_user())
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(
+            self.client.get(f"{reverse('lab_api.queue')}?id=bad").status_code, 422
+        )
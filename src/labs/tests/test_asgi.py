@@ -0,0 +1,205 @@
+"""
+Tests for the native async handling of the pod status endpoints under ASGI.
+"""
+
+import json
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.test import tag, override_settings
+from django.urls import reverse
+
+from guacamole.models import GuacamoleConnection
+from labs.asgi import PodStatusApp, close_async_clients
+from labs.fakehub import start_fake_hub
+from labs.hub import get_client, reset_client
+from labs.loadtest import BENCHMARK_HOST
+from labs.models import LabEnvironment
+from labs.status import cache_key, store_pod_status
+from labs.tests.test_hub import trip
+from lawliet.test_utils import UnitTest, random_docker_image
+from users.models import User
+
+"""
+---------------------------------------------------
+Helpers
+---------------------------------------------------
+"""
+
+
+class StubApp:
+    """
+    ASGI application that records the requests passed on to it.
+    """
+
+    def __init__(self):
+        self.paths = []
+
+    async def __call__(self, scope, receive, send):
+        self.paths.append(scope["path"])
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def asgi_request(app, path, query_string="", cookie="", method="GET"):
+    """
+    Send a request to an ASGI application, and return the status code,
+    headers, and body of its response.
+    """
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query_string.encode("latin-1"),
+        "headers": [
+            (b"host", BENCHMARK_HOST.encode("latin-1")),
+            (b"cookie", cookie.encode("latin-1")),
+        ],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        try:
+            await app(scope, receive, send)
+        finally:
+            await close_async_clients()
+
+    async_to_sync(run)()
+    start, body = messages
+    headers = {k.decode(): v.decode() for (k, v) in start["headers"]}
+    return start["status"], headers, body["body"]
+
+
+"""
+---------------------------------------------------
+Pod status application tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "asgi")
+class PodStatusAppTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        cache.clear()
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=self.user
+        )
+        self.name = self.conn.connection_name
+
+        self.server = start_fake_hub()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(reset_client)
+        overrides = override_settings(HUB_API_HOST=self.server.url)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_client()
+
+        self.server.hub.create_pod(self.name, {})
+        self.stub = StubApp()
+        # Queries are run in the test's thread, so they see its transaction
+        self.app = PodStatusApp(self.stub, thread_sensitive=True)
+        cookie_name = settings.SESSION_COOKIE_NAME
+        self.cookie = f"{cookie_name}={self.client.cookies[cookie_name].value}"
+
+        self.url = reverse("lab_api.pod.pod_status")
+        self.batch_url = reverse("lab_api.pod.pod_status_batch")
+
+    def get(self, path, query_string="", cookie=None):
+        cookie = self.cookie if cookie is None else cookie
+        return asgi_request(self.app, path, query_string, cookie)
+
+    def test_pod_status(self):
+        status, headers, body = self.get(self.url, f"id={self.name}")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["name"], self.name)
+        self.assertIn("retry-after", headers)
+        self.assertFalse(self.stub.paths)
+
+        # The status is cached, as it is by PodStatusView
+        self.assertEqual(cache.get(cache_key(self.name))["name"], self.name)
+        self.assertEqual(get_client().latency_report()["GET /pods/<name>"]["count"], 1)
+
+    def test_invalid_requests(self):
+        status, _, _ = self.get(self.url)
+        self.assertEqual(status, 422)
+        status, _, _ = self.get(self.url, "id=nonexistent")
+        self.assertEqual(status, 422)
+
+        other = User.objects.create_user(
+            username="meepy-other", email="other@colorado.edu", password=self.password
+        )
+        conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=other
+        )
+        status, _, _ = self.get(self.url, f"id={conn.connection_name}")
+        self.assertEqual(status, 403)
+
+        # Pods that the hub doesn't know about are reported as a bad gateway
+        self.server.hub.delete_pod(self.name)
+        status, _, _ = self.get(self.url, f"id={self.name}")
+        self.assertEqual(status, 502)
+
+    def test_login_required(self):
+        status, headers, _ = self.get(self.url, f"id={self.name}", cookie="")
+        self.assertEqual(status, 302)
+        # The same redirect as the one sent by PodStatusView
+        self.client.logout()
+        response = self.client.get(f"{self.url}?id={self.name}")
+        self.assertEqual(headers["location"], response["Location"])
+
+    def test_invalid_host(self):
+        with override_settings(ALLOWED_HOSTS=["lawliet.invalid"]):
+            status, _, _ = self.get(self.url, f"id={self.name}")
+        self.assertEqual(status, 400)
+
+    def test_batch_status(self):
+        status, headers, body = self.get(
+            self.batch_url, f"id={self.name}&id=nonexistent"
+        )
+        self.assertEqual(status, 200)
+        statuses = json.loads(body)["statuses"]
+        self.assertEqual(statuses[self.name]["name"], self.name)
+        self.assertIn("error", statuses["nonexistent"])
+        self.assertIn("retry-after", headers)
+
+        # Without any ids, every one of the user's labs is returned
+        status, _, body = self.get(self.batch_url)
+        self.assertEqual(list(json.loads(body)["statuses"]), [self.name])
+
+    def test_stale_status(self):
+        store_pod_status(self.name, {"name": self.name, "phase": "Running"})
+        cache.delete(cache_key(self.name))
+        trip(get_client().breaker)
+
+        status, _, body = self.get(self.url, f"id={self.name}")
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)["stale"])
+
+        # Without a last known status, the hub is reported as unavailable
+        conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=self.user
+        )
+        status, headers, _ = self.get(self.url, f"id={conn.connection_name}")
+        self.assertEqual(status, 503)
+        self.assertGreaterEqual(int(headers["retry-after"]), 1)
+
+    def test_other_requests_are_passed_on(self):
+        self.get(reverse("lab_api.generate"))
+        asgi_request(self.app, self.url, f"id={self.name}", self.cookie, "POST")
+        self.assertEqual(self.stub.paths, [reverse("lab_api.generate"), self.url])
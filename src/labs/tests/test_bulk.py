@@ -0,0 +1,198 @@
+"""
+Tests for bulk lab provisioning.
+"""
+
+import json
+
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.test import tag, override_settings
+from django.urls import reverse
+from io import StringIO
+from unittest import mock
+
+from guacamole.models import (
+    GuacamoleConnection,
+    GuacamoleConnectionParameter,
+    GuacamoleConnectionPermission,
+)
+from labs.bulk import provision_labs
+from labs.hub import get_client, reset_client
+from labs.models import AdmissionTicket, LabEnvironment, ProvisioningJob
+from labs.tests.test_hub import trip
+from labs.tests.test_views import hub_response
+from lawliet.test_utils import UnitTest, random_docker_image, create_random_user
+from users.models import User
+
+"""
+---------------------------------------------------
+Bulk provisioning tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "bulk")
+class BulkProvisioningTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.students = [
+            User.objects.create_user(*create_random_user(self.rd)) for _ in range(5)
+        ]
+        self.usernames = [student.username for student in self.students]
+        self.ids = [student.id for student in self.students]
+        self.url = reverse("lab_api.bulk_generate")
+        self.addCleanup(reset_client)
+
+    def post(self, data):
+        return self.client.post(
+            self.url, json.dumps(data), content_type="application/json"
+        )
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_provision_labs(self, request):
+        report = provision_labs(self.lab, self.students, max_workers=2)
+
+        self.assertEqual(len(report), 5)
+        self.assertTrue(all(result["status"] == "created" for result in report))
+        self.assertEqual(request.call_count, 5)
+
+        self.assertEqual(GuacamoleConnection.objects.count(), 5)
+        self.assertEqual(GuacamoleConnectionParameter.objects.count(), 10)
+        self.assertEqual(GuacamoleConnectionPermission.objects.count(), 5)
+        self.assertEqual(
+            ProvisioningJob.objects.filter(state=ProvisioningJob.SUCCEEDED).count(), 5
+        )
+        for student in User.objects.filter(username__in=self.usernames):
+            self.assertEqual(student.n_active_labs, 1)
+            conn = GuacamoleConnection.objects.get(user=student)
+            perm = GuacamoleConnectionPermission.objects.get(connection=conn)
+            self.assertEqual(perm.entity.name, student.username)
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_failures_are_reported(self, request):
+        request.side_effect = [hub_response(status=500), hub_response(), hub_response()]
+        report = provision_labs(self.lab, self.students[:2])
+
+        statuses = sorted(result["status"] for result in report)
+        self.assertEqual(statuses, ["created", "failed"])
+        failed = [result for result in report if result["status"] == "failed"][0]
+        self.assertIn("500", failed["error"])
+
+        job = ProvisioningJob.objects.get(connection_name=failed["conn_name"])
+        self.assertEqual(job.state, ProvisioningJob.FAILED)
+
+        # The failed lab is released, as it would be by the provisioning queue
+        self.assertEqual(request.call_args_list[-1][0][0], "DELETE")
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
+        failed_user = User.objects.get(username=failed["username"])
+        self.assertEqual(failed_user.n_active_labs, 0)
+
+    @override_settings(LAB_MAX_LABS_PER_USER=1, LAB_CLUSTER_CPU=1000)
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_admission(self, request):
+        self.lab.cpu_request = 300
+        self.lab.save()
+        User.objects.filter(id=self.students[0].id).update(n_active_labs=1)
+
+        # The first student is over their quota, and only three of the other
+        # labs fit in the cluster
+        report = provision_labs(self.lab, User.objects.filter(id__in=self.ids))
+        statuses = {result["username"]: result["status"] for result in report}
+        self.assertEqual(statuses[self.usernames[0]], "failed")
+        self.assertEqual(
+            sorted(statuses.values()), ["created"] * 3 + ["failed", "queued"]
+        )
+        self.assertEqual(GuacamoleConnection.objects.count(), 3)
+        self.assertEqual(
+            AdmissionTicket.objects.filter(state=AdmissionTicket.WAITING).count(), 1
+        )
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_hub_unavailable(self, request):
+        self.user.is_staff = True
+        self.user.save()
+        trip(get_client().breaker)
+
+        response = self.post({"lab": str(self.lab.id), "usernames": self.usernames})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(GuacamoleConnection.objects.exists())
+        request.assert_not_called()
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_bulk_endpoint_restricted_to_staff(self, request):
+        response = self.post({"lab": str(self.lab.id), "usernames": self.usernames})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(GuacamoleConnection.objects.exists())
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_bulk_endpoint(self, request):
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.post(
+            {"lab": str(self.lab.id), "usernames": self.usernames + ["nobody"]}
+        )
+        self.assertEqual(response.status_code, 200)
+        results = {r["username"]: r for r in response.json()["results"]}
+        self.assertEqual(results["nobody"]["status"], "failed")
+        for username in self.usernames:
+            self.assertEqual(results[username]["status"], "created")
+
+    @override_settings(LAB_BULK_CONCURRENCY=8)
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_bulk_endpoint_validation(self, request):
+        self.user.is_staff = True
+        self.user.save()
+
+        lab = str(self.lab.id)
+        for body in (
+            [lab],
+            {"lab": lab, "usernames": self.usernames[0]},
+            {"lab": lab, "usernames": [1, 2]},
+            {"lab": lab, "group": ["CSCI 4830"]},
+            {"lab": lab, "usernames": self.usernames, "concurrency": "4"},
+            {"lab": lab, "usernames": self.usernames, "concurrency": 0},
+            {"lab": lab, "usernames": self.usernames, "concurrency": 9},
+            {"lab": lab, "usernames": self.usernames, "concurrency": True},
+        ):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+        response = self.client.post(self.url, "{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(GuacamoleConnection.objects.exists())
+
+        response = self.post({"lab": [lab], "usernames": self.usernames})
+        self.assertEqual(response.status_code, 422)
+
+        response = self.post(
+            {"lab": lab, "usernames": self.usernames, "concurrency": 8}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_bulk_endpoint_with_group(self, request):
+        self.user.is_staff = True
+        self.user.save()
+        group = Group.objects.create(name="CSCI 4830")
+        group.user_set.add(*self.students[:3])
+
+        response = self.post({"lab": str(self.lab.id), "group": "CSCI 4830"})
+        self.assertEqual(len(response.json()["results"]), 3)
+        self.assertEqual(GuacamoleConnection.objects.count(), 3)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_management_command(self, request):
+        out = StringIO()
+        call_command(
+            "provision_labs", self.lab.name, "--users", *self.usernames, stdout=out
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(len(report), 5)
+        self.assertEqual(GuacamoleConnection.objects.count(), 5)
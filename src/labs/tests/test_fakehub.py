@@ -0,0 +1,158 @@
+"""
+Tests for the fake hub API server.
+"""
+
+import json
+import requests
+import time
+
+from django.test import tag, override_settings
+from django.urls import reverse
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs import fakehub
+from labs.fakehub import start_fake_hub
+from labs.hub import HubClient
+from labs.models import LabEnvironment
+from labs.status import is_ready
+from lawliet.test_utils import UnitTest, random_docker_image
+
+"""
+---------------------------------------------------
+Fake hub tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "fake-hub")
+class FakeHubTestCase(UnitTest):
+    def start(self, **options):
+        server = start_fake_hub(**options)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return (
+            server,
+            HubClient(server.url, connect_timeout=1, read_timeout=5, pool_size=4),
+        )
+
+    def test_pod_lifecycle(self):
+        server, client = self.start(ready_delay=0.2)
+        client.create_pod("lawliet-env-test", image="cutter", ports=[22])
+
+        status = client.get_pod("lawliet-env-test")
+        self.assertEqual(status["phase"], "Pending")
+        self.assertFalse(is_ready(status))
+
+        time.sleep(0.3)
+        status = client.get_pod("lawliet-env-test")
+        self.assertEqual(status["phase"], "Running")
+        self.assertTrue(is_ready(status))
+
+        client.delete_pod("lawliet-env-test")
+        with self.assertRaises(requests.HTTPError) as cm:
+            client.get_pod("lawliet-env-test")
+        self.assertEqual(cm.exception.response.status_code, 404)
+
+    def test_duplicate_pods(self):
+        server, client = self.start()
+        client.create_pod("lawliet-env-test", image="cutter", ports=[22])
+        with self.assertRaises(requests.HTTPError) as cm:
+            client.create_pod("lawliet-env-test", image="cutter", ports=[22])
+        self.assertEqual(cm.exception.response.status_code, 409)
+
+    def test_failure_rate(self):
+        server, client = self.start(failure_rate=1)
+        with self.assertRaises(requests.HTTPError) as cm:
+            client.create_pod("lawliet-env-test", image="cutter", ports=[22])
+        self.assertEqual(cm.exception.response.status_code, 500)
+        self.assertEqual(server.hub.pods, {})
+
+    def test_latency(self):
+        server, client = self.start(latency=0.1, seed=0)
+        start = time.monotonic()
+        client.create_pod("lawliet-env-test", image="cutter", ports=[22])
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_list_and_watch(self):
+        server, client = self.start(ready_delay=0.3)
+        client.create_pod("lawliet-env-a", image="cutter", ports=[22])
+        items, resource_version = client.list_pods()
+        self.assertEqual([pod["name"] for pod in items], ["lawliet-env-a"])
+
+        client.create_pod("lawliet-env-b", image="cutter", ports=[22])
+        events = []
+        for line in client.watch_pods(resource_version):
+            if line:
+                events.append(json.loads(line))
+            if len(events) == 3:
+                break
+
+        # b is added, and then a and b become ready (in either order)
+        self.assertEqual(events[0]["type"], "ADDED")
+        self.assertEqual(events[0]["object"]["name"], "lawliet-env-b")
+        self.assertEqual({e["type"] for e in events[1:]}, {"MODIFIED"})
+        self.assertTrue(all(is_ready(e["object"]) for e in events[1:]))
+
+    def test_list_pages(self):
+        server, client = self.start()
+        names = [f"lawliet-env-{ii}" for ii in range(5)]
+        for name in reversed(names):
+            client.create_pod(name, image="cutter", ports=[22])
+
+        # Pods are returned in order of their names, two at a time
+        with mock.patch.object(client, "request", wraps=client.request) as request:
+            pods = list(client.iter_pods(page_size=2))
+        self.assertEqual([pod["name"] for pod in pods], names)
+        self.assertEqual(request.call_count, 3)
+
+    def test_image_pulls(self):
+        server, client = self.start(nodes=["node-a", "node-b"])
+        self.assertEqual(
+            client.get_image_pulls("cutter"), {"node-a": "Pulling", "node-b": "Pulling"}
+        )
+        client.pull_image("cutter")
+        self.assertEqual(
+            client.get_image_pulls("cutter"), {"node-a": "Ready", "node-b": "Ready"}
+        )
+
+
+@tag("labs", "fake-hub", "views")
+@override_settings(HUB_API_FAKE=True, LAB_PROVISIONING_WORKERS=0)
+class FakeHubViewsTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+
+    @mock.patch("labs.fakehub._server", None)
+    @mock.patch("labs.hub._clients", {})
+    def test_views_use_fake_hub(self):
+        response = self.client.post(
+            f"{reverse('lab_api.generate')}?create={self.lab.id}"
+        )
+        self.assertEqual(response.status_code, 202)
+        conn_name = response.json()["conn_name"]
+
+        # The fake hub should have been started by the first request to the hub
+        server = fakehub._server
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.assertIn(conn_name, server.hub.pods)
+        self.assertEqual(
+            server.hub.pods[conn_name]["spec"]["image"], self.lab.pod_image()
+        )
+
+        response = self.client.get(
+            f"{reverse('lab_api.pod.pod_status')}?id={conn_name}"
+        )
+        self.assertTrue(is_ready(response.json()))
+
+        self.client.post(f"{reverse('lab_api.delete')}?id={conn_name}")
+        self.assertEqual(server.hub.pods, {})
+        self.assertFalse(GuacamoleConnection.objects.exists())
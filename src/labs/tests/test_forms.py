@@ -57,3 +57,31 @@ class LabUploadFormTestCase(UnitTest):
         lab = LabEnvironment.objects.get(name=self.lab_name)
         self.assertEqual(lab.description, self.lab_description)
         self.assertEqual(lab.url, self.lab_url)
+
+    def test_resource_fields(self):
+        """
+        Resource requests and limits should default to the model's defaults,
+        and limits must be at least as large as requests.
+        """
+        data = {
+            "name": self.lab_name,
+            "description": self.lab_description,
+            "url": self.lab_url,
+            "protocol": "ssh",
+            "category": "Reverse engineering",
+        }
+        form = LabUploadForm(data)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["cpu_request"], 500)
+        self.assertEqual(form.cleaned_data["memory_limit"], 1024)
+
+        form = LabUploadForm({**data, "cpu_request": 2000, "cpu_limit": 1000})
+        self.assertFalse(form.is_valid())
+        self.assertIn("cpu_limit", form.errors)
+
+        form = LabUploadForm({**data, "memory_request": 2048, "memory_limit": 4096})
+        self.assertTrue(form.is_valid())
+        lab = LabEnvironment.objects.create(**form.cleaned_data)
+        self.assertEqual(
+            lab.resources()["limits"], {"cpu": "1000m", "memory": "4096Mi"}
+        )
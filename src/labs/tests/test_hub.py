@@ -0,0 +1,351 @@
+"""
+Tests for the Lawliet Hub client.
+"""
+
+import random
+import requests
+import time
+
+from django.core.cache import cache
+from django.test import tag, override_settings
+from django.urls import reverse
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs.hub import (
+    CircuitBreaker,
+    HubBackend,
+    HubClient,
+    HubUnavailable,
+    choose_backend,
+    get_backend,
+    get_client,
+    reset_client,
+)
+from labs.models import LabEnvironment, ProvisioningJob
+from labs.status import cache_key
+from labs.tests.test_status import READY
+from labs.tests.test_views import hub_response
+from lawliet.test_utils import UnitTest, random_docker_image
+
+"""
+---------------------------------------------------
+HubClient tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "hub")
+class HubClientTestCase(UnitTest):
+    def setUp(self):
+        super().setUp()
+        self.hub = HubClient(
+            "http://hub.test/", connect_timeout=1, read_timeout=5, pool_size=4
+        )
+
+    def test_connection_pool_is_shared(self):
+        adapter = self.hub.session.get_adapter("http://hub.test/pods/a")
+        self.assertIs(adapter, self.hub.session.get_adapter("https://hub.test"))
+        self.assertEqual(adapter._pool_maxsize, 4)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_requests_use_timeouts(self, request):
+        self.hub.create_pod("lawliet-env-a", image="meepy/lab", ports=[22])
+        request.assert_called_once_with(
+            "PUT",
+            "http://hub.test/pods/lawliet-env-a",
+            json={"image": "meepy/lab", "ports": [22]},
+            timeout=(1, 5),
+        )
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_latency_report(self, request):
+        request.side_effect = [
+            hub_response(data={"conditions": []}),
+            hub_response(data={"conditions": []}),
+            requests.Timeout("timed out"),
+        ]
+        self.hub.get_pod("lawliet-env-a")
+        self.hub.get_pod("lawliet-env-b")
+        with self.assertRaises(requests.Timeout):
+            self.hub.delete_pod("lawliet-env-a")
+
+        report = self.hub.latency_report()
+        self.assertEqual(set(report), {"GET /pods/<name>", "DELETE /pods/<name>"})
+        self.assertEqual(report["GET /pods/<name>"]["count"], 2)
+        self.assertEqual(report["GET /pods/<name>"]["errors"], 0)
+        self.assertEqual(report["DELETE /pods/<name>"]["errors"], 1)
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_error_status_codes_raise(self, request):
+        request.return_value = hub_response(status=500)
+        with self.assertRaises(requests.HTTPError):
+            self.hub.get_pod("lawliet-env-a")
+
+    def test_get_client_is_reused(self):
+        self.assertIs(get_client(), get_client())
+
+
+"""
+---------------------------------------------------
+Hub backend tests
+---------------------------------------------------
+"""
+
+BACKENDS = [
+    {"name": "east", "url": "http://hub-east.test", "weight": 1, "capacity": 10},
+    {"name": "west", "url": "http://hub-west.test", "weight": 1},
+]
+
+
+def trip(breaker):
+    """
+    Open a circuit breaker, as though the hub had just failed.
+    """
+    breaker.opened_at = time.monotonic()
+
+
+@tag("labs", "hub")
+class CircuitBreakerTestCase(UnitTest):
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker(failure_threshold=2, retry_interval=60)
+        self.hub = HubClient(
+            "http://hub.test",
+            connect_timeout=1,
+            read_timeout=5,
+            pool_size=4,
+            breaker=self.breaker,
+        )
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_failures_open_breaker(self, request):
+        # Client errors don't trip the breaker
+        request.return_value = hub_response(status=404)
+        for _ in range(3):
+            with self.assertRaises(requests.HTTPError):
+                self.hub.get_pod("lawliet-env-a")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        request.side_effect = requests.ConnectionError("refused")
+        with self.assertRaises(requests.ConnectionError):
+            self.hub.get_pod("lawliet-env-a")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        with self.assertRaises(requests.ConnectionError):
+            self.hub.get_pod("lawliet-env-a")
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.healthy)
+        self.assertEqual(request.call_count, 5)
+
+        # Requests fail fast while the breaker is open
+        with self.assertRaises(HubUnavailable):
+            self.hub.get_pod("lawliet-env-a")
+        self.assertEqual(request.call_count, 5)
+        self.assertEqual(self.hub.latency_report()["GET /pods/<name>"]["errors"], 6)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_half_open_probe(self, request):
+        self.breaker.retry_interval = 0
+        trip(self.breaker)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+        # Only one probe is let through at a time
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+        # A successful probe closes the breaker
+        self.breaker.record(failed=False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.hub.get_pod("lawliet-env-a")
+        request.assert_called_once()
+
+    def test_failed_probe_reopens_breaker(self):
+        self.breaker.retry_interval = 0.05
+        trip(self.breaker)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertGreater(self.breaker.retry_after(), 0)
+
+        time.sleep(0.05)
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record(failed=True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+
+@tag("labs", "hub")
+class ChooseBackendTestCase(UnitTest):
+    def setUp(self):
+        super().setUp()
+        self.east = HubBackend("east", "http://hub-east.test", weight=3, capacity=10)
+        self.west = HubBackend("west", "http://hub-west.test", weight=1)
+        self.backends = [self.east, self.west]
+
+    def choices(self, loads, n=1000):
+        rng = random.Random(0)
+        names = [choose_backend(self.backends, loads, rng).name for _ in range(n)]
+        return names.count("east") / n
+
+    def test_weights(self):
+        self.assertAlmostEqual(self.choices({}), 0.75, delta=0.05)
+
+    def test_free_capacity_scales_weight(self):
+        # East has half of its capacity free, so its weight is halved
+        self.assertAlmostEqual(self.choices({"east": 5}), 0.6, delta=0.05)
+
+    def test_full_backends_are_skipped(self):
+        self.assertEqual(self.choices({"east": 10}), 0)
+
+    def test_unhealthy_backends_are_skipped(self):
+        trip(self.west.breaker)
+        self.assertEqual(self.choices({}), 1)
+
+        # Unhealthy backends with room are preferred to full ones
+        trip(self.east.breaker)
+        self.assertEqual(self.choices({"east": 10}), 0)
+
+        # If every backend is unavailable, we still have to choose one
+        self.assertTrue(0 < self.choices({}) < 1)
+
+
+@tag("labs", "hub", "views")
+@override_settings(HUB_API_BACKENDS=BACKENDS, LAB_PROVISIONING_WORKERS=0)
+class HubBackendRoutingTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.addCleanup(reset_client)
+
+    def urls(self, request):
+        return [call[0][1] for call in request.call_args_list]
+
+    def test_default_backend(self):
+        self.assertEqual(get_backend().name, "east")
+        self.assertEqual(get_backend("").name, "east")
+        self.assertEqual(get_backend("west").name, "west")
+        self.assertEqual(get_client("west").host, "http://hub-west.test")
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_requests_go_to_lab_backend(self, request):
+        trip(get_backend("east").breaker)
+        response = self.client.post(
+            f"{reverse('lab_api.generate')}?create={self.lab.id}"
+        )
+        conn_name = response.json()["conn_name"]
+        conn = GuacamoleConnection.objects.get(connection_name=conn_name)
+        self.assertEqual(conn.hub_backend, "west")
+
+        self.client.get(f"{reverse('lab_api.pod.pod_status')}?id={conn_name}")
+        self.client.get(f"{reverse('lab_api.pod.pod_status_batch')}?id={conn_name}")
+        self.client.post(f"{reverse('lab_api.delete')}?id={conn_name}")
+        self.assertTrue(
+            all(url.startswith("http://hub-west.test/") for url in self.urls(request))
+        )
+        self.assertEqual(len(self.urls(request)), 3)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_hub_stats(self, request):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.post(f"{reverse('lab_api.generate')}?create={self.lab.id}")
+
+        response = self.client.get(reverse("lab_api.hub.stats"))
+        backends = response.json()["backends"]
+        self.assertEqual(set(backends), {"east", "west"})
+        self.assertEqual(backends["east"]["capacity"], 10)
+        self.assertEqual(sum(b["n_labs"] for b in backends.values()), 1)
+        self.assertTrue(all(b["healthy"] for b in backends.values()))
+
+
+"""
+---------------------------------------------------
+Hub outage tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "hub", "views")
+@override_settings(LAB_PROVISIONING_WORKERS=0)
+class HubOutageTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        cache.clear()
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=self.user
+        )
+        self.name = self.conn.connection_name
+        self.status_url = f"{reverse('lab_api.pod.pod_status')}?id={self.name}"
+        self.batch_url = reverse("lab_api.pod.pod_status_batch")
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_last_known_status(self, request):
+        request.return_value = hub_response(data=READY)
+        self.assertEqual(self.client.get(self.status_url).json(), READY)
+
+        # Once the status expires from the cache, the last known status is
+        # served while the hub is down
+        cache.delete(cache_key(self.name))
+        request.side_effect = requests.ConnectionError("refused")
+        response = self.client.get(self.status_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), dict(READY, stale=True))
+
+        response = self.client.get(self.batch_url)
+        self.assertEqual(
+            response.json()["statuses"][self.name], dict(READY, stale=True)
+        )
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_no_known_status(self, request):
+        request.side_effect = requests.Timeout("timed out")
+        response = self.client.get(self.status_url)
+        self.assertEqual(response.status_code, 503)
+        self.assertTrue(response.has_header("Retry-After"))
+
+        statuses = self.client.get(self.batch_url).json()["statuses"]
+        self.assertIn("error", statuses[self.name])
+
+        # Errors from the hub about the pod itself aren't outages
+        request.side_effect = None
+        request.return_value = hub_response(status=404)
+        self.assertEqual(self.client.get(self.status_url).status_code, 502)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_open_breaker_fails_fast(self, request):
+        trip(get_backend().breaker)
+
+        response = self.client.get(self.status_url)
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+        response = self.client.post(
+            f"{reverse('lab_api.generate')}?create={self.lab.id}"
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
+        self.assertFalse(ProvisioningJob.objects.exists())
+        request.assert_not_called()
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_idempotency_keys_are_retried(self, request):
+        url = f"{reverse('lab_api.generate')}?create={self.lab.id}"
+        trip(get_backend().breaker)
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertEqual(response.status_code, 503)
+
+        # The 503 isn't replayed once the hub is back
+        reset_client()
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
@@ -0,0 +1,158 @@
+"""
+Tests for idempotency keys on the lab generation and deletion endpoints.
+"""
+
+import datetime
+
+from django.test import tag, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs.idempotency import purge_expired_keys
+from labs.models import IdempotencyKey, LabEnvironment
+from labs.tests.test_views import hub_response
+from lawliet.test_utils import UnitTest, random_docker_image
+from users.models import User
+
+"""
+---------------------------------------------------
+Idempotency key tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "idempotency")
+@override_settings(LAB_PROVISIONING_WORKERS=0)
+class IdempotencyKeyTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.url = f"{reverse('lab_api.generate')}?create={self.lab.id}"
+
+    def post(self, url, key):
+        return self.client.post(url, HTTP_IDEMPOTENCY_KEY=key)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_repeated_generate(self, request):
+        first = self.post(self.url, "key-1")
+        second = self.post(self.url, "key-1")
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertFalse(first.has_header("Idempotent-Replayed"))
+
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 1)
+        request.assert_called_once()
+
+        # A new key starts a new lab
+        self.post(self.url, "key-2")
+        self.assertEqual(GuacamoleConnection.objects.count(), 2)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_requests_without_keys(self, request):
+        self.client.post(self.url)
+        self.client.post(self.url)
+        self.assertEqual(GuacamoleConnection.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_repeated_delete(self, request):
+        conn_name = self.client.post(self.url).json()["conn_name"]
+        url = f"{reverse('lab_api.delete')}?id={conn_name}"
+
+        first = self.post(url, "delete-1")
+        second = self.post(url, "delete-1")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["n_deleted"], 1)
+        self.assertFalse(GuacamoleConnection.objects.exists())
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 0)
+
+        methods = [call[0][0] for call in request.call_args_list]
+        self.assertEqual(methods.count("DELETE"), 1)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_key_reused_for_different_request(self, request):
+        self.post(self.url, "key-1")
+        other = LabEnvironment.objects.create(
+            name="Ghidra",
+            description="Ghidra lab environment",
+            url=random_docker_image(self.rd),
+            protocol="vnc",
+            port=5901,
+        )
+        response = self.post(
+            f"{reverse('lab_api.generate')}?create={other.id}", "key-1"
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
+
+    def test_request_in_progress(self):
+        IdempotencyKey.objects.create(
+            user=self.user, key="key-1", request=f"POST {self.url}"
+        )
+        response = self.post(self.url, "key-1")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertFalse(GuacamoleConnection.objects.exists())
+
+    @override_settings(LAB_IDEMPOTENCY_CLAIM_TIMEOUT=60)
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_abandoned_requests(self, request):
+        # The request that claimed the key never finished (e.g. because its
+        # worker was killed), so the key can be claimed again
+        IdempotencyKey.objects.create(
+            user=self.user,
+            key="key-1",
+            request=f"POST {self.url}",
+            date_created=timezone.now() - datetime.timedelta(minutes=2),
+        )
+        response = self.post(self.url, "key-1")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 202)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_keys_are_per_user(self, request):
+        self.post(self.url, "key-1")
+        other = User.objects.create_user(
+            username="meepy-other", email="other@colorado.edu", password=self.password
+        )
+        self.client.force_login(other)
+        response = self.post(self.url, "key-1")
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+        self.assertEqual(GuacamoleConnection.objects.count(), 2)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_expired_keys(self, request):
+        self.post(self.url, "key-1")
+        IdempotencyKey.objects.update(
+            date_created=timezone.now() - datetime.timedelta(days=2)
+        )
+
+        # Expired keys are treated as new
+        response = self.post(self.url, "key-1")
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+        self.assertEqual(GuacamoleConnection.objects.count(), 2)
+
+        IdempotencyKey.objects.update(
+            date_created=timezone.now() - datetime.timedelta(days=2)
+        )
+        self.assertEqual(purge_expired_keys(), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_key_too_long(self):
+        response = self.post(self.url, "k" * 65)
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(IdempotencyKey.objects.exists())
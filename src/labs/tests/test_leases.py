@@ -0,0 +1,147 @@
+"""
+Tests for lab leases.
+"""
+
+import datetime
+
+from django.core.management import call_command
+from django.test import tag, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from io import StringIO
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs.leases import expire_leases, extend_lease, new_lease, next_expiry
+from labs.models import LabEnvironment, LabLease
+from labs.tests.test_views import hub_response
+from lawliet.test_utils import UnitTest, random_docker_image
+from users.models import User
+
+NOW = timezone.make_aware(datetime.datetime(2020, 4, 29, 12))
+
+"""
+---------------------------------------------------
+Lease tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "leases")
+@override_settings(
+    LAB_LEASE_DURATION=60,
+    LAB_LEASE_EXTENSION=30,
+    LAB_LEASE_MAX_DURATION=120,
+    LAB_PROVISIONING_WORKERS=0,
+)
+class LeaseTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+
+    def create_lab(self, created, user=None):
+        conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=user or self.user
+        )
+        lease = new_lease(conn, now=created)
+        lease.save()
+        return lease
+
+    def test_extend_lease(self):
+        lease = self.create_lab(NOW)
+        self.assertEqual(lease.expires_at, NOW + datetime.timedelta(minutes=60))
+
+        self.assertTrue(extend_lease(lease, now=NOW))
+        self.assertEqual(lease.expires_at, NOW + datetime.timedelta(minutes=90))
+
+        # Leases can't be extended past the maximum lifetime of a lab
+        self.assertTrue(extend_lease(lease, now=NOW))
+        self.assertEqual(lease.expires_at, NOW + datetime.timedelta(minutes=120))
+        self.assertFalse(extend_lease(lease, now=NOW))
+        self.assertEqual(LabLease.objects.get().extensions, 2)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_expire_leases(self, request):
+        leases = [
+            self.create_lab(NOW - datetime.timedelta(minutes=age))
+            for age in (90, 70, 30)
+        ]
+        self.user.n_active_labs = 3
+        self.user.save()
+
+        expired = expire_leases(now=NOW, batch_size=1)
+        self.assertEqual(
+            expired, [lease.connection.connection_name for lease in leases[:2]]
+        )
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(LabLease.objects.get().id, leases[2].id)
+        self.assertEqual(next_expiry(now=NOW), leases[2].expires_at)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.n_active_labs, 1)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_management_command(self, request):
+        self.create_lab(timezone.now() - datetime.timedelta(minutes=90))
+        out = StringIO()
+        call_command("expire_leases", "--once", stdout=out)
+        self.assertEqual(len(out.getvalue().split()), 1)
+        self.assertFalse(GuacamoleConnection.objects.exists())
+
+    @override_settings(LAB_LEASE_RETRY_DELAY=5, LAB_LEASE_CHECK_INTERVAL=60)
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response(500))
+    def test_failed_teardowns_back_off(self, request):
+        self.create_lab(timezone.now() - datetime.timedelta(minutes=90))
+        self.create_lab(timezone.now())
+
+        # The lab that couldn't be deleted is retried with a growing delay,
+        # rather than waiting on the other lab's lease or retrying right away
+        with mock.patch(
+            "labs.management.commands.expire_leases.time.sleep",
+            side_effect=[None, None, None, StopIteration],
+        ) as sleep:
+            with self.assertRaises(StopIteration):
+                call_command("expire_leases", stdout=StringIO())
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [5, 10, 20, 40])
+        self.assertEqual(GuacamoleConnection.objects.count(), 2)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_generate_lab_creates_lease(self, request):
+        response = self.client.post(
+            f"{reverse('lab_api.generate')}?create={self.lab.id}"
+        )
+        self.assertEqual(response.status_code, 202)
+        lease = LabLease.objects.get(connection__user=self.user)
+        self.assertEqual(response.json()["expires_at"], lease.expires_at.isoformat())
+
+        info = self.client.get(reverse("lab_api.info")).json()
+        self.assertEqual(info[0]["expires_at"], lease.expires_at.isoformat())
+
+    def test_extend_lease_view(self):
+        lease = self.create_lab(timezone.now())
+        url = f"{reverse('lab_api.lease.extend')}?id={lease.connection.connection_name}"
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        lease.refresh_from_db()
+        self.assertEqual(response.json()["expires_at"], lease.expires_at.isoformat())
+
+        self.client.post(url)
+        self.assertEqual(self.client.post(url).status_code, 409)
+
+    def test_extend_other_users_lease(self):
+        other = User.objects.create_user(
+            username="meepy-other", email="other@colorado.edu", password=self.password
+        )
+        lease = self.create_lab(timezone.now(), user=other)
+        url = f"{reverse('lab_api.lease.extend')}?id={lease.connection.connection_name}"
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.assertEqual(
+            self.client.post(f"{reverse('lab_api.lease.extend')}?id=nope").status_code,
+            422,
+        )
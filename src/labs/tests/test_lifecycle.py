@@ -0,0 +1,227 @@
+"""
+Tests for lab lifecycle timestamps and startup latency statistics.
+"""
+
+import datetime
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import tag, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection, GuacamoleConnectionHistory
+from labs.lifecycle import (
+    latency_report,
+    percentile,
+    record_ready,
+    record_requested,
+    summarize,
+)
+from labs.models import LabEnvironment, LabLifecycle
+from labs.tests.test_views import hub_response
+from lawliet.test_utils import UnitTest, random_docker_image
+
+READY = {"conditions": [{"type": "Ready", "status": "True"}]}
+NOT_READY = {"conditions": [{"type": "Ready", "status": "False"}]}
+
+"""
+---------------------------------------------------
+Latency statistics tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "lifecycle")
+class LatencyStatisticsTestCase(UnitTest):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        summary = summarize([0.5, 3, 4, 45, 1000])
+        self.assertEqual(summary["count"], 5)
+        self.assertEqual(summary["p50"], 4)
+        self.assertEqual(summary["p99"], 1000)
+        self.assertEqual(summary["histogram"]["le_1"], 1)
+        self.assertEqual(summary["histogram"]["le_5"], 2)
+        self.assertEqual(summary["histogram"]["le_60"], 1)
+        self.assertEqual(summary["histogram"]["gt_600"], 1)
+
+
+"""
+---------------------------------------------------
+Lifecycle recording tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "lifecycle")
+@override_settings(LAB_PROVISIONING_WORKERS=0)
+class LabLifecycleTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        cache.clear()
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+
+    def generate_lab(self):
+        response = self.client.post(
+            f"{reverse('lab_api.generate')}?create={self.lab.id}"
+        )
+        self.assertEqual(response.status_code, 202)
+        return response.json()["conn_name"]
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_lifecycle_is_recorded(self, request):
+        request.return_value = hub_response()
+        conn_name = self.generate_lab()
+        lifecycle = LabLifecycle.objects.get(connection_name=conn_name)
+        self.assertEqual(lifecycle.lab, self.lab)
+        self.assertIsNotNone(lifecycle.pod_created_at)
+        self.assertIsNone(lifecycle.ready_at)
+
+        # The lab is only marked as ready once a status check sees it ready
+        url = f"{reverse('lab_api.pod.pod_status')}?id={conn_name}"
+        request.return_value = hub_response(data=NOT_READY)
+        self.client.get(url)
+        lifecycle.refresh_from_db()
+        self.assertIsNone(lifecycle.ready_at)
+
+        cache.clear()
+        request.return_value = hub_response(data=READY)
+        self.client.get(url)
+        lifecycle.refresh_from_db()
+        ready_at = lifecycle.ready_at
+        self.assertIsNotNone(ready_at)
+
+        # Later status checks shouldn't move the time at which it became ready
+        cache.clear()
+        self.client.get(url)
+        lifecycle.refresh_from_db()
+        self.assertEqual(lifecycle.ready_at, ready_at)
+
+        # The user's first session has to be copied out of the connection
+        # history before the connection (and its history) is deleted.
+        conn = GuacamoleConnection.objects.get(connection_name=conn_name)
+        session_start = timezone.now()
+        GuacamoleConnectionHistory.objects.create(
+            connection=conn,
+            connection_name=conn_name,
+            username=self.user.username,
+            start_date=session_start,
+        )
+        request.return_value = hub_response()
+        self.client.post(f"{reverse('lab_api.delete')}?id={conn_name}")
+        lifecycle.refresh_from_db()
+        self.assertEqual(lifecycle.first_session_at, session_start)
+        self.assertIsNotNone(lifecycle.deleted_at)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_batch_status_records_ready(self, request):
+        names = [self.generate_lab() for _ in range(2)]
+        request.return_value = hub_response(data=READY)
+        self.client.get(reverse("lab_api.pod.pod_status_batch"))
+        self.assertEqual(
+            LabLifecycle.objects.filter(
+                connection_name__in=names, ready_at__isnull=False
+            ).count(),
+            2,
+        )
+
+    def test_ready_is_only_written_once(self):
+        conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=self.user
+        )
+        record_requested([conn])
+        with self.assertNumQueries(1):
+            record_ready([conn.connection_name])
+
+        # Ready labs keep being polled, but they're only written once
+        with self.assertNumQueries(0):
+            record_ready([conn.connection_name])
+
+    def test_sync_lifecycles(self):
+        conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=self.user
+        )
+        record_requested([conn])
+        session_start = timezone.now()
+        GuacamoleConnectionHistory.objects.create(
+            connection=conn,
+            connection_name=conn.connection_name,
+            username=self.user.username,
+            start_date=session_start,
+        )
+
+        # Reports don't read the connection history themselves
+        report = latency_report()[self.lab.name]
+        self.assertEqual(report["first_session"]["count"], 0)
+
+        call_command("sync_lifecycles", "--once")
+        report = latency_report()[self.lab.name]
+        self.assertEqual(report["first_session"]["count"], 1)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response(500))
+    def test_failed_pod_creation(self, request):
+        with self.settings(LAB_PROVISIONING_RETRY_DELAY=0):
+            conn_name = self.generate_lab()
+        lifecycle = LabLifecycle.objects.get(connection_name=conn_name)
+        self.assertIsNone(lifecycle.pod_created_at)
+
+    def test_latency_report(self):
+        now = timezone.now()
+        conns = [
+            GuacamoleConnection.objects.create(
+                protocol="ssh", lab=self.lab, user=self.user
+            )
+            for _ in range(4)
+        ]
+        record_requested(conns, now=now)
+        for (i, conn) in enumerate(conns):
+            LabLifecycle.objects.filter(connection_name=conn.connection_name).update(
+                pod_created_at=now + datetime.timedelta(seconds=1),
+                ready_at=now + datetime.timedelta(seconds=10 * (i + 1)),
+            )
+
+        # Labs requested outside of the window aren't included
+        old = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=self.user
+        )
+        record_requested([old], now=now - datetime.timedelta(days=30))
+
+        report = latency_report(days=14)[self.lab.name]
+        self.assertEqual(report["pod_created"]["count"], 4)
+        self.assertEqual(report["pod_created"]["p50"], 1)
+        self.assertEqual(report["ready"]["p50"], 20)
+        self.assertEqual(report["ready"]["p95"], 40)
+        self.assertEqual(report["first_session"]["count"], 0)
+
+    def test_metrics_endpoint(self):
+        url = reverse("lab_api.metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=self.user
+        )
+        record_requested([conn])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.lab.name, response.json()["labs"])
+        self.assertEqual(self.client.get(f"{url}?days=x").status_code, 422)
+        for days in ("inf", "nan", "-1", "0", "1e12"):
+            with self.subTest(days=days):
+                response = self.client.get(f"{url}?days={days}")
+                self.assertEqual(response.status_code, 422)
@@ -0,0 +1,163 @@
+"""
+Tests for the lab provisioning load test.
+"""
+
+from django.core.management import call_command
+from django.test import tag, override_settings
+from io import StringIO
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection, GuacamoleEntity
+from labs.fakehub import start_fake_hub
+from labs.hub import get_backends, get_client, reset_client
+from labs.loadtest import LabLoadTest, RequestStats
+from labs.models import LabEnvironment
+from lawliet.test_utils import UnitTest, random_docker_image
+from users.models import User
+
+"""
+---------------------------------------------------
+Load test tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "load-test")
+@override_settings(LAB_PROVISIONING_WORKERS=0)
+class LabLoadTestTestCase(UnitTest):
+    def setUp(self):
+        super().setUp()
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+
+        server = start_fake_hub()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(reset_client)
+        overrides = override_settings(HUB_API_HOST=server.url)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_client()
+
+    def test_request_stats(self):
+        stats = RequestStats()
+        for (elapsed, n_queries) in [(0.1, 4), (0.2, 6), (0.3, 8), (0.4, 6)]:
+            stats.record(elapsed, n_queries, error=False)
+        stats.record(1.0, 2, error=True)
+
+        report = stats.as_dict(duration=10)
+        self.assertEqual(report["count"], 5)
+        self.assertEqual(report["errors"], 1)
+        self.assertEqual(report["throughput"], 0.5)
+        self.assertEqual(report["p50_ms"], 300)
+        self.assertEqual(report["p99_ms"], 1000)
+        self.assertEqual(report["mean_queries"], 5.2)
+        self.assertEqual(report["max_queries"], 8)
+
+    def test_simulated_user(self):
+        test = LabLoadTest(self.lab, n_users=2, cycles=2, think_time=0, seed=0)
+        test.create_users()
+        self.assertEqual(
+            GuacamoleEntity.objects.filter(
+                name__in=[user.username for user in test.users]
+            ).count(),
+            2,
+        )
+
+        # Users are simulated in their own threads by run(); here we run one in
+        # the test's thread, so that it can see the test's transaction.
+        test.simulate_user(test.users[0], delay=0)
+        self.assertEqual(test.stats["generate"].as_dict(1)["count"], 2)
+        self.assertEqual(test.stats["delete"].as_dict(1)["count"], 2)
+        self.assertGreaterEqual(test.stats["pod/status"].as_dict(1)["count"], 2)
+        self.assertEqual(sum(stats.errors for stats in test.stats.values()), 0)
+        self.assertGreater(test.stats["generate"].as_dict(1)["max_queries"], 0)
+        self.assertEqual(len(test.ready_times), 2)
+        self.assertFalse(GuacamoleConnection.objects.exists())
+
+        test.delete_users()
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(GuacamoleEntity.objects.exists())
+
+
+@tag("labs", "load-test")
+@override_settings(
+    HUB_API_BACKENDS=[
+        {"name": "cluster-a", "url": "http://cluster-a.invalid"},
+        {"name": "cluster-b", "url": "http://cluster-b.invalid"},
+    ]
+)
+class LoadTestCommandsTestCase(UnitTest):
+    def setUp(self):
+        super().setUp()
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.addCleanup(reset_client)
+
+        # Keep track of the fake hubs started by the commands
+        self.servers = []
+
+        def start(**options):
+            server = start_fake_hub(**options)
+            self.servers.append(server)
+            return server
+
+        patcher = mock.patch(
+            "labs.management.commands.loadtest_labs.start_fake_hub", side_effect=start
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch(
+            "labs.management.commands.benchmark_status.start_fake_hub",
+            side_effect=start,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_load_test_uses_fake_hub(self):
+        hosts = []
+
+        def run():
+            hosts.extend(backend.url for backend in get_backends())
+            get_client().create_pod("probe", image=self.lab.pod_image(), ports=[22])
+            return {}
+
+        with mock.patch("labs.loadtest.LabLoadTest.run", side_effect=run):
+            call_command("loadtest_labs", self.lab.name, stdout=StringIO())
+
+        (server,) = self.servers
+        self.assertEqual(hosts, [server.url])
+        self.assertIn("probe", server.hub.pods)
+
+    def test_benchmark_uses_fake_hub(self):
+        hosts = []
+
+        def benchmark(application, urls, n_requests, concurrency, cookie):
+            hosts.extend(backend.url for backend in get_backends())
+            for name in self.servers[0].hub.pods:
+                get_client().get_pod(name)
+            return {}
+
+        with mock.patch(
+            "labs.management.commands.benchmark_status.benchmark_wsgi",
+            side_effect=benchmark,
+        ), mock.patch(
+            "labs.management.commands.benchmark_status.benchmark_asgi",
+            side_effect=benchmark,
+        ):
+            call_command(
+                "benchmark_status", self.lab.name, "--labs", "2", stdout=StringIO()
+            )
+
+        (server,) = self.servers
+        self.assertEqual(hosts, [server.url] * 2)
@@ -0,0 +1,91 @@
+"""
+Tests for node pool placement.
+"""
+
+from django.core.management import call_command
+from django.test import tag, override_settings
+from django.urls import reverse
+from io import StringIO
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs.models import LabEnvironment
+from labs.placement import choose_node_pool, pack
+from labs.tests.test_views import hub_response
+from lawliet.test_utils import UnitTest, random_docker_image
+
+POOLS = [
+    {"name": "small", "nodes": 1, "cpu": 2000, "memory": 4096},
+    {"name": "large", "nodes": 2, "cpu": 4000, "memory": 16384},
+]
+
+"""
+---------------------------------------------------
+Placement tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "placement")
+@override_settings(LAB_NODE_POOLS=POOLS, LAB_PROVISIONING_WORKERS=0)
+class PlacementTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+            cpu_request=1000,
+            memory_request=1024,
+        )
+
+    def test_choose_node_pool(self):
+        # Pods should go to the pool that they fill the most, until it's full
+        self.assertEqual(choose_node_pool(self.lab, {}), "small")
+        self.assertEqual(choose_node_pool(self.lab, {"small": (1000, 1024)}), "small")
+        self.assertEqual(choose_node_pool(self.lab, {"small": (2000, 2048)}), "large")
+        self.assertEqual(
+            choose_node_pool(self.lab, {"small": (2000, 2048), "large": (8000, 0)}), ""
+        )
+
+        with self.settings(LAB_NODE_POOLS=[]):
+            self.assertEqual(choose_node_pool(self.lab), "")
+
+    def test_pack(self):
+        nodes = [(4000, 8192)] * 4
+        pods = [(1000, 1024)] * 6
+
+        counts, unplaced = pack(pods, nodes, strategy="binpack")
+        self.assertEqual((sorted(counts), unplaced), ([0, 0, 2, 4], 0))
+
+        counts, unplaced = pack(pods, nodes, strategy="spread")
+        self.assertEqual((sorted(counts), unplaced), ([1, 1, 2, 2], 0))
+
+        counts, unplaced = pack([(3000, 1024)] * 5, nodes)
+        self.assertEqual(unplaced, 1)
+
+        with self.assertRaises(ValueError):
+            pack(pods, nodes, strategy="random")
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_pod_spec(self, request):
+        self.client.post(f"{reverse('lab_api.generate')}?create={self.lab.id}")
+        conn = GuacamoleConnection.objects.get(user=self.user)
+        self.assertEqual(conn.node_pool, "small")
+
+        spec = request.call_args[1]["json"]
+        self.assertEqual(spec["nodePool"], "small")
+        self.assertEqual(
+            spec["resources"]["requests"], {"cpu": "1000m", "memory": "1024Mi"}
+        )
+
+    def test_simulation(self):
+        out = StringIO()
+        call_command(
+            "simulate_placement", "--students", "10", "--nodes", "5", stdout=out
+        )
+        lines = out.getvalue().splitlines()
+        self.assertIn("spread: 10 placed, 0 unplaced, 5 nodes used", lines[1])
+        self.assertIn("binpack: 10 placed, 0 unplaced, 3 nodes used", lines[2])
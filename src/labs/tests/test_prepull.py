@@ -0,0 +1,156 @@
+"""
+Tests for pre-pulling lab images.
+"""
+
+import threading
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import tag, override_settings
+from django.urls import reverse
+from io import StringIO
+from unittest import mock
+
+from labs import prepull
+from labs.models import ImagePullStatus, LabEnvironment
+from labs.prepull import run_prepull, start_prepull, warming_labs
+from labs.tests.test_views import hub_response, run_on_commit_callbacks
+from lawliet.test_utils import UnitTest, random_docker_image
+
+"""
+---------------------------------------------------
+Image pre-pull tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "prepull")
+@override_settings(
+    LAB_PROVISIONING_WORKERS=0,
+    LAB_IMAGE_PULL_WORKERS=0,
+    LAB_PIN_IMAGE_DIGESTS=False,
+    LAB_IMAGE_PULL_POLL_INTERVAL=0,
+    LAB_IMAGE_PULL_TIMEOUT=60,
+)
+class PrepullTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+
+    def pulls(self):
+        return dict(self.lab.image_pulls.values_list("node", "state"))
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_run_prepull(self, request):
+        request.side_effect = [
+            hub_response(data={"nodes": {"a": "Pulling", "b": "Ready"}}),
+            hub_response(data={"nodes": {"a": "Pulling", "b": "Ready"}}),
+            hub_response(data={"nodes": {"a": "Ready", "b": "Ready"}}),
+        ]
+        self.assertTrue(run_prepull(self.lab.id))
+        self.assertEqual(self.pulls(), {"a": "ready", "b": "ready"})
+        self.assertEqual(request.call_args_list[0][0][0], "POST")
+        self.assertEqual(request.call_args_list[0][1]["json"], {"image": self.lab.url})
+        self.assertEqual(warming_labs(), set())
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_warming(self, request):
+        ImagePullStatus.objects.create(lab=self.lab, node="a", image=self.lab.url)
+        self.assertEqual(warming_labs(), {self.lab.id})
+
+        ImagePullStatus.objects.update(state=ImagePullStatus.READY)
+        self.assertEqual(warming_labs(), set())
+
+        # Changing the lab's image means that it has to be pulled again
+        self.lab.url = "meepy/new-image"
+        self.lab.save()
+        self.assertEqual(warming_labs(), {self.lab.id})
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_hub_errors(self, request):
+        request.side_effect = [
+            hub_response(data={"nodes": {"a": "Pulling"}}),
+            hub_response(status=500),
+        ]
+        self.assertFalse(run_prepull(self.lab.id))
+        self.assertEqual(self.pulls(), {"a": "failed"})
+
+    @override_settings(LAB_IMAGE_PULL_WORKERS=1)
+    def test_prepulls_have_their_own_workers(self):
+        threads = []
+        with mock.patch("labs.prepull.run_prepull") as run:
+            run.side_effect = lambda *args, **kwargs: threads.append(
+                threading.current_thread().name
+            )
+            start_prepull(self.lab)
+            run_on_commit_callbacks()
+            # With a single worker, this only runs once the pull has finished
+            prepull.get_executor().submit(lambda: None).result()
+        run.assert_called_once_with(self.lab.id, close_connection=True, pin=False)
+        self.assertTrue(threads[0].startswith("lab-prepull"))
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_upload_starts_prepull(self, request):
+        request.return_value = hub_response(data={"nodes": {"a": "Pulling"}})
+        self.user.is_staff = True
+        self.user.save()
+
+        with self.settings(LAB_IMAGE_PULL_TIMEOUT=0):
+            self.client.post(
+                reverse("upload lab"),
+                {
+                    "name": "Ghidra",
+                    "description": "Ghidra lab environment",
+                    "url": "meepy/ghidra",
+                    "protocol": "vnc",
+                    "category": "Reverse engineering",
+                },
+            )
+        lab = LabEnvironment.objects.get(name="Ghidra")
+        self.assertEqual(lab.image_pulls.get().state, ImagePullStatus.PULLING)
+
+        response = self.client.get(reverse("dashboard"))
+        self.assertIn(lab.id, response.context["warming"])
+
+    @override_settings(LAB_IMAGE_PULL_WORKERS=2)
+    @mock.patch("labs.prepull.get_executor")
+    def test_prepull_submitted_after_commit(self, get_executor):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.post(
+            reverse("upload lab"),
+            {
+                "name": "Ghidra",
+                "description": "Ghidra lab environment",
+                "url": "meepy/ghidra",
+                "protocol": "vnc",
+                "category": "Reverse engineering",
+            },
+        )
+        lab = LabEnvironment.objects.get(name="Ghidra")
+
+        # The pull isn't handed to the workers until the upload is committed
+        get_executor.return_value.submit.assert_not_called()
+        run_on_commit_callbacks()
+        get_executor.return_value.submit.assert_called_once_with(
+            run_prepull, lab.id, close_connection=True, pin=True
+        )
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_management_command(self, request):
+        request.return_value = hub_response(data={"nodes": {"a": "Ready"}})
+        out = StringIO()
+        call_command("prepull_images", "Cutter", stdout=out)
+        self.assertIn("Cutter", out.getvalue())
+
+        request.return_value = hub_response(data={"nodes": {"a": "Failed"}})
+        with self.assertRaises(CommandError):
+            call_command("prepull_images", stdout=out)
+        with self.assertRaises(CommandError):
+            call_command("prepull_images", "Nonexistent", stdout=out)
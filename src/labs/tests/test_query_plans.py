@@ -0,0 +1,43 @@
+"""
+Tests for the indexes used by the hot lookups on the Guacamole tables.
+"""
+
+from django.db import IntegrityError, connection, transaction
+from django.test import tag
+from unittest import skipUnless
+
+from guacamole.models import GuacamoleConnection
+from labs.query_plans import explain_lookups, populate
+from lawliet.test_utils import UnitTest
+
+"""
+---------------------------------------------------
+Query plan tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "query-plans")
+class QueryPlansTestCase(UnitTest):
+    def setUp(self):
+        super().setUp()
+        self.sample = populate(connections=200, users=10)
+
+    @skipUnless(connection.vendor == "sqlite", "Plans are checked on SQLite")
+    def test_lookups_are_indexed(self):
+        report = explain_lookups(self.sample, repeat=1)
+        for (name, result) in report.items():
+            with self.subTest(lookup=name):
+                self.assertIn("USING", result["plan"])
+                self.assertNotIn("SCAN", result["plan"])
+                self.assertNotIn("TEMP B-TREE", result["plan"])
+
+    def test_connection_names_are_unique(self):
+        conn = GuacamoleConnection.objects.get(connection_name=self.sample["conn_name"])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            GuacamoleConnection.objects.create(
+                connection_name=conn.connection_name,
+                protocol="ssh",
+                lab=conn.lab,
+                user=conn.user,
+            )
@@ -0,0 +1,145 @@
+"""
+Tests for the idle lab reaper.
+"""
+
+import datetime
+
+from django.core.management import call_command
+from django.test import tag, override_settings
+from django.utils import timezone
+from io import StringIO
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection, GuacamoleConnectionHistory
+from labs.models import LabEnvironment
+from labs.reaper import find_idle_labs, reap_idle_labs
+from labs.teardown import teardown_labs
+from labs.tests.test_views import hub_response
+from lawliet.test_utils import UnitTest, random_docker_image
+from users.models import User
+
+NOW = timezone.make_aware(datetime.datetime(2020, 4, 29, 12))
+
+"""
+---------------------------------------------------
+Idle lab reaper tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "reaper")
+@override_settings(LAB_IDLE_TIMEOUT=60)
+class ReaperTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+
+    def create_lab(self, age, sessions=(), user=None):
+        """
+        Create a lab that was started `age` minutes ago, with connection
+        history given as a list of (start, end) times in minutes ago. An end of
+        None means that the user is still connected.
+        """
+        user = user or self.user
+        conn = GuacamoleConnection.objects.create(
+            protocol="ssh",
+            lab=self.lab,
+            user=user,
+            date_created=NOW - datetime.timedelta(minutes=age),
+        )
+        for (start, end) in sessions:
+            GuacamoleConnectionHistory.objects.create(
+                username=user.username,
+                connection=conn,
+                connection_name=conn.connection_name,
+                start_date=NOW - datetime.timedelta(minutes=start),
+                end_date=None if end is None else NOW - datetime.timedelta(minutes=end),
+            )
+        user.n_active_labs += 1
+        user.save()
+        return conn.connection_name
+
+    def test_find_idle_labs(self):
+        new = self.create_lab(age=30)
+        never_used = self.create_lab(age=90)
+        recently_used = self.create_lab(age=180, sessions=[(170, 100), (50, 40)])
+        in_use = self.create_lab(age=180, sessions=[(170, None)])
+        abandoned = self.create_lab(age=180, sessions=[(170, 160), (150, 90)])
+
+        idle = {c.connection_name for c in find_idle_labs(self.lab, now=NOW)}
+        self.assertEqual(idle, {never_used, abandoned})
+
+    def test_per_lab_timeout(self):
+        name = self.create_lab(age=90)
+        self.lab.idle_timeout = 120
+        self.assertFalse(find_idle_labs(self.lab, now=NOW).exists())
+        self.lab.idle_timeout = 0
+        self.assertFalse(find_idle_labs(self.lab, now=NOW).exists())
+        self.lab.idle_timeout = 30
+        self.assertEqual(find_idle_labs(self.lab, now=NOW).get().connection_name, name)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_reap_idle_labs(self, request):
+        other = User.objects.create_user(
+            username="meepy-other", email="other@colorado.edu", password=self.password
+        )
+        self.create_lab(age=90)
+        self.create_lab(age=120, user=other)
+        self.create_lab(age=150, user=other)
+        in_use = self.create_lab(age=120, sessions=[(100, None)], user=other)
+        active = self.create_lab(age=10)
+
+        reaped = reap_idle_labs(now=NOW, batch_size=1)
+        self.assertEqual(len(reaped), 3)
+        self.assertEqual(request.call_count, 3)
+        for call in request.call_args_list:
+            self.assertEqual(call[0][0], "DELETE")
+
+        remaining = GuacamoleConnection.objects.values_list(
+            "connection_name", flat=True
+        )
+        self.assertEqual(set(remaining), {in_use, active})
+        self.user.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.user.n_active_labs, 1)
+        self.assertEqual(other.n_active_labs, 1)
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_failed_deletions_are_kept(self, request):
+        names = [self.create_lab(age=90) for _ in range(3)]
+        request.side_effect = [
+            hub_response(),
+            hub_response(status=404),
+            hub_response(status=500),
+        ]
+        results = teardown_labs(GuacamoleConnection.objects.all(), max_workers=1)
+
+        self.assertEqual(sum(ex is not None for ex in results.values()), 1)
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.n_active_labs, 1)
+
+    def test_active_labs_never_negative(self):
+        self.create_lab(age=90)
+        self.user.n_active_labs = 0
+        self.user.save()
+        with mock.patch(
+            "labs.hub.requests.Session.request", return_value=hub_response()
+        ):
+            teardown_labs(GuacamoleConnection.objects.all())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.n_active_labs, 0)
+
+    def test_dry_run(self):
+        self.create_lab(age=90)
+        out = StringIO()
+        with mock.patch("labs.reaper.timezone.now", return_value=NOW):
+            call_command("reap_idle_labs", "--once", "--dry-run", stdout=out)
+        self.assertEqual(len(out.getvalue().split()), 1)
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
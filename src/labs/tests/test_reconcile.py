@@ -0,0 +1,225 @@
+"""
+Tests for reconciling the Guacamole tables with the pods on the hub.
+"""
+
+import requests
+
+from datetime import timedelta
+from django.db.models import F
+from django.test import tag, override_settings
+from django.utils import timezone
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs.fakehub import start_fake_hub
+from labs.hub import HubClient, reset_client
+from labs.models import LabEnvironment, LabService, ProvisioningJob, WarmPod
+from labs import reconcile
+from labs.reconcile import diff_pods, reconcile_labs
+from labs.topology import member_pod_name
+from lawliet.test_utils import UnitTest, random_docker_image
+from users.models import User
+
+"""
+---------------------------------------------------
+Diffing tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "reconcile")
+class DiffPodsTestCase(UnitTest):
+    def test_diff_pods(self):
+        labs = {"a": ["a"], "b": ["b", "b-target"], "c": ["c"]}
+        orphans, broken = diff_pods({"a", "b", "c", "d", "warm"}, labs, ["warm"])
+        self.assertEqual(orphans, {"d"})
+        self.assertEqual(broken, {"b"})
+
+
+"""
+---------------------------------------------------
+Reconciliation tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "reconcile")
+@override_settings(LAB_RECONCILE_GRACE_PERIOD=60, LAB_RECONCILE_PAGE_SIZE=2)
+class ReconcileLabsTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(create_user=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+
+        self.server = start_fake_hub()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(reset_client)
+        overrides = override_settings(HUB_API_HOST=self.server.url)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_client()
+
+        # The pods are only checked once the labs are past the grace period
+        self.later = timezone.now() + timedelta(minutes=5)
+
+    def new_lab(self, with_pod=True, lab=None):
+        conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=lab or self.lab, user=self.user
+        )
+        User.objects.filter(id=self.user.id).update(
+            n_active_labs=F("n_active_labs") + 1
+        )
+        for service in conn.lab.services.all():
+            GuacamoleConnection.objects.create(
+                connection_name=member_pod_name(conn.connection_name, service.name),
+                primary=conn,
+                lab=conn.lab,
+                user=self.user,
+            )
+        if with_pod:
+            self.server.hub.create_pod(conn.connection_name, {})
+        return conn.connection_name
+
+    def hub_pods(self):
+        return set(self.server.hub.pods)
+
+    def n_active_labs(self):
+        return User.objects.get(id=self.user.id).n_active_labs
+
+    def test_orphaned_pods_are_deleted(self):
+        running = self.new_lab()
+        warm = WarmPod.objects.create(lab=self.lab, state=WarmPod.IDLE)
+        for name in ("lawliet-env-orphan-1", "lawliet-env-orphan-2", warm.name):
+            self.server.hub.create_pod(name, {})
+
+        report = reconcile_labs(now=self.later, batch_size=1)
+        self.assertEqual(
+            report["orphan_pods"], ["lawliet-env-orphan-1", "lawliet-env-orphan-2"]
+        )
+        self.assertEqual(report["orphan_labs"], [])
+        self.assertEqual(self.hub_pods(), {running, warm.name})
+
+    def test_labs_started_during_reconcile(self):
+        warm = WarmPod.objects.create(lab=self.lab, state=WarmPod.IDLE)
+        self.server.hub.create_pod(warm.name, {})
+        started = "lawliet-env-started"
+        self.server.hub.create_pod(started, {})
+
+        # While the labs are being read, a lab claims the warm pod and another
+        # lab is started for a pod that was already listed
+        def expected_pods():
+            labs = original()
+            WarmPod.objects.filter(name=warm.name).delete()
+            for name in (warm.name, started):
+                GuacamoleConnection.objects.create(
+                    connection_name=name, protocol="ssh", lab=self.lab, user=self.user
+                )
+            return labs
+
+        original = reconcile.expected_pods
+        with mock.patch("labs.reconcile.expected_pods", side_effect=expected_pods):
+            report = reconcile_labs(now=self.later)
+        self.assertEqual(report["orphan_pods"], [])
+        self.assertEqual(self.hub_pods(), {warm.name, started})
+
+    def test_orphaned_labs_are_deleted(self):
+        running = self.new_lab()
+        missing = self.new_lab(with_pod=False)
+        self.assertEqual(self.n_active_labs(), 2)
+
+        # Labs that are still within the grace period are left alone
+        report = reconcile_labs()
+        self.assertEqual(report["orphan_labs"], [])
+
+        report = reconcile_labs(now=self.later)
+        self.assertEqual(report["orphan_labs"], [missing])
+        self.assertEqual(
+            list(GuacamoleConnection.objects.values_list("connection_name", flat=True)),
+            [running],
+        )
+        self.assertEqual(self.n_active_labs(), 1)
+
+    def test_labs_being_provisioned_are_left_alone(self):
+        name = self.new_lab(with_pod=False)
+        ProvisioningJob.objects.create(
+            connection=GuacamoleConnection.objects.get(connection_name=name),
+            connection_name=name,
+            lab=self.lab,
+            user=self.user,
+            state=ProvisioningJob.RUNNING,
+        )
+        report = reconcile_labs(now=self.later)
+        self.assertEqual(report["orphan_labs"], [])
+        self.assertTrue(GuacamoleConnection.objects.filter(connection_name=name))
+
+    def test_missing_member_pods(self):
+        lab = LabEnvironment.objects.create(
+            name="Attack-Defend",
+            description="Attack-defend lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        LabService.objects.create(
+            lab=lab, name="target", url=random_docker_image(self.rd)
+        )
+        complete = self.new_lab(lab=lab)
+        self.server.hub.create_pod(member_pod_name(complete, "target"), {})
+        broken = self.new_lab(lab=lab)
+
+        # Services added since the labs were started aren't expected to exist
+        LabService.objects.create(
+            lab=lab, name="attacker", url=random_docker_image(self.rd)
+        )
+
+        # The remaining pod of a lab with a missing member is deleted with it
+        report = reconcile_labs(now=self.later)
+        self.assertEqual(report["orphan_pods"], [])
+        self.assertEqual(report["orphan_labs"], [broken])
+        self.assertEqual(
+            self.hub_pods(), {complete, member_pod_name(complete, "target")}
+        )
+
+    def test_active_labs_are_recounted(self):
+        self.new_lab()
+        self.new_lab()
+        other = User.objects.create_user(
+            username="meepy-other", email="other@colorado.edu", password=self.password
+        )
+        User.objects.filter(id=self.user.id).update(n_active_labs=5)
+        User.objects.filter(id=other.id).update(n_active_labs=3)
+
+        report = reconcile_labs(now=self.later)
+        self.assertEqual(report["recounted_users"], 2)
+        self.assertEqual(self.n_active_labs(), 2)
+        self.assertEqual(User.objects.get(id=other.id).n_active_labs, 0)
+
+    def test_dry_run(self):
+        self.new_lab(with_pod=False)
+        self.server.hub.create_pod("lawliet-env-orphan", {})
+        User.objects.filter(id=self.user.id).update(n_active_labs=0)
+
+        report = reconcile_labs(now=self.later, dry_run=True)
+        self.assertEqual(report["orphan_pods"], ["lawliet-env-orphan"])
+        self.assertEqual(len(report["orphan_labs"]), 1)
+        self.assertEqual(report["recounted_users"], 1)
+        self.assertEqual(self.hub_pods(), {"lawliet-env-orphan"})
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
+        self.assertEqual(self.n_active_labs(), 0)
+
+    def test_unreachable_hub(self):
+        self.new_lab(with_pod=False)
+        with mock.patch.object(
+            HubClient, "iter_pods", side_effect=requests.ConnectionError
+        ):
+            report = reconcile_labs(now=self.later)
+
+        # None of the labs are deleted when the hub's pods can't be listed
+        self.assertEqual(report["orphan_labs"], [])
+        self.assertEqual(GuacamoleConnection.objects.count(), 1)
@@ -0,0 +1,222 @@
+"""
+Tests for resolving lab images to digests, against a local stand-in for a
+Docker registry.
+"""
+
+import json
+import threading
+
+from django.test import tag, override_settings
+from django.urls import reverse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from labs.hub import get_client
+from labs.models import LabEnvironment
+from labs.prepull import run_prepull
+from labs.registry import RegistryError, parse_image, pin_image, resolve_digest
+from labs.tests.test_views import hub_response, run_on_commit_callbacks
+from lawliet.test_utils import UnitTest
+
+DIGEST = "sha256:" + "a" * 64
+NEW_DIGEST = "sha256:" + "b" * 64
+
+"""
+---------------------------------------------------
+Stand-in registry
+---------------------------------------------------
+"""
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    """
+    Serves manifests for the images in self.server.manifests (a dictionary
+    mapping "repository:tag" to a digest), behind anonymous token auth.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/token"):
+            body = json.dumps({"token": "anonymous"}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def do_HEAD(self):
+        self.server.requests.append(self.path)
+        if self.headers.get("Authorization") != "Bearer anonymous":
+            host, port = self.server.server_address
+            self.send_response(401)
+            self.send_header(
+                "WWW-Authenticate",
+                f'Bearer realm="http://{host}:{port}/token",service="registry.test"',
+            )
+            self.end_headers()
+            return
+
+        _, _, path = self.path.partition("/v2/")
+        repository, _, tag = path.partition("/manifests/")
+        digest = self.server.manifests.get(f"{repository}:{tag}")
+        if digest is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Docker-Content-Digest", digest)
+        self.end_headers()
+
+
+"""
+---------------------------------------------------
+Registry tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "registry")
+class RegistryTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.registry = ThreadingHTTPServer(("127.0.0.1", 0), RegistryHandler)
+        self.registry.manifests = {"wshand/cutter:latest": DIGEST}
+        self.registry.requests = []
+        threading.Thread(target=self.registry.serve_forever, daemon=True).start()
+
+        host, port = self.registry.server_address
+        self.settings_override = override_settings(
+            LAB_REGISTRY_URL=f"http://{host}:{port}",
+            LAB_PIN_IMAGE_DIGESTS=True,
+            LAB_PROVISIONING_WORKERS=0,
+            LAB_IMAGE_PULL_WORKERS=0,
+        )
+        self.settings_override.enable()
+
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url="wshand/cutter:latest",
+            protocol="ssh",
+            port=22,
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.registry.shutdown()
+        self.registry.server_close()
+        super().tearDown()
+
+    def test_parse_image(self):
+        registry = self.registry_url()
+        self.assertEqual(
+            parse_image("wshand/cutter"), (registry, "wshand/cutter", "latest")
+        )
+        self.assertEqual(
+            parse_image("ubuntu:18.04"), (registry, "library/ubuntu", "18.04")
+        )
+        self.assertEqual(
+            parse_image("localhost:5000/meepy/lab:v2"),
+            ("https://localhost:5000", "meepy/lab", "v2"),
+        )
+        self.assertEqual(
+            parse_image(f"ghcr.io/meepy/lab@{DIGEST}"),
+            ("https://ghcr.io", "meepy/lab", DIGEST),
+        )
+
+    def registry_url(self):
+        host, port = self.registry.server_address
+        return f"http://{host}:{port}"
+
+    def test_resolve_digest(self):
+        self.assertEqual(resolve_digest("wshand/cutter:latest"), DIGEST)
+        self.assertEqual(resolve_digest(f"wshand/cutter@{NEW_DIGEST}"), NEW_DIGEST)
+        with self.assertRaises(RegistryError):
+            resolve_digest("wshand/nonexistent:latest")
+
+    def test_pin_image(self):
+        self.assertTrue(pin_image(self.lab))
+        self.assertEqual(self.lab.image_digest, DIGEST)
+        self.assertEqual(self.lab.pod_image(), f"wshand/cutter@{DIGEST}")
+        self.assertFalse(pin_image(self.lab))
+
+        # Refreshing should pick up a tag that has moved
+        self.registry.manifests["wshand/cutter:latest"] = NEW_DIGEST
+        self.assertTrue(pin_image(self.lab))
+        self.assertEqual(self.lab.pod_image(), f"wshand/cutter@{NEW_DIGEST}")
+
+    def test_registry_unavailable(self):
+        pin_image(self.lab)
+        self.registry.manifests.clear()
+
+        # If the registry can't resolve the image, we keep the current digest
+        self.assertFalse(pin_image(self.lab))
+        self.assertEqual(LabEnvironment.objects.get().image_digest, DIGEST)
+
+    def test_pods_created_by_digest(self):
+        pin_image(self.lab)
+
+        # Only the hub's session is mocked, since the registry is also accessed
+        # through requests.
+        with mock.patch.object(
+            get_client().session, "request", return_value=hub_response()
+        ) as request:
+            self.client.post(f"{reverse('lab_api.generate')}?create={self.lab.id}")
+        self.assertEqual(
+            request.call_args[1]["json"]["image"], f"wshand/cutter@{DIGEST}"
+        )
+
+    def test_upload_pins_digest(self):
+        self.user.is_staff = True
+        self.user.save()
+        with mock.patch.object(
+            get_client().session,
+            "request",
+            return_value=hub_response(data={"nodes": {"a": "Ready"}}),
+        ) as request:
+            self.client.post(
+                reverse("upload lab"),
+                {
+                    "name": "Ghidra",
+                    "description": "Ghidra lab environment",
+                    "url": "wshand/cutter:latest",
+                    "protocol": "vnc",
+                    "category": "Reverse engineering",
+                },
+            )
+        lab = LabEnvironment.objects.get(name="Ghidra")
+        self.assertEqual(lab.image_digest, DIGEST)
+        self.assertIsNotNone(lab.date_digest_resolved)
+
+        # The image should be pre-pulled by its digest
+        self.assertEqual(request.call_args[1]["json"], {"image": lab.pod_image()})
+
+    @mock.patch("labs.prepull.get_executor")
+    def test_upload_pins_in_background(self, get_executor):
+        self.user.is_staff = True
+        self.user.save()
+        with self.settings(LAB_IMAGE_PULL_WORKERS=2):
+            self.client.post(
+                reverse("upload lab"),
+                {
+                    "name": "Ghidra",
+                    "description": "Ghidra lab environment",
+                    "url": "wshand/cutter:latest",
+                    "protocol": "vnc",
+                    "category": "Reverse engineering",
+                },
+            )
+            run_on_commit_callbacks()
+
+        # The registry is only contacted by the pre-pull worker
+        lab = LabEnvironment.objects.get(name="Ghidra")
+        self.assertEqual(lab.image_digest, "")
+        self.assertEqual(self.registry.requests, [])
+        get_executor.return_value.submit.assert_called_once_with(
+            run_prepull, lab.id, close_connection=True, pin=True
+        )
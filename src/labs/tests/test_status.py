@@ -0,0 +1,327 @@
+"""
+Tests for the pod status cache.
+"""
+
+import itertools
+import json
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import tag, override_settings
+from django.urls import reverse
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs.models import LabEnvironment
+from labs.status import SingleFlight, cache_key, is_ready, pod_events
+from labs.tests.test_views import hub_response
+from lawliet.test_utils import UnitTest, random_docker_image
+from users.models import User
+
+READY = {"conditions": [{"type": "Ready", "status": "True"}]}
+NOT_READY = {"conditions": [{"type": "Ready", "status": "False"}]}
+
+"""
+---------------------------------------------------
+SingleFlight tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "status")
+class SingleFlightTestCase(UnitTest):
+    def test_concurrent_calls_are_coalesced(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return "status"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do("a", slow)))
+        leader.start()
+        started.wait()
+
+        followers = [
+            threading.Thread(target=lambda: results.append(flight.do("a", slow)))
+            for _ in range(5)
+        ]
+        for thread in followers:
+            thread.start()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["status"] * 6)
+
+        # Once the call has finished, new calls should do work again
+        flight.do("a", slow)
+        self.assertEqual(len(calls), 2)
+
+    def test_errors_are_raised(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError("hub unavailable")
+
+        with self.assertRaises(ValueError):
+            flight.do("a", fail)
+
+
+"""
+---------------------------------------------------
+PodStatusView tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "status", "views")
+class PodStatusViewTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        cache.clear()
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=self.user
+        )
+        self.url = f"{reverse('lab_api.pod.pod_status')}?id={self.conn.connection_name}"
+
+    def test_is_ready(self):
+        self.assertTrue(is_ready(READY))
+        self.assertFalse(is_ready(NOT_READY))
+        self.assertFalse(is_ready({"conditions": []}))
+        self.assertFalse(is_ready({}))
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_status_is_cached(self, request):
+        request.return_value = hub_response(data=NOT_READY)
+        for _ in range(3):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), NOT_READY)
+        request.assert_called_once()
+
+        cache.clear()
+        request.return_value = hub_response(data=READY)
+        self.assertEqual(self.client.get(self.url).json(), READY)
+        self.assertEqual(request.call_count, 2)
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_retry_after_header(self, request):
+        with self.settings(
+            LAB_POD_STATUS_POLL_INTERVAL=1.5, LAB_POD_STATUS_READY_POLL_INTERVAL=30
+        ):
+            request.return_value = hub_response(data=NOT_READY)
+            self.assertEqual(self.client.get(self.url)["Retry-After"], "2")
+
+            cache.clear()
+            request.return_value = hub_response(data=READY)
+            self.assertEqual(self.client.get(self.url)["Retry-After"], "30")
+
+    def test_status_of_other_users_lab(self):
+        other = User.objects.create_user(
+            username="meepy-other", email="other@colorado.edu", password=self.password
+        )
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_status_of_nonexistent_lab(self):
+        url = f"{reverse('lab_api.pod.pod_status')}?id=lawliet-env-nonexistent"
+        self.assertEqual(self.client.get(url).status_code, 422)
+
+
+"""
+---------------------------------------------------
+PodStatusBatchView tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "status", "views")
+class PodStatusBatchViewTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        cache.clear()
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.conns = [
+            GuacamoleConnection.objects.create(
+                protocol="ssh", lab=self.lab, user=self.user
+            )
+            for _ in range(3)
+        ]
+        self.names = [conn.connection_name for conn in self.conns]
+        self.url = reverse("lab_api.pod.pod_status_batch")
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_defaults_to_all_labs(self, request):
+        request.return_value = hub_response(data=NOT_READY)
+        # Session and user lookups, plus one query for the user's connections
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["statuses"], {n: NOT_READY for n in self.names}
+        )
+        self.assertEqual(request.call_count, 3)
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_statuses_are_cached(self, request):
+        request.return_value = hub_response(data=READY)
+        self.client.get(f"{self.url}?id={self.names[0]}")
+        self.assertEqual(request.call_count, 1)
+
+        # Only the statuses that weren't cached should be requested from the hub
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.json()["statuses"]), 3)
+        self.assertEqual(request.call_count, 3)
+        self.client.get(self.url)
+        self.assertEqual(request.call_count, 3)
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_retry_after_header(self, request):
+        with self.settings(
+            LAB_POD_STATUS_POLL_INTERVAL=2, LAB_POD_STATUS_READY_POLL_INTERVAL=30
+        ):
+            request.return_value = hub_response(data=READY)
+            self.assertEqual(self.client.get(self.url)["Retry-After"], "30")
+
+            # The client should check again soon if any lab isn't ready yet
+            cache.delete(cache_key(self.names[0]))
+            request.return_value = hub_response(data=NOT_READY)
+            self.assertEqual(self.client.get(self.url)["Retry-After"], "2")
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_labs_not_owned_by_user(self, request):
+        request.return_value = hub_response(data=READY)
+        other = User.objects.create_user(
+            username="meepy-other", email="other@colorado.edu", password=self.password
+        )
+        conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=other
+        )
+
+        query = "&".join(
+            f"id={name}"
+            for name in [self.names[0], conn.connection_name, "lawliet-env-fake"]
+        )
+        statuses = self.client.get(f"{self.url}?{query}").json()["statuses"]
+        self.assertEqual(statuses[self.names[0]], READY)
+        self.assertIn("error", statuses[conn.connection_name])
+        self.assertIn("error", statuses["lawliet-env-fake"])
+        request.assert_called_once()
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_hub_errors(self, request):
+        request.side_effect = [hub_response(status=500)] + [
+            hub_response(data=READY)
+        ] * 2
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        statuses = response.json()["statuses"]
+        self.assertEqual(sum("error" in status for status in statuses.values()), 1)
+
+
+"""
+---------------------------------------------------
+PodEventsView tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "status", "views")
+@override_settings(LAB_POD_EVENTS=True)
+class PodEventsTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        cache.clear()
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.conns = [
+            GuacamoleConnection.objects.create(
+                protocol="ssh", lab=self.lab, user=self.user
+            )
+            for _ in range(2)
+        ]
+
+    def parse(self, event):
+        lines = event.strip().split("\n")
+        return lines[0].split(": ")[1], json.loads(lines[1].split(": ", 1)[1])
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_event_stream(self, request):
+        request.return_value = hub_response(data=NOT_READY)
+        with self.settings(LAB_POD_EVENTS_MAX_DURATION=0):
+            response = self.client.get(reverse("lab_api.pod.events"))
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            events = [e.decode() for e in response.streaming_content]
+
+        self.assertTrue(events[0].startswith("retry:"))
+        statuses = [self.parse(event) for event in events[1:]]
+        self.assertEqual(
+            {data["conn_name"] for (_, data) in statuses},
+            {conn.connection_name for conn in self.conns},
+        )
+        for (event, data) in statuses:
+            self.assertEqual(event, "status")
+            self.assertFalse(data["ready"])
+
+    @override_settings(LAB_POD_EVENTS=False)
+    def test_events_disabled(self):
+        response = self.client.get(reverse("lab_api.pod.events"))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse("dashboard"))
+        self.assertContains(response, 'data-pod-events="false"')
+
+    @mock.patch("labs.status.time.sleep")
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_readiness_transitions(self, request, sleep):
+        request.return_value = hub_response(data=NOT_READY)
+
+        def become_ready(seconds):
+            # The first lab becomes ready, and the second one is deleted
+            cache.clear()
+            request.return_value = hub_response(data=READY)
+            self.conns[1].delete()
+
+        sleep.side_effect = become_ready
+        events = list(itertools.islice(pod_events(self.user, max_duration=60), 7))
+
+        # retry, 2 x status, keep-alive, status, deleted, keep-alive
+        self.assertEqual(events[3], ": keep-alive\n\n")
+        self.assertEqual(
+            self.parse(events[4]),
+            (
+                "status",
+                {
+                    "conn_name": self.conns[0].connection_name,
+                    "ready": True,
+                    "conditions": READY["conditions"],
+                },
+            ),
+        )
+        self.assertEqual(
+            self.parse(events[5]),
+            ("deleted", {"conn_name": self.conns[1].connection_name}),
+        )
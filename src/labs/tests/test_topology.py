@@ -0,0 +1,284 @@
+"""
+Tests for multi-machine labs.
+"""
+
+import threading
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.test import tag, override_settings
+from django.urls import reverse
+from unittest import mock
+
+from guacamole.models import (
+    GuacamoleConnection,
+    GuacamoleConnectionGroup,
+    GuacamoleConnectionPermission,
+)
+from labs.admission import cluster_usage, fits
+from labs.models import LabEnvironment, LabService, ProvisioningJob
+from labs.placement import choose_node_pool, pool_usage
+from labs.status import is_ready, lab_status
+from labs.teardown import teardown_labs
+from labs.tests.test_status import NOT_READY, READY
+from labs.tests.test_views import hub_response
+from labs.topology import lab_pods, member_pod_name
+from lawliet.test_utils import UnitTest, random_docker_image
+from users.models import User
+
+"""
+---------------------------------------------------
+Lab status tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "topology")
+class LabStatusTestCase(UnitTest):
+    def test_lab_status(self):
+        status = lab_status(
+            {"a": dict(READY, phase="Running"), "b": dict(NOT_READY, phase="Pending")}
+        )
+        self.assertFalse(is_ready(status))
+        self.assertEqual(status["phase"], "Pending")
+        self.assertEqual(set(status["members"]), {"a", "b"})
+        self.assertNotIn("stale", status)
+
+        status = lab_status(
+            {"a": dict(READY, phase="Running"), "b": dict(READY, stale=True)}
+        )
+        self.assertTrue(is_ready(status))
+        self.assertTrue(status["stale"])
+
+
+"""
+---------------------------------------------------
+Multi-machine lab tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "topology")
+@override_settings(LAB_PROVISIONING_WORKERS=0)
+class MultiMachineLabTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        cache.clear()
+        self.lab = LabEnvironment.objects.create(
+            name="Attack-Defend",
+            description="Attack-defend lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        LabService.objects.create(
+            lab=self.lab,
+            name="target",
+            url=random_docker_image(self.rd),
+            protocol="vnc",
+            port=5901,
+        )
+        LabService.objects.create(
+            lab=self.lab, name="database", url=random_docker_image(self.rd)
+        )
+        self.generate_url = f"{reverse('lab_api.generate')}?create={self.lab.id}"
+
+    def generate(self):
+        response = self.client.post(self.generate_url)
+        self.assertEqual(response.status_code, 202)
+        return response.json()["conn_name"]
+
+    def pods(self, conn_name):
+        return [
+            conn_name,
+            member_pod_name(conn_name, "database"),
+            member_pod_name(conn_name, "target"),
+        ]
+
+    def test_pods_are_created_concurrently(self):
+        # Every creation request waits until all three are in flight at once,
+        # which would time out if they were sent one after the other.
+        barrier = threading.Barrier(3, timeout=5)
+
+        def request(method, url, **kwargs):
+            if method == "PUT":
+                barrier.wait()
+            return hub_response()
+
+        with mock.patch("labs.hub.requests.Session.request", side_effect=request):
+            conn_name = self.generate()
+
+        job = ProvisioningJob.objects.get(connection_name=conn_name)
+        self.assertEqual(job.state, ProvisioningJob.SUCCEEDED)
+
+        # The lab and its reachable service are in the same connection group,
+        # and the user can connect to both of them.
+        conn = GuacamoleConnection.objects.get(connection_name=conn_name)
+        group = GuacamoleConnectionGroup.objects.get(connection_group_name=conn_name)
+        self.assertEqual(conn.parent, group)
+        member = GuacamoleConnection.objects.get(primary=conn, protocol="vnc")
+        self.assertEqual(member.connection_name, member_pod_name(conn_name, "target"))
+        self.assertEqual(member.parent, group)
+        self.assertEqual(member.protocol, "vnc")
+        self.assertEqual(
+            GuacamoleConnectionPermission.objects.filter(
+                connection__in=[conn, member]
+            ).count(),
+            2,
+        )
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 1)
+
+        # Members are listed with the lab, rather than as labs of their own
+        labs = self.client.get(reverse("lab_api.info")).json()
+        self.assertEqual([lab["conn_name"] for lab in labs], [conn_name])
+        self.assertEqual(
+            [m["conn_name"] for m in labs[0]["members"]], [member.connection_name]
+        )
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_status_covers_every_member(self, request):
+        conn_name = self.generate()
+        pods = self.pods(conn_name)
+        url = f"{reverse('lab_api.pod.pod_status')}?id={conn_name}"
+
+        request.return_value = hub_response(data=NOT_READY)
+        request.reset_mock()
+        status = self.client.get(url).json()
+        self.assertFalse(is_ready(status))
+        self.assertEqual(set(status["members"]), set(pods))
+        self.assertEqual(request.call_count, 3)
+
+        # The lab is ready once every one of its pods is
+        cache.clear()
+        request.side_effect = lambda method, url, **kwargs: hub_response(
+            data=NOT_READY if url.endswith("-database") else READY
+        )
+        self.assertFalse(is_ready(self.client.get(url).json()))
+        cache.clear()
+        request.side_effect = None
+        request.return_value = hub_response(data=READY)
+        self.assertTrue(is_ready(self.client.get(url).json()))
+
+        # The batch endpoint doesn't report members as labs of their own
+        response = self.client.get(reverse("lab_api.pod.pod_status_batch"))
+        statuses = response.json()["statuses"]
+        self.assertEqual(list(statuses), [conn_name])
+        self.assertTrue(is_ready(statuses[conn_name]))
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_delete(self, request):
+        conn_name = self.generate()
+        request.reset_mock()
+
+        response = self.client.post(f"{reverse('lab_api.delete')}?id={conn_name}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["n_deleted"], 1)
+
+        deleted = {call[0][1].rsplit("/", 1)[-1] for call in request.call_args_list}
+        self.assertEqual(deleted, set(self.pods(conn_name)))
+        self.assertFalse(GuacamoleConnection.objects.exists())
+        self.assertFalse(GuacamoleConnectionGroup.objects.exists())
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 0)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_teardown(self, request):
+        conn_name = self.generate()
+        request.reset_mock()
+
+        # Labs are only deleted once all of their pods are
+        request.side_effect = lambda method, url, **kwargs: hub_response(
+            status=500 if url.endswith("-target") else 200
+        )
+        conns = GuacamoleConnection.objects.filter(primary=None)
+        results = teardown_labs(conns)
+        self.assertIsNotNone(results[conn_name])
+        self.assertEqual(GuacamoleConnection.objects.count(), 3)
+
+        request.side_effect = None
+        results = teardown_labs(conns)
+        self.assertEqual(results, {conn_name: None})
+        self.assertFalse(GuacamoleConnection.objects.exists())
+        self.assertFalse(GuacamoleConnectionGroup.objects.exists())
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 0)
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_services_added_later(self, request):
+        conn_name = self.generate()
+        LabService.objects.create(
+            lab=self.lab, name="attacker", url=random_docker_image(self.rd)
+        )
+
+        # Running labs keep the pods that they were started with
+        request.return_value = hub_response(data=READY)
+        request.reset_mock()
+        url = f"{reverse('lab_api.pod.pod_status')}?id={conn_name}"
+        status = self.client.get(url).json()
+        self.assertEqual(set(status["members"]), set(self.pods(conn_name)))
+        self.assertEqual(request.call_count, 3)
+
+        conn = GuacamoleConnection.objects.get(connection_name=conn_name)
+        self.assertEqual(lab_pods([conn])[conn_name], self.pods(conn_name))
+
+    @override_settings(
+        LAB_NODE_POOLS=[
+            {"name": "small", "nodes": 1, "cpu": 1000, "memory": 4096},
+            {"name": "large", "nodes": 1, "cpu": 4000, "memory": 4096},
+        ]
+    )
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_capacity_includes_services(self, request):
+        # The lab's own pod would fit in the small pool, but not with its
+        # services alongside it
+        self.assertEqual(self.lab.footprint(), (1500, 1536))
+        self.assertEqual(choose_node_pool(self.lab), "large")
+        with self.settings(LAB_CLUSTER_CPU=1000):
+            self.assertFalse(fits(self.lab, (0, 0)))
+
+        conn_name = self.generate()
+        conn = GuacamoleConnection.objects.get(connection_name=conn_name)
+        self.assertEqual(conn.node_pool, "large")
+        self.assertEqual(cluster_usage(), (1500, 1536))
+        self.assertEqual(pool_usage(), {"large": (1500, 1536)})
+
+    @override_settings(LAB_PROVISIONING_MAX_ATTEMPTS=1)
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_failed_member_releases_lab(self, request):
+        request.side_effect = lambda method, url, **kwargs: hub_response(
+            status=500 if method == "PUT" and url.endswith("-target") else 200
+        )
+        conn_name = self.generate()
+
+        # The pods that were created are cleaned up along with the lab
+        deleted = {
+            call[0][1].rsplit("/", 1)[-1]
+            for call in request.call_args_list
+            if call[0][0] == "DELETE"
+        }
+        self.assertEqual(deleted, set(self.pods(conn_name)))
+        self.assertFalse(GuacamoleConnection.objects.exists())
+        self.assertFalse(GuacamoleConnectionGroup.objects.exists())
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 0)
+
+    def test_service_names(self):
+        conn_name = self.generate()
+        service = self.lab.services.get(name="target")
+        for name in ("Target", "target_1", "-target", "target-", "t" * 15):
+            service.name = name
+            with self.subTest(name=name), self.assertRaises(ValidationError):
+                service.full_clean()
+
+        # The longest name that's allowed still gives a valid pod name
+        service.name = "t" * 14
+        service.full_clean()
+        self.assertEqual(len(member_pod_name(conn_name, service.name)), 63)
+
+    def test_bulk_provisioning_is_rejected(self):
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post(
+            reverse("lab_api.bulk_generate"),
+            data={"lab": str(self.lab.id), "usernames": [self.user.username]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(GuacamoleConnection.objects.exists())
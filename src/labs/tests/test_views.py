@@ -0,0 +1,305 @@
+"""
+Tests for the lab API views.
+"""
+
+import json
+import requests
+
+from django.db import connection
+from django.db.models import F
+from django.test import tag, override_settings
+from django.urls import reverse
+from unittest import mock
+from uuid import uuid4
+
+from guacamole.models import GuacamoleConnection
+from labs.jobs import run_job
+from labs.models import LabEnvironment, ProvisioningJob
+from lawliet.test_utils import UnitTest, random_docker_image
+from users.models import User
+
+"""
+---------------------------------------------------
+Helper functions
+---------------------------------------------------
+"""
+
+
+def hub_response(status=200, data=None):
+    """
+    Create a fake response from the Lawliet Hub API server.
+    """
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({} if data is None else data).encode("utf-8")
+    return response
+
+
+def run_on_commit_callbacks():
+    """
+    Run the callbacks registered with transaction.on_commit(). Tests run inside
+    of a transaction that is never committed, so these would otherwise never
+    be called.
+    """
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for (_, callback) in callbacks:
+        callback()
+
+
+"""
+---------------------------------------------------
+GenerateLabView tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "views")
+@override_settings(LAB_PROVISIONING_WORKERS=0, LAB_PROVISIONING_RETRY_DELAY=0)
+class GenerateLabViewTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.url = f"{reverse('lab_api.generate')}?create={self.lab.id}"
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_generate_lab_queues_job(self, put):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 202)
+
+        data = response.json()
+        job = ProvisioningJob.objects.get(id=data["job_id"])
+        conn = GuacamoleConnection.objects.get(user=self.user)
+        self.assertEqual(job.connection, conn)
+        self.assertEqual(data["conn_name"], conn.connection_name)
+
+        # The job should have been run by the (synchronous) provisioning queue
+        self.assertEqual(job.state, ProvisioningJob.SUCCEEDED)
+        self.assertEqual(job.attempts, 1)
+        put.assert_called_once()
+        self.assertEqual(put.call_args[0][0], "PUT")
+        self.assertTrue(put.call_args[0][1].endswith(f"/pods/{conn.connection_name}"))
+        self.assertEqual(
+            put.call_args[1]["json"],
+            {
+                "image": self.lab.url,
+                "ports": [self.lab.port],
+                "resources": self.lab.resources(),
+            },
+        )
+
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(user.n_active_labs, 1)
+
+    @override_settings(LAB_PROVISIONING_MAX_ATTEMPTS=3)
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_failed_jobs_are_retried(self, put):
+        put.side_effect = [
+            requests.ConnectionError("hub unavailable"),
+            hub_response(status=500),
+            hub_response(),
+        ]
+        response = self.client.post(self.url)
+        job = ProvisioningJob.objects.get(id=response.json()["job_id"])
+        self.assertEqual(job.state, ProvisioningJob.SUCCEEDED)
+        self.assertEqual(job.attempts, 3)
+        self.assertEqual(put.call_count, 3)
+
+    @override_settings(LAB_PROVISIONING_MAX_ATTEMPTS=2)
+    @mock.patch(
+        "labs.hub.requests.Session.request", return_value=hub_response(status=503)
+    )
+    def test_job_fails_after_max_attempts(self, put):
+        response = self.client.post(self.url)
+        job = ProvisioningJob.objects.get(id=response.json()["job_id"])
+        self.assertEqual(job.state, ProvisioningJob.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn("503", job.error)
+
+    @override_settings(LAB_PROVISIONING_MAX_ATTEMPTS=2)
+    @mock.patch(
+        "labs.hub.requests.Session.request", return_value=hub_response(status=503)
+    )
+    def test_failed_jobs_release_lab(self, put):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(GuacamoleConnection.objects.exists())
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 0)
+
+        # The job is kept so that the user can find out what went wrong
+        job = ProvisioningJob.objects.get(id=response.json()["job_id"])
+        self.assertIsNone(job.connection)
+        self.assertEqual(job.state, ProvisioningJob.FAILED)
+
+    @override_settings(LAB_PROVISIONING_WORKERS=4)
+    @mock.patch("labs.jobs.get_executor")
+    def test_query_count(self, get_executor):
+        # 2 queries to look up the session and user, then 1 for the lab and 1
+        # for the user's waiting tickets. The lab is created in a transaction
+        # (a savepoint inside of the test's transaction, adding 2 queries),
+        # which looks up the lab's services, claims from the warm pool in a
+        # savepoint (3), looks up the user's entity, and writes the
+        # connection, parameters, permission, lease, lifecycle, job, and
+        # active lab count (8).
+        with self.assertNumQueries(18):
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 1)
+
+    @override_settings(LAB_PROVISIONING_MAX_ATTEMPTS=2)
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_retry_of_created_pod_succeeds(self, put):
+        # The first attempt created the pod, but its response was lost
+        put.side_effect = [requests.ConnectionError("timed out"), hub_response(409)]
+        response = self.client.post(self.url)
+        job = ProvisioningJob.objects.get(id=response.json()["job_id"])
+        self.assertEqual(job.state, ProvisioningJob.SUCCEEDED)
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(GuacamoleConnection.objects.exists())
+
+    @override_settings(LAB_PROVISIONING_MAX_ATTEMPTS=1)
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_failed_jobs_delete_pod(self, request):
+        request.side_effect = [hub_response(500), hub_response()]
+        response = self.client.post(self.url)
+        conn_name = response.json()["conn_name"]
+
+        # The hub may have created the pod anyway, so it's deleted
+        self.assertEqual(request.call_args_list[1][0][0], "DELETE")
+        self.assertTrue(request.call_args_list[1][0][1].endswith(f"/pods/{conn_name}"))
+        self.assertFalse(GuacamoleConnection.objects.exists())
+
+    @override_settings(LAB_PROVISIONING_WORKERS=4)
+    @mock.patch("labs.jobs.get_executor")
+    def test_job_submitted_after_commit(self, get_executor):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 202)
+
+        # The test's transaction is never committed, so the job shouldn't have
+        # been handed to the worker pool until we run the on-commit callbacks.
+        get_executor.return_value.submit.assert_not_called()
+        run_on_commit_callbacks()
+        get_executor.return_value.submit.assert_called_once()
+        self.assertTrue(GuacamoleConnection.objects.exists())
+
+    @override_settings(LAB_PROVISIONING_WORKERS=4)
+    @mock.patch("labs.jobs.get_executor")
+    def test_failed_submit_releases_lab(self, get_executor):
+        get_executor.return_value.submit.side_effect = RuntimeError("shut down")
+        response = self.client.post(self.url)
+        run_on_commit_callbacks()
+
+        job = ProvisioningJob.objects.get(id=response.json()["job_id"])
+        self.assertEqual(job.state, ProvisioningJob.FAILED)
+        self.assertIn("shut down", job.error)
+        self.assertFalse(GuacamoleConnection.objects.exists())
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 0)
+
+    @override_settings(LAB_PROVISIONING_WORKERS=4)
+    @mock.patch("labs.jobs.get_executor")
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_deleted_labs_are_not_created(self, request, get_executor):
+        response = self.client.post(self.url)
+        job_id = response.json()["job_id"]
+
+        # The lab is deleted while its job is still queued
+        GuacamoleConnection.objects.all().delete()
+        job = run_job(job_id)
+        self.assertEqual(job.state, ProvisioningJob.FAILED)
+        self.assertEqual(job.attempts, 0)
+        request.assert_not_called()
+
+    @mock.patch("labs.jobs.record_pod_created", side_effect=RuntimeError("oops"))
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_unexpected_errors_release_lab(self, request, record_pod_created):
+        response = self.client.post(self.url)
+        job = ProvisioningJob.objects.get(id=response.json()["job_id"])
+        self.assertEqual(job.state, ProvisioningJob.FAILED)
+        self.assertIn("oops", job.error)
+        self.assertFalse(GuacamoleConnection.objects.exists())
+        self.assertEqual(User.objects.get(id=self.user.id).n_active_labs, 0)
+        methods = [call[0][0] for call in request.call_args_list]
+        self.assertEqual(methods, ["PUT", "DELETE"])
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_delete_lab_keeps_concurrent_updates(self, request):
+        response = self.client.post(self.url)
+        conn_name = response.json()["conn_name"]
+
+        # Another lab is started, and the user's email is changed, while the
+        # lab is being deleted
+        def update_user(conn_names):
+            User.objects.filter(id=self.user.id).update(
+                n_active_labs=F("n_active_labs") + 1, email="new@colorado.edu"
+            )
+
+        with mock.patch("labs.views.views.record_deleted", side_effect=update_user):
+            response = self.client.post(f"{reverse('lab_api.delete')}?id={conn_name}")
+        self.assertEqual(response.json()["n_deleted"], 1)
+
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(user.n_active_labs, 1)
+        self.assertEqual(user.email, "new@colorado.edu")
+        self.assertFalse(GuacamoleConnection.objects.exists())
+
+    def test_generate_invalid_lab_id(self):
+        response = self.client.post(f"{reverse('lab_api.generate')}?create=not-a-uuid")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(ProvisioningJob.objects.count(), 0)
+
+    def test_generate_nonexistent_lab(self):
+        response = self.client.post(f"{reverse('lab_api.generate')}?create={uuid4()}")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(ProvisioningJob.objects.count(), 0)
+
+
+"""
+---------------------------------------------------
+ProvisioningJobView tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "views")
+@override_settings(LAB_PROVISIONING_WORKERS=0, LAB_PROVISIONING_RETRY_DELAY=0)
+class ProvisioningJobViewTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        with mock.patch(
+            "labs.hub.requests.Session.request", return_value=hub_response()
+        ):
+            response = self.client.post(
+                f"{reverse('lab_api.generate')}?create={self.lab.id}"
+            )
+        self.job_id = response.json()["job_id"]
+
+    def test_get_job_state(self):
+        response = self.client.get(f"{reverse('lab_api.jobs')}?id={self.job_id}")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["state"], ProvisioningJob.SUCCEEDED)
+        self.assertTrue(data["finished"])
+
+    def test_cannot_view_other_users_jobs(self):
+        other = User.objects.create_user(
+            username="meepy-other", email="other@colorado.edu", password=self.password
+        )
+        self.client.force_login(other)
+        response = self.client.get(f"{reverse('lab_api.jobs')}?id={self.job_id}")
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_nonexistent_job(self):
+        response = self.client.get(f"{reverse('lab_api.jobs')}?id=not-a-job")
+        self.assertEqual(response.status_code, 422)
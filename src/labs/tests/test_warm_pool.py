@@ -0,0 +1,159 @@
+"""
+Tests for the warm pod pools.
+"""
+
+import datetime
+
+from django.test import tag, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs.models import LabEnvironment, ProvisioningJob, WarmPod
+from labs.tests.test_views import hub_response
+from labs.warm_pool import claim_pod, in_class_hours, refill_all, target_size
+from lawliet.test_utils import UnitTest, random_docker_image
+
+# A Wednesday at noon, and the following Saturday at noon
+CLASS_TIME = timezone.make_aware(datetime.datetime(2020, 4, 29, 12))
+WEEKEND = timezone.make_aware(datetime.datetime(2020, 5, 2, 12))
+
+READY = {"phase": "Running", "conditions": [{"type": "Ready", "status": "True"}]}
+NOT_READY = {"phase": "Pending", "conditions": [{"type": "Ready", "status": "False"}]}
+
+"""
+---------------------------------------------------
+Warm pool tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "warm-pool")
+@override_settings(
+    LAB_CLASS_HOURS=[8, 22], LAB_CLASS_DAYS=[0, 1, 2, 3, 4], LAB_PROVISIONING_WORKERS=0,
+)
+class WarmPoolTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+            warm_pool_size=3,
+            warm_pool_off_hours_size=1,
+        )
+
+    def test_class_hours(self):
+        self.assertTrue(in_class_hours(CLASS_TIME))
+        self.assertFalse(in_class_hours(CLASS_TIME.replace(hour=23)))
+        self.assertFalse(in_class_hours(WEEKEND))
+        self.assertEqual(target_size(self.lab, CLASS_TIME), 3)
+        self.assertEqual(target_size(self.lab, WEEKEND), 1)
+
+    @mock.patch(
+        "labs.hub.requests.Session.request", return_value=hub_response(data=READY)
+    )
+    def test_refill_creates_pods(self, request):
+        refill_all(now=CLASS_TIME)
+        self.assertEqual(WarmPod.objects.filter(state=WarmPod.PENDING).count(), 3)
+        self.assertEqual(request.call_count, 3)
+        for call in request.call_args_list:
+            self.assertEqual(call[0][0], "PUT")
+
+        # Refilling a full pool shouldn't create any new pods, but should mark
+        # the ones that are ready as idle
+        refill_all(now=CLASS_TIME)
+        self.assertEqual(WarmPod.objects.filter(state=WarmPod.IDLE).count(), 3)
+        methods = [call[0][0] for call in request.call_args_list]
+        self.assertEqual(methods[3:], ["GET"] * 3)
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_pods_are_idle_once_ready(self, request):
+        request.return_value = hub_response(data=NOT_READY)
+        refill_all(now=CLASS_TIME)
+        refill_all(now=CLASS_TIME)
+        self.assertEqual(WarmPod.objects.filter(state=WarmPod.PENDING).count(), 3)
+        self.assertIsNone(claim_pod(self.lab))
+
+        request.return_value = hub_response(data=READY)
+        refill_all(now=CLASS_TIME)
+        self.assertEqual(WarmPod.objects.filter(state=WarmPod.IDLE).count(), 3)
+        self.assertIsNotNone(claim_pod(self.lab))
+
+    @mock.patch(
+        "labs.hub.requests.Session.request", return_value=hub_response(data=READY)
+    )
+    def test_outdated_pods_are_drained(self, request):
+        refill_all(now=CLASS_TIME)
+        refill_all(now=CLASS_TIME)
+        old = set(WarmPod.objects.values_list("name", flat=True))
+
+        # Pods created from the lab's old image can't be claimed, and are
+        # replaced by the next refill
+        self.lab.image_digest = "sha256:" + "a" * 64
+        self.lab.save()
+        self.assertIsNone(claim_pod(self.lab))
+
+        request.reset_mock()
+        refill_all(now=CLASS_TIME)
+        pods = WarmPod.objects.all()
+        self.assertEqual(len(pods), 3)
+        self.assertTrue(old.isdisjoint(pod.name for pod in pods))
+        for pod in pods:
+            self.assertEqual(pod.image, self.lab.pod_image())
+
+        methods = [call[0][0] for call in request.call_args_list]
+        self.assertEqual(methods.count("DELETE"), 3)
+        self.assertEqual(methods.count("PUT"), 3)
+        for call in request.call_args_list:
+            if call[0][0] == "PUT":
+                self.assertEqual(call[1]["json"]["image"], self.lab.pod_image())
+
+    @mock.patch(
+        "labs.hub.requests.Session.request", return_value=hub_response(data=READY)
+    )
+    def test_pool_shrinks_outside_class_hours(self, request):
+        refill_all(now=CLASS_TIME)
+        refill_all(now=WEEKEND)
+        self.assertEqual(WarmPod.objects.count(), 1)
+        methods = [call[0][0] for call in request.call_args_list]
+        self.assertEqual(methods.count("DELETE"), 2)
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_failed_pods_are_not_added(self, request):
+        request.side_effect = [hub_response(), hub_response(status=500), hub_response()]
+        refill_all(now=CLASS_TIME)
+        self.assertEqual(WarmPod.objects.count(), 2)
+
+    def test_claim_pod(self):
+        self.assertIsNone(claim_pod(self.lab))
+        pending = WarmPod.objects.create(lab=self.lab)
+        idle = WarmPod.objects.create(
+            lab=self.lab, state=WarmPod.IDLE, image=self.lab.pod_image()
+        )
+        self.assertEqual(claim_pod(self.lab), idle.name)
+        self.assertIsNone(claim_pod(self.lab))
+        self.assertTrue(WarmPod.objects.filter(name=pending.name).exists())
+
+    @mock.patch("labs.hub.requests.Session.request", return_value=hub_response())
+    def test_generate_lab_uses_warm_pod(self, request):
+        pod = WarmPod.objects.create(
+            lab=self.lab, state=WarmPod.IDLE, image=self.lab.pod_image()
+        )
+        response = self.client.post(
+            f"{reverse('lab_api.generate')}?create={self.lab.id}"
+        )
+        self.assertEqual(response.status_code, 202)
+
+        # The new connection should be bound to the warm pod, without
+        # having to ask the hub to create a new pod.
+        conn = GuacamoleConnection.objects.get(user=self.user)
+        self.assertEqual(conn.connection_name, pod.name)
+        self.assertFalse(WarmPod.objects.exists())
+        request.assert_not_called()
+
+        job = ProvisioningJob.objects.get(id=response.json()["job_id"])
+        self.assertEqual(job.state, ProvisioningJob.SUCCEEDED)
@@ -0,0 +1,194 @@
+"""
+Tests for the local pod state table and the watch consumer.
+"""
+
+import json
+import requests
+
+from django.core.cache import cache
+from django.test import tag, override_settings
+from django.urls import reverse
+from unittest import mock
+
+from guacamole.models import GuacamoleConnection
+from labs.models import LabEnvironment, PodState
+from labs.tests.test_views import hub_response
+from labs.watch import WatchExpired, consume, resync, watch
+from lawliet.test_utils import UnitTest, random_docker_image
+
+READY = [{"type": "Ready", "status": "True"}]
+NOT_READY = [{"type": "Ready", "status": "False"}]
+
+"""
+---------------------------------------------------
+Helper functions
+---------------------------------------------------
+"""
+
+
+def pod(name, phase="Running", conditions=READY, version="1"):
+    return {
+        "name": name,
+        "phase": phase,
+        "conditions": conditions,
+        "resourceVersion": version,
+    }
+
+
+def event(kind, obj):
+    return json.dumps({"type": kind, "object": obj})
+
+
+class FakeHub:
+    """
+    A stand-in for HubClient that serves a fixed pod listing and a sequence of
+    event streams, one for every time the watch is (re)opened.
+    """
+
+    def __init__(self, listings, streams):
+        self.listings = list(listings)
+        self.streams = list(streams)
+        self.watched_from = []
+
+    def list_pods(self):
+        return self.listings.pop(0)
+
+    def watch_pods(self, resource_version=None):
+        self.watched_from.append(resource_version)
+        for line in self.streams.pop(0):
+            if isinstance(line, Exception):
+                raise line
+            yield line
+
+
+"""
+---------------------------------------------------
+Watch consumer tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "watch")
+class WatchTestCase(UnitTest):
+    def status(self, name):
+        return PodState.objects.get(connection_name=name).as_status()
+
+    def test_consume_events(self):
+        version = consume(
+            [
+                event("ADDED", pod("a", "Pending", NOT_READY, "1")),
+                event("ADDED", pod("b", version="2")),
+                "",
+                event("MODIFIED", pod("a", version="3")),
+                event("DELETED", pod("b", version="4")),
+                event("BOOKMARK", {"resourceVersion": "5"}),
+            ]
+        )
+        self.assertEqual(version, "5")
+        self.assertEqual(self.status("a"), {"phase": "Running", "conditions": READY})
+        self.assertFalse(PodState.objects.filter(connection_name="b").exists())
+
+    def test_error_events(self):
+        with self.assertRaises(WatchExpired):
+            consume([event("ERROR", {"message": "too old resource version"})])
+
+    def test_resync(self):
+        consume(
+            [event("ADDED", pod("a", "Pending", NOT_READY)), event("ADDED", pod("b"))]
+        )
+        resync([pod("a"), pod("c")])
+
+        self.assertEqual(
+            set(PodState.objects.values_list("connection_name", flat=True)), {"a", "c"},
+        )
+        self.assertEqual(self.status("a"), {"phase": "Running", "conditions": READY})
+
+    @mock.patch("labs.watch.time.sleep")
+    def test_resync_on_reconnect(self, sleep):
+        # The first stream drops partway through, and pod "b" is deleted while
+        # we're disconnected. Reconnecting should resync the table.
+        hub = FakeHub(
+            listings=[([pod("a"), pod("b")], "10"), ([pod("a")], "20")],
+            streams=[
+                [event("ADDED", pod("c", version="11")), requests.ConnectionError()],
+                [event("MODIFIED", pod("a", "Pending", NOT_READY, "21"))],
+            ],
+        )
+        watch(client=hub, max_reconnects=1)
+
+        self.assertEqual(hub.watched_from, ["10", "20"])
+        self.assertEqual(
+            list(PodState.objects.values_list("connection_name", flat=True)), ["a"]
+        )
+        self.assertEqual(
+            self.status("a"), {"phase": "Pending", "conditions": NOT_READY}
+        )
+        sleep.assert_called_once()
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_hub_client(self, request):
+        listing = hub_response(data={"items": [pod("a")], "resourceVersion": "7"})
+        stream = requests.Response()
+        stream.status_code = 200
+        stream._content = "\n".join(
+            [event("MODIFIED", pod("a", version="8")), event("DELETED", pod("a"))]
+        ).encode("utf-8")
+        stream._content_consumed = True
+        request.side_effect = [listing, stream]
+
+        with mock.patch("labs.watch.time.sleep"):
+            watch(max_reconnects=0)
+
+        self.assertFalse(PodState.objects.exists())
+        self.assertEqual(request.call_args[0][1].split("/", 3)[-1], "pods/watch")
+        self.assertEqual(request.call_args[1]["params"], {"resourceVersion": "7"})
+
+
+"""
+---------------------------------------------------
+View tests
+---------------------------------------------------
+"""
+
+
+@tag("labs", "watch", "views")
+@override_settings(LAB_POD_STATE_WATCH=True)
+class LocalPodStateViewTestCase(UnitTest):
+    def setUp(self):
+        super().setUp(preauth=True)
+        cache.clear()
+        self.lab = LabEnvironment.objects.create(
+            name="Cutter",
+            description="Cutter lab environment",
+            url=random_docker_image(self.rd),
+            protocol="ssh",
+            port=22,
+        )
+        self.conn = GuacamoleConnection.objects.create(
+            protocol="ssh", lab=self.lab, user=self.user
+        )
+        self.name = self.conn.connection_name
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_pod_status(self, request):
+        url = f"{reverse('lab_api.pod.pod_status')}?id={self.name}"
+        self.assertEqual(self.client.get(url).json(), {"phase": "", "conditions": []})
+
+        PodState.objects.create(
+            connection_name=self.name, phase="Running", conditions=json.dumps(READY)
+        )
+        self.assertEqual(
+            self.client.get(url).json(), {"phase": "Running", "conditions": READY}
+        )
+        request.assert_not_called()
+
+    @mock.patch("labs.hub.requests.Session.request")
+    def test_lab_info(self, request):
+        PodState.objects.create(
+            connection_name=self.name, phase="Running", conditions=json.dumps(READY)
+        )
+        data = self.client.get(reverse("lab_api.info")).json()
+        self.assertEqual(len(data), 1)
+        self.assertTrue(data[0]["ready"])
+        self.assertEqual(data[0]["status"]["phase"], "Running")
+        request.assert_not_called()
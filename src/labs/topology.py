@@ -0,0 +1,218 @@
+"""
+Multi-machine labs.
+
+Every lab runs the lab environment's own image as its primary pod, whose name
+is the lab's connection name. A lab environment can also have any number of
+LabServices (e.g. the targets in an attack-defend exercise), each of which
+runs as a member pod named after the lab and the service.
+
+All of a lab's pods are created through the hub concurrently, so a lab takes
+as long to start as its slowest machine. The lab's connection and the
+connections to each of its members are grouped together in a
+GuacamoleConnectionGroup named after the lab, and the lab is only reported
+as ready once every one of its pods is (see labs.status.lab_status).
+
+The member connections are the record of which pods a lab has, so changes to
+the lab environment's services only affect the labs started after them. Only
+the members running a reachable service can be connected to by the user.
+"""
+
+import logging
+import requests
+
+from django.conf import settings
+from guacamole.models import (
+    GuacamoleConnection,
+    GuacamoleConnectionGroup,
+    GuacamoleConnectionParameter,
+    GuacamoleConnectionPermission,
+)
+from labs.hub import get_client, run_concurrently
+from labs.models import LabEnvironment, LabService
+
+logger = logging.getLogger("labs")
+
+"""
+---------------------------------------------------
+Member pods
+---------------------------------------------------
+"""
+
+
+def member_pod_name(conn_name, service_name):
+    """
+    Return the name of the pod running one of a lab's services.
+    """
+    return f"{conn_name}-{service_name}"
+
+
+def lab_pods(conns):
+    """
+    Return a dictionary mapping the connection name of each lab in a group of
+    labs to the names of all of its pods, starting with its primary pod. The
+    member pods are the ones recorded (as member connections) when the lab was
+    started, so services added to the lab environment since then don't count.
+
+    Parameters
+    ----------
+    conns (iterable of GuacamoleConnection)
+        The connections for the labs.
+    """
+    conns = list(conns)
+    names = {conn.connection_id: conn.connection_name for conn in conns}
+    pods = {name: [name] for name in names.values()}
+    if conns:
+        rows = (
+            GuacamoleConnection.objects.filter(primary_id__in=list(names))
+            .order_by("connection_name")
+            .values_list("primary_id", "connection_name")
+        )
+        for (primary_id, name) in rows:
+            pods[names[primary_id]].append(name)
+    return pods
+
+
+def pods_from_rows(rows):
+    """
+    Return a dictionary mapping connection names to the names of all of their
+    labs' pods, from (connection name, member name) pairs as returned by
+    values_list("connection_name", "members__connection_name"). The member
+    name is None for labs with only one machine.
+    """
+    pods = {}
+    for (conn_name, member) in rows:
+        members = pods.setdefault(conn_name, [conn_name])
+        if member:
+            members.append(member)
+    for members in pods.values():
+        members[1:] = sorted(members[1:])
+    return pods
+
+
+def member_usage():
+    """
+    Return a list with the node pool, CPU request, and memory request of every
+    member pod that is running. Member pods are placed on the same node pool
+    as their lab, and request the resources of the service that they run.
+    """
+    requests = {
+        (lab_id, name): (cpu, memory)
+        for (lab_id, name, cpu, memory) in LabService.objects.values_list(
+            "lab_id", "name", "cpu_request", "memory_request"
+        )
+    }
+    rows = GuacamoleConnection.objects.exclude(primary=None).values_list(
+        "lab_id", "primary__connection_name", "primary__node_pool", "connection_name"
+    )
+
+    usage = []
+    for (lab_id, conn_name, node_pool, name) in rows:
+        # Services that have been removed since the lab started aren't counted
+        service = name[len(conn_name) + 1 :]
+        cpu, memory = requests.get((lab_id, service), (0, 0))
+        usage.append((node_pool, cpu, memory))
+    return usage
+
+
+def create_lab_pods(conn: GuacamoleConnection, lab: LabEnvironment, services):
+    """
+    Ask the hub to create all of a lab's pods at once. Pods that already exist
+    (because they were created by an earlier attempt) are left alone.
+
+    Returns
+    ----------
+    dict
+        A dictionary mapping the name of each pod to the exception raised
+        while creating it, or to None if it was created.
+    """
+    client = get_client(conn.hub_backend)
+    specs = {conn.connection_name: lab}
+    for service in services:
+        specs[member_pod_name(conn.connection_name, service.name)] = service
+
+    def create(name):
+        spec = specs[name]
+        try:
+            client.create_pod(
+                name,
+                image=spec.pod_image(),
+                ports=[spec.port] if spec.port is not None else [],
+                resources=spec.resources(),
+                node_pool=conn.node_pool,
+            )
+        except requests.HTTPError as ex:
+            if ex.response is None or ex.response.status_code != 409:
+                raise
+
+    return run_concurrently(create, list(specs), settings.LAB_BULK_CONCURRENCY)
+
+
+"""
+---------------------------------------------------
+Guacamole rows
+---------------------------------------------------
+"""
+
+
+def create_group(conn: GuacamoleConnection):
+    """
+    Create the GuacamoleConnectionGroup for a multi-machine lab. This must be
+    called before the lab's connection is saved, so that the connection can be
+    added to the group.
+    """
+    group = GuacamoleConnectionGroup.objects.create(
+        connection_group_name=conn.connection_name,
+        type="ORGANIZATIONAL",
+        enable_session_affinity=0,
+    )
+    conn.parent = group
+    return group
+
+
+def create_member_connections(conn: GuacamoleConnection, services, entity_id):
+    """
+    Create a connection for each of the services of a lab, in the lab's
+    connection group. These connections record which member pods the lab has,
+    for as long as it runs. Only the connections to reachable services are
+    given parameters and a permission, so that the user can connect to them.
+
+    Returns
+    ----------
+    list of GuacamoleConnection
+        The new connections.
+    """
+    # Imported here, since labs.bulk depends on this module (through
+    # labs.teardown)
+    from labs.bulk import connection_rows
+
+    members, params, perms = [], [], []
+    for service in services:
+        member = GuacamoleConnection.objects.create(
+            connection_name=member_pod_name(conn.connection_name, service.name),
+            parent=conn.parent,
+            primary=conn,
+            protocol=service.protocol if service.reachable else "",
+            lab=conn.lab,
+            user=conn.user,
+            hub_backend=conn.hub_backend,
+        )
+        members.append(member)
+        if not service.reachable:
+            continue
+        member_params, perm = connection_rows(member, service, entity_id)
+        params.extend(member_params)
+        perms.append(perm)
+
+    GuacamoleConnectionParameter.objects.bulk_create(params)
+    GuacamoleConnectionPermission.objects.bulk_create(perms)
+    return members
+
+
+def delete_groups(conn_names):
+    """
+    Delete the connection groups of a group of labs, once their connections
+    have been deleted.
+    """
+    GuacamoleConnectionGroup.objects.filter(
+        connection_group_name__in=list(conn_names), parent=None
+    ).delete()
@@ -3,8 +3,22 @@ from labs.views import *
 
 urlpatterns = [
     url(r"^generate$", GenerateLabView.as_view(), name="lab_api.generate"),
+    url(
+        r"^bulk-generate$", BulkGenerateLabView.as_view(), name="lab_api.bulk_generate",
+    ),
     url(r"^delete$", DeleteLabView.as_view(), name="lab_api.delete"),
+    url(r"^lease/extend$", ExtendLeaseView.as_view(), name="lab_api.lease.extend"),
+    url(
+        r"^pod/status/batch$",
+        PodStatusBatchView.as_view(),
+        name="lab_api.pod.pod_status_batch",
+    ),
     url(r"^pod/status", PodStatusView.as_view(), name="lab_api.pod.pod_status"),
+    url(r"^pod/events$", PodEventsView.as_view(), name="lab_api.pod.events"),
     url(r"^list", LabListView.as_view(), name="lab_api.list"),
     url(r"^info$", LabInfoView.as_view(), name="lab_api.info"),
+    url(r"^jobs$", ProvisioningJobView.as_view(), name="lab_api.jobs"),
+    url(r"^queue$", AdmissionTicketView.as_view(), name="lab_api.queue"),
+    url(r"^metrics$", LabMetricsView.as_view(), name="lab_api.metrics"),
+    url(r"^hub/stats$", HubStatsView.as_view(), name="lab_api.hub.stats"),
 ]
@@ -1,16 +1,50 @@
 import abc
 import json
 import logging
+import math
 import os
 import requests
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core import serializers
-from django.http import JsonResponse, HttpResponse
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views import View
 from django.urls import reverse
-from labs.models import LabEnvironment
+from labs.bulk import provision_roster
+from labs.hub import (
+    HubUnavailable,
+    get_backends,
+    get_client,
+    hub_retry_after,
+    is_hub_failure,
+    run_concurrently,
+)
+from labs.admission import (
+    QuotaExceeded,
+    request_admission,
+    ticket_status,
+)
+from labs.idempotency import IdempotentPostMixin
+from labs.jobs import start_lab
+from labs.lifecycle import MAX_METRICS_WINDOW, latency_report, record_deleted
+from labs.leases import extend_lease, max_expiry, new_lease
+from labs.models import AdmissionTicket, LabEnvironment, LabLease, ProvisioningJob
+from labs.placement import backend_loads
+from labs.status import (
+    batch_poll_interval,
+    get_lab_status,
+    get_lab_statuses,
+    is_ready,
+    observe_statuses,
+    pod_events,
+    poll_interval,
+)
+from labs.teardown import decrement_active_labs
+from labs.topology import delete_groups, lab_pods, pods_from_rows
 from guacamole.models import (
     GuacamoleConnection,
     GuacamoleConnectionParameter,
@@ -26,7 +60,13 @@ class HubAPIView(LoginRequiredMixin, View, metaclass=abc.ABCMeta):
     """
 
     logger = logging.getLogger("labs")
-    api_server_host = "http://lawliet-k8s-api-server"
+
+    @property
+    def hub(self):
+        """
+        The HubClient that should be used to communicate with the hub.
+        """
+        return get_client()
 
     def generate_response(self, *args, status=200, **kwargs):
         """
@@ -37,14 +77,26 @@ class HubAPIView(LoginRequiredMixin, View, metaclass=abc.ABCMeta):
         self.logger.info(f"kwargs = {kwargs}")
         return JsonResponse(kwargs, status=status)
 
+    def unavailable_response(self):
+        """
+        Return a 503 response for a request that can't be served because the
+        hub is unavailable, telling the client when to try again.
+        """
+        response = self.generate_response(
+            status=503, err="The lab server is temporarily unavailable"
+        )
+        response["Retry-After"] = max(math.ceil(hub_retry_after()), 1)
+        return response
 
-class GenerateLabView(HubAPIView):
+
+class GenerateLabView(IdempotentPostMixin, HubAPIView):
     def post(self, request):
         username = request.user.username
         lab_id = request.GET.get("create", "")
-        labenv = LabEnvironment.objects.filter(id=lab_id)
 
-        if not labenv.exists():
+        try:
+            lab = LabEnvironment.objects.get(id=lab_id)
+        except (LabEnvironment.DoesNotExist, ValidationError):
             self.logger.info(
                 (
                     f"User {username!r} failed to create new lab environment: lab "
@@ -55,63 +107,143 @@ class GenerateLabView(HubAPIView):
                 status=422, err=f"Lab environment does not exist", id=lab_id,
             )
         else:
-            image = labenv[0].url
-            protocol = labenv[0].protocol
-            port = labenv[0].port
-
-            # Create a new GuacamoleConnection to the container
-            conn = GuacamoleConnection.objects.create(
-                # connection_name="ssh-test",
-                protocol=protocol,
-                lab=labenv[0],
-                user=request.user,
-            )
-            GuacamoleConnectionParameter.objects.bulk_create(
-                [
-                    GuacamoleConnectionParameter(
-                        connection=conn,
-                        parameter_name="hostname",
-                        parameter_value=conn.connection_name,
-                    ),
-                    GuacamoleConnectionParameter(
-                        connection=conn, parameter_name="port", parameter_value=port,
-                    ),
-                ]
-            )
-
-            # Give the user permission to connect to the container
-            entity = GuacamoleEntity.objects.get(
-                name=request.user.username, type="USER"
-            )
-            perm = GuacamoleConnectionPermission.objects.create(
-                entity=entity, connection=conn, permission="READ",
-            )
+            # Fail fast while every hub is down, rather than creating a lab
+            # whose pod can't be created.
+            if hub_retry_after() > 0:
+                self.logger.info(
+                    f"User {username!r} failed to create lab: hub unavailable"
+                )
+                return self.unavailable_response()
 
+            # If the cluster is full, the request joins the admission queue
+            # rather than creating a pod that can't be scheduled.
             try:
-                msg = f"Username {username!r} requested to create a new lab (lab id: {lab_id})"
-                msg += f" (image: {image}) (port: {port})"
-                self.logger.info(msg)
-                endpoint = f"{self.api_server_host}/pods/{conn.connection_name}"
-                response = requests.put(
-                    endpoint, json={"image": image, "ports": [port]}
+                ticket = request_admission(lab, request.user)
+            except QuotaExceeded as ex:
+                self.logger.info(f"User {username!r} failed to create lab: {ex}")
+                return self.generate_response(status=429, err=str(ex), id=lab_id)
+
+            if ticket is not None:
+                self.logger.info(
+                    f"Username {username!r} queued to create a new lab "
+                    f"(lab id: {lab_id}) (ticket: {ticket.id})"
+                )
+                return self.generate_response(
+                    status=202,
+                    msg="Lab start has been queued",
+                    id=lab_id,
+                    **ticket_status(ticket),
                 )
-            except Exception as ex:
-                self.logger.error(f"API error creating lab: {ex}")
 
-            # Increment the number of active labs that the user has
-            request.user.n_active_labs += 1
-            request.user.save()
+            conn, job, lease = start_lab(lab, request.user)
+
+            msg = f"Username {username!r} requested to create a new lab (lab id: {lab_id})"
+            msg += f" (image: {lab.url}) (port: {lab.port})"
+            self.logger.info(msg)
 
             return self.generate_response(
-                status=200,
-                msg="Successfully created lab",
+                status=202,
+                msg="Lab creation has been queued",
                 id=lab_id,
-                protocol=protocol,
-                port=port,
+                job_id=job.id,
+                conn_name=conn.connection_name,
+                expires_at=lease.expires_at.isoformat(),
+                protocol=lab.protocol,
+                port=lab.port,
             )
 
 
-class DeleteLabView(HubAPIView):
+class BulkGenerateLabView(UserPassesTestMixin, HubAPIView):
+    """
+    Create a lab for every user in a class roster. Only available to staff.
+
+    The request body should be a JSON object containing the id of the lab
+    ("lab"), and either a list of usernames ("usernames") or the name of a
+    group of users ("group"). The number of pod creation requests that are
+    sent to the hub at once can optionally be limited with "concurrency", up
+    to LAB_BULK_CONCURRENCY.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def validate(self, body):
+        """
+        Return a description of what's wrong with the body of a request, or
+        None if it's valid.
+        """
+        if not isinstance(body, dict):
+            return "Request body must be a JSON object"
+
+        usernames = body.get("usernames")
+        if usernames is not None and not (
+            isinstance(usernames, list)
+            and all(isinstance(name, str) for name in usernames)
+        ):
+            return "usernames must be a list of strings"
+
+        group = body.get("group")
+        if group is not None and not isinstance(group, str):
+            return "group must be a string"
+
+        # Booleans are ints too, but they aren't a concurrency
+        concurrency = body.get("concurrency")
+        limit = settings.LAB_BULK_CONCURRENCY
+        if concurrency is not None and (
+            type(concurrency) is not int or not 1 <= concurrency <= limit
+        ):
+            return f"concurrency must be an integer between 1 and {limit}"
+
+        return None
+
+    def post(self, request):
+        try:
+            body = json.loads(request.body or "{}")
+        except ValueError:
+            return self.generate_response(status=400, err="Request body must be JSON")
+
+        error = self.validate(body)
+        if error is not None:
+            return self.generate_response(status=400, err=error)
+
+        try:
+            lab = LabEnvironment.objects.get(id=body.get("lab"))
+        except (TypeError, ValueError, ValidationError, LabEnvironment.DoesNotExist):
+            return self.generate_response(
+                status=422, err="Lab environment does not exist"
+            )
+
+        # Multi-machine labs are started one at a time through GenerateLabView
+        if lab.services.exists():
+            return self.generate_response(
+                status=422,
+                err="Multi-machine labs can't be provisioned in bulk",
+                id=lab.id,
+            )
+
+        if "usernames" not in body and "group" not in body:
+            return self.generate_response(
+                status=422, err="Either usernames or group must be provided"
+            )
+
+        self.logger.info(
+            f"User {request.user.username!r} requested bulk creation of lab "
+            f"{lab.name!r}"
+        )
+        try:
+            report = provision_roster(
+                lab,
+                usernames=body.get("usernames"),
+                group=body.get("group"),
+                max_workers=body.get("concurrency"),
+            )
+        except HubUnavailable:
+            return self.unavailable_response()
+
+        return self.generate_response(status=200, id=lab.id, results=report)
+
+
+class DeleteLabView(IdempotentPostMixin, HubAPIView):
     """
     Delete a user's active lab environment
     """
@@ -128,38 +260,106 @@ class DeleteLabView(HubAPIView):
                 status=422, err="Connection name not provided"
             )
 
-        conns = GuacamoleConnection.objects.filter(connection_name=conn_name)
+        conns = GuacamoleConnection.objects.filter(
+            connection_name=conn_name, primary=None
+        )
         if not conns.exists():
             return self.generate_response(
                 status=422, err=f"Connection {conn_name} does not exist"
             )
 
-        conns = conns.filter(user=user)
-        if not conns.exists():
+        conns = list(conns.filter(user=user).only("lab_id", "hub_backend"))
+        if not conns:
             return self.generate_response(
                 status=403, err=f"Cannot delete {conn_name}: permission denied"
             )
 
-        endpoint = f"{self.api_server_host}/pods/{conn_name}"
+        # Every pod of a multi-machine lab is deleted at once
+        backend = conns[0].hub_backend
+        pods = lab_pods(conns)[conn_name]
+        results = run_concurrently(
+            lambda name: get_client(backend).delete_pod(name),
+            pods,
+            settings.LAB_BULK_CONCURRENCY,
+        )
+        for ex in results.values():
+            if ex is not None:
+                self.logger.error(f"API error deleting lab: {ex}")
+
+        with transaction.atomic():
+            record_deleted([conn_name])
+
+            # Delete the connection, along with the connections to the lab's
+            # other machines (which are deleted first, so that only the lab
+            # itself is counted)
+            if len(pods) > 1:
+                GuacamoleConnection.objects.filter(
+                    primary__connection_name=conn_name
+                ).delete()
+            _, deleted = GuacamoleConnection.objects.filter(
+                connection_name=conn_name, primary=None
+            ).delete()
+            n_connections = deleted.get(GuacamoleConnection._meta.label, 0)
+            if len(pods) > 1:
+                delete_groups([conn_name])
+
+            # Decrement the number of active labs that the user has. This is
+            # done in the database, so that concurrent requests can't lose an
+            # update.
+            if n_connections:
+                decrement_active_labs({user.id: n_connections})
 
-        try:
-            response = requests.delete(endpoint)
-        except Exception as ex:
-            self.logger.error(f"API error deleting lab: {ex}")
+        return self.generate_response(
+            status=200, msg="Successfully deleted labs", n_deleted=n_connections,
+        )
+
+
+class ExtendLeaseView(HubAPIView):
+    """
+    Extend the lease on one of a user's labs, so that it runs for longer before
+    it is deleted.
+    """
+
+    def post(self, request):
+        conn_name = request.GET.get("id", None)
+
+        if conn_name is None:
+            return self.generate_response(
+                status=422, err="Connection name not provided"
+            )
 
-        conn = GuacamoleConnection.objects.filter(connection_name=conn_name)
-        n_connections = len(conn)
+        lease = (
+            LabLease.objects.filter(connection__connection_name=conn_name)
+            .select_related("connection")
+            .first()
+        )
+        if lease is None:
+            return self.generate_response(
+                status=422, err=f"Lab {conn_name} does not have a lease"
+            )
 
-        # Decrement the number of active labs that the user has
-        if request.user.n_active_labs > 0:
-            request.user.n_active_labs -= 1
-            request.user.save()
+        if lease.connection.user_id != request.user.id:
+            return self.generate_response(
+                status=403, err=f"Cannot extend {conn_name}: permission denied"
+            )
 
-        # Delete the connection
-        conn.delete()
+        if not extend_lease(lease):
+            return self.generate_response(
+                status=409,
+                err=f"Lab {conn_name} has reached its maximum lifetime",
+                expires_at=lease.expires_at.isoformat(),
+            )
 
+        self.logger.info(
+            f"User {request.user.username} extended the lease on {conn_name} "
+            f"until {lease.expires_at}"
+        )
+        limit = max_expiry(lease)
         return self.generate_response(
-            status=200, msg="Successfully deleted labs", n_deleted=n_connections,
+            status=200,
+            msg="Lease extended",
+            expires_at=lease.expires_at.isoformat(),
+            max_expires_at=None if limit is None else limit.isoformat(),
         )
 
 
@@ -180,9 +380,11 @@ class LabInfoView(HubAPIView):
     """
 
     def get(self, request):
-        user = request.user
-        fields = ("name", "url", "protocol")
-        conns = GuacamoleConnection.objects.filter(user=request.user)
+        conns = (
+            GuacamoleConnection.objects.filter(user=request.user, primary=None)
+            .select_related("lab", "lease")
+            .prefetch_related("members")
+        )
 
         data = []
         for conn in conns:
@@ -193,14 +395,51 @@ class LabInfoView(HubAPIView):
                     "protocol": conn.lab.protocol,
                     "conn_id": conn.connection_id,
                     "conn_name": conn.connection_name,
+                    "expires_at": lease_expiry(conn),
+                    # Connections to the other machines in multi-machine labs
+                    # that the user can connect to
+                    "members": [
+                        {
+                            "protocol": member.protocol,
+                            "conn_id": member.connection_id,
+                            "conn_name": member.connection_name,
+                        }
+                        for member in conn.members.all()
+                        if member.protocol
+                    ],
                 }
             )
 
+        # When pod states are kept in the local PodState table we can include
+        # each lab's status without any requests to the hub.
+        if settings.LAB_POD_STATE_WATCH:
+            statuses, _ = get_lab_statuses(lab_pods(conns))
+            for lab in data:
+                lab["status"] = statuses[lab["conn_name"]]
+                lab["ready"] = is_ready(lab["status"])
+
         data = json.dumps(data)
         return HttpResponse(data, status=200, content_type="application/json")
 
 
+def lease_expiry(conn):
+    """
+    Return the time at which a connection's lease expires as an ISO 8601
+    string, or None if it doesn't have a lease.
+    """
+    try:
+        return conn.lease.expires_at.isoformat()
+    except LabLease.DoesNotExist:
+        return None
+
+
 class PodStatusView(HubAPIView):
+    """
+    Get the status of the pod for one of a user's labs. Statuses are cached, so
+    the response includes a Retry-After header telling the client how long to
+    wait before checking again.
+    """
+
     def get(self, request):
         conn_name = request.GET.get("id", None)
 
@@ -209,19 +448,215 @@ class PodStatusView(HubAPIView):
                 status=422, err="Connection name not provided"
             )
 
-        conns = GuacamoleConnection.objects.filter(connection_name=conn_name)
-        if not conns.exists():
+        # The lab's member connections are looked up in the same query, to
+        # find the pods of multi-machine labs.
+        rows = list(
+            GuacamoleConnection.objects.filter(
+                connection_name=conn_name, primary=None
+            ).values_list("user_id", "hub_backend", "members__connection_name")
+        )
+        if not rows:
             return self.generate_response(
                 status=422, err=f"Connection {conn_name} does not exist"
             )
 
-        conns = conns.filter(user=request.user)
-        if not conns.exists():
+        owner, backend, _ = rows[0]
+        if owner != request.user.id:
             return self.generate_response(
                 status=403, err=f"Cannot delete {conn_name}: permission denied"
             )
 
-        endpoint = f"{self.api_server_host}/pods/{conn_name}"
-        response = requests.get(endpoint).json()
-        self.logger.info(f"Response: {response}")
-        return JsonResponse(response)
+        pods = pods_from_rows((conn_name, member) for (_, _, member) in rows)
+        try:
+            status = get_lab_status(conn_name, pods[conn_name], backend)
+        except requests.RequestException as ex:
+            self.logger.error(f"Unable to get status of {conn_name}: {ex}")
+            if not is_hub_failure(ex):
+                return self.generate_response(
+                    status=502, err=f"Unable to get status of {conn_name}"
+                )
+            return self.unavailable_response()
+
+        observe_statuses({conn_name: status})
+        self.logger.debug(f"Response: {status}")
+        response = JsonResponse(status)
+        response["Retry-After"] = math.ceil(poll_interval(status))
+        return response
+
+
+class PodStatusBatchView(HubAPIView):
+    """
+    Get the statuses of the pods for many of a user's labs in one request. The
+    labs are given as any number of "id" parameters; if none are given, the
+    statuses of all of the user's labs are returned.
+    """
+
+    def get(self, request):
+        conn_names = request.GET.getlist("id")
+
+        # Look up the requested connections that belong to the user, so that
+        # ownership is checked with a single query.
+        owned = GuacamoleConnection.objects.filter(user=request.user, primary=None)
+        if conn_names:
+            owned = owned.filter(connection_name__in=conn_names)
+        rows = list(
+            owned.values_list(
+                "connection_name", "hub_backend", "members__connection_name"
+            )
+        )
+        backends = {name: backend for (name, backend, _) in rows}
+        if not conn_names:
+            conn_names = list(backends)
+
+        pods = pods_from_rows((name, member) for (name, _, member) in rows)
+        statuses, errors = get_lab_statuses(pods, backends)
+        for (name, ex) in errors.items():
+            self.logger.error(f"Unable to get status of {name}: {ex}")
+        observe_statuses(statuses)
+
+        results = {}
+        for name in conn_names:
+            if name in statuses:
+                results[name] = statuses[name]
+            elif name in errors:
+                results[name] = {"error": "Unable to get pod status"}
+            else:
+                results[name] = {
+                    "error": f"Connection {name} does not exist or permission denied"
+                }
+
+        response = JsonResponse({"statuses": results})
+        response["Retry-After"] = math.ceil(batch_poll_interval(statuses, errors))
+        return response
+
+
+class PodEventsView(HubAPIView):
+    """
+    Stream readiness updates for all of a user's labs as Server-Sent Events.
+    Only available when LAB_POD_EVENTS is turned on, since every stream holds
+    a worker for as long as it's open.
+    """
+
+    def get(self, request):
+        if not settings.LAB_POD_EVENTS:
+            return self.generate_response(status=404, err="Pod events are disabled")
+
+        response = StreamingHttpResponse(
+            pod_events(request.user), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        # Stop Nginx from buffering the stream
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class ProvisioningJobView(HubAPIView):
+    """
+    Get the state of a lab provisioning job
+    """
+
+    def get(self, request):
+        job_id = request.GET.get("id", None)
+
+        if job_id is None:
+            return self.generate_response(status=422, err="Job id not provided")
+
+        try:
+            job = ProvisioningJob.objects.get(id=job_id)
+        except (ProvisioningJob.DoesNotExist, ValidationError):
+            return self.generate_response(
+                status=422, err=f"Job {job_id} does not exist"
+            )
+
+        if job.user_id != request.user.id:
+            return self.generate_response(
+                status=403, err=f"Cannot view job {job_id}: permission denied"
+            )
+
+        return self.generate_response(
+            status=200,
+            job_id=job.id,
+            state=job.state,
+            attempts=job.attempts,
+            error=job.error,
+            conn_name=job.connection_name,
+            finished=job.finished,
+        )
+
+
+class AdmissionTicketView(HubAPIView):
+    """
+    Get a user's place in the admission queue, and an estimate of when their
+    lab will be started.
+    """
+
+    def get(self, request):
+        ticket_id = request.GET.get("id", None)
+
+        if ticket_id is None:
+            return self.generate_response(status=422, err="Ticket id not provided")
+
+        try:
+            ticket = AdmissionTicket.objects.select_related("user", "job").get(
+                id=ticket_id
+            )
+        except (AdmissionTicket.DoesNotExist, ValidationError):
+            return self.generate_response(
+                status=422, err=f"Ticket {ticket_id} does not exist"
+            )
+
+        if ticket.user_id != request.user.id:
+            return self.generate_response(
+                status=403, err=f"Cannot view ticket {ticket_id}: permission denied"
+            )
+
+        return self.generate_response(status=200, **ticket_status(ticket))
+
+
+class HubStatsView(UserPassesTestMixin, HubAPIView):
+    """
+    Report the health of every hub backend, and the latency of every endpoint
+    that this process has called on it. Only available to staff.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        loads = backend_loads()
+        backends = {
+            backend.name: {
+                **backend.as_dict(),
+                "n_labs": loads[backend.name],
+                "endpoints": get_client(backend.name).latency_report(),
+            }
+            for backend in get_backends()
+        }
+        return self.generate_response(
+            status=200, endpoints=self.hub.latency_report(), backends=backends
+        )
+
+
+class LabMetricsView(UserPassesTestMixin, HubAPIView):
+    """
+    Report percentiles and histograms of the time taken for each lab
+    environment to start up. Only available to staff.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        try:
+            days = float(request.GET.get("days", settings.LAB_METRICS_WINDOW))
+        except ValueError:
+            return self.generate_response(status=422, err="Invalid number of days")
+        if not (math.isfinite(days) and 0 < days <= MAX_METRICS_WINDOW):
+            return self.generate_response(
+                status=422,
+                err=f"Number of days must be between 0 and {MAX_METRICS_WINDOW}",
+            )
+
+        return self.generate_response(
+            status=200, days=days, labs=latency_report(days=days)
+        )
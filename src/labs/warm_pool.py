@@ -0,0 +1,226 @@
+"""
+Pools of pre-created ("warm") pods for each LabEnvironment.
+
+Starting a pod from scratch is the slowest part of starting a lab, so we keep
+a number of idle pods running for each lab. When a user starts a lab we try to
+claim one of these pods before falling back to creating a new one. The pools
+are kept topped up by refill_all(), which is run periodically by the
+refill_warm_pools management command.
+
+New pods stay pending until a later refill sees that the hub reports them as
+ready; only then can they be claimed. Each pod records the image that it was
+created from, and pods whose image is no longer the lab's (e.g. because the
+lab's image was changed or re-pinned to a new digest) are drained from the
+pool and replaced.
+
+Warm pods are always created on the default hub backend.
+"""
+
+import logging
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from labs.hub import get_client, run_concurrently
+from labs.models import LabEnvironment, WarmPod
+from labs.status import is_ready
+
+logger = logging.getLogger("labs")
+
+# Pods that are still pending after this amount of time are assumed to have
+# failed to start (e.g. because they never became ready, or because the
+# refiller died while creating them).
+PENDING_TIMEOUT = timedelta(minutes=5)
+
+"""
+---------------------------------------------------
+Claiming pods
+---------------------------------------------------
+"""
+
+
+def claim_pod(lab: LabEnvironment):
+    """
+    Claim an idle pod from a lab's warm pool.
+
+    Returns
+    ----------
+    str or None
+        The name of the pod that was claimed, or None if the pool was empty.
+    """
+    with transaction.atomic():
+        pod = (
+            WarmPod.objects.select_for_update(skip_locked=True)
+            .filter(lab=lab, state=WarmPod.IDLE, image=lab.pod_image())
+            .order_by("date_created")
+            .first()
+        )
+        if pod is None:
+            return None
+        pod.delete()
+
+    logger.info(f"Claimed warm pod {pod.name} for lab {lab.name!r}")
+    return pod.name
+
+
+"""
+---------------------------------------------------
+Refilling pools
+---------------------------------------------------
+"""
+
+
+def in_class_hours(now=None):
+    """
+    Return whether or not the given time (by default, the current time) falls
+    within class hours, as defined by LAB_CLASS_HOURS and LAB_CLASS_DAYS.
+    """
+    now = timezone.localtime(now)
+    start, end = settings.LAB_CLASS_HOURS
+    return now.weekday() in settings.LAB_CLASS_DAYS and start <= now.hour < end
+
+
+def target_size(lab: LabEnvironment, now=None):
+    """
+    Return the number of pods that should be in a lab's warm pool right now.
+    """
+    if in_class_hours(now):
+        return lab.warm_pool_size
+    return lab.warm_pool_off_hours_size
+
+
+def ready_pods(hub, names, max_workers):
+    """
+    Return the names of the pods in a group of warm pods that the hub reports
+    as ready. Pods whose status couldn't be retrieved are treated as not
+    ready.
+    """
+    statuses = {}
+
+    def fetch(name):
+        statuses[name] = hub.get_pod(name)
+
+    run_concurrently(fetch, names, max_workers)
+    return [name for (name, status) in statuses.items() if is_ready(status)]
+
+
+def drain_outdated(lab: LabEnvironment, hub, max_workers):
+    """
+    Remove the pods from a lab's warm pool that were created from an image
+    other than the lab's current one.
+
+    Returns
+    ----------
+    int
+        The number of pods removed.
+    """
+    # Idle pods are locked while they're removed, so that they can't be
+    # claimed in the meantime.
+    with transaction.atomic():
+        outdated = list(
+            WarmPod.objects.select_for_update(skip_locked=True)
+            .filter(lab=lab)
+            .exclude(image=lab.pod_image())
+            .values_list("name", flat=True)
+        )
+        WarmPod.objects.filter(name__in=outdated).delete()
+
+    if outdated:
+        run_concurrently(hub.delete_pod, outdated, max_workers)
+        logger.info(
+            f"Drained {len(outdated)} pods with an outdated image from warm "
+            f"pool for {lab.name!r}"
+        )
+    return len(outdated)
+
+
+def refill_pool(lab: LabEnvironment, now=None):
+    """
+    Grow or shrink the warm pool for a lab so that it matches its target size,
+    after replacing its pods that run an outdated image and marking the ones
+    that have become ready as idle.
+
+    Returns
+    ----------
+    int
+        The change in the number of pods in the pool.
+    """
+    hub = get_client()
+    max_workers = max(settings.LAB_PROVISIONING_WORKERS, 1)
+    image = lab.pod_image()
+    n_drained = drain_outdated(lab, hub, max_workers)
+
+    # Pods can only be claimed once they're ready
+    pending = WarmPod.objects.filter(lab=lab, state=WarmPod.PENDING)
+    ready = ready_pods(hub, pending.values_list("name", flat=True), max_workers)
+    WarmPod.objects.filter(name__in=ready).update(state=WarmPod.IDLE)
+
+    # Discard pods that have been stuck in the pending state
+    stale = WarmPod.objects.filter(
+        lab=lab,
+        state=WarmPod.PENDING,
+        date_created__lt=timezone.now() - PENDING_TIMEOUT,
+    )
+    stale_names = list(stale.values_list("name", flat=True))
+    if stale_names:
+        logger.warning(f"Discarding {len(stale_names)} stale warm pods")
+        run_concurrently(hub.delete_pod, stale_names, max_workers)
+        WarmPod.objects.filter(name__in=stale_names).delete()
+
+    current = WarmPod.objects.filter(lab=lab).count()
+    target = target_size(lab, now)
+
+    if current < target:
+        pods = [WarmPod(lab=lab, image=image) for _ in range(target - current)]
+        WarmPod.objects.bulk_create(pods)
+        results = run_concurrently(
+            lambda name: hub.create_pod(
+                name, image=image, ports=[lab.port], resources=lab.resources()
+            ),
+            [pod.name for pod in pods],
+            max_workers,
+        )
+
+        created = [name for (name, ex) in results.items() if ex is None]
+        failed = [name for (name, ex) in results.items() if ex is not None]
+        WarmPod.objects.filter(name__in=failed).delete()
+        logger.info(f"Added {len(created)} pods to warm pool for {lab.name!r}")
+        return len(created) - n_drained
+
+    if current > target:
+        # Only idle pods are removed; pending pods are trimmed on a later
+        # refill if they're still surplus. We lock the pods while removing
+        # them from the pool so that they can't be claimed in the meantime.
+        with transaction.atomic():
+            surplus = list(
+                WarmPod.objects.select_for_update(skip_locked=True)
+                .filter(lab=lab, state=WarmPod.IDLE)
+                .order_by("-date_created")
+                .values_list("name", flat=True)[: current - target]
+            )
+            n_claimed = WarmPod.objects.filter(name__in=surplus).delete()[0]
+
+        run_concurrently(hub.delete_pod, surplus, max_workers)
+        logger.info(f"Removed {n_claimed} pods from warm pool for {lab.name!r}")
+        return -n_claimed - n_drained
+
+    return -n_drained
+
+
+def refill_all(now=None):
+    """
+    Refill the warm pools for every lab that has (or should have) one.
+    """
+    labs = LabEnvironment.objects.filter(
+        Q(warm_pool_size__gt=0)
+        | Q(warm_pool_off_hours_size__gt=0)
+        | Q(warmpod__isnull=False)
+    ).distinct()
+
+    for lab in labs:
+        try:
+            refill_pool(lab, now=now)
+        except Exception as ex:
+            logger.exception(f"Unable to refill warm pool for {lab.name!r}: {ex}")
@@ -0,0 +1,181 @@
+"""
+Local copy of the state of every pod on the hub.
+
+Rather than asking the hub for a pod's status every time a dashboard checks on
+a lab, the watch_pods command consumes the hub's stream of pod events and
+writes each pod's phase and conditions into the PodState table. When
+LAB_POD_STATE_WATCH is enabled, pod statuses are read from that table instead
+of from the hub.
+
+The hub's watch API follows the Kubernetes conventions: GET /pods returns
+{"items": [...], "resourceVersion": ...}, and GET /pods/watch streams one
+JSON event per line, of the form
+
+    {"type": "ADDED" | "MODIFIED" | "DELETED" | "BOOKMARK" | "ERROR",
+     "object": {"name": ..., "phase": ..., "conditions": [...],
+                "resourceVersion": ...}}
+
+Events may be missed while the stream is disconnected, so the table is
+resynchronized against a full listing of the pods every time we (re)connect.
+
+When there are several hub backends, one watch_pods command is run for each
+of them, and each only resynchronizes the pods of the labs on its backend.
+"""
+
+import json
+import logging
+import requests
+import time
+
+from django.db import transaction
+from guacamole.models import GuacamoleConnection
+from labs.hub import get_backend, get_backends, get_client
+from labs.models import PodState
+
+logger = logging.getLogger("labs")
+
+
+class WatchExpired(Exception):
+    """
+    Raised when the hub reports an error on the event stream, e.g. because the
+    resource version we asked to watch from is too old.
+    """
+
+
+"""
+---------------------------------------------------
+Applying pod states
+---------------------------------------------------
+"""
+
+
+def pod_fields(pod):
+    """
+    Return the PodState fields for a pod returned by the hub.
+    """
+    return {
+        "phase": pod.get("phase") or "",
+        "conditions": json.dumps(pod.get("conditions") or []),
+    }
+
+
+def resync(pods, backend=None):
+    """
+    Replace the contents of the PodState table with a full listing of the pods
+    on the hub.
+
+    Keyword parameters
+    ----------
+    backend (str) (default = None)
+        The hub backend that the pods were listed from. If this is given, the
+        states of pods belonging to labs on other backends are left alone.
+    """
+    pods = {pod["name"]: pod for pod in pods}
+
+    stale = PodState.objects.exclude(connection_name__in=pods)
+    if backend is not None:
+        # Labs without a backend are on the default backend
+        own = {backend} | ({""} if backend == get_backend().name else set())
+        others = GuacamoleConnection.objects.exclude(hub_backend__in=own)
+        stale = stale.exclude(connection_name__in=others.values("connection_name"))
+
+    with transaction.atomic():
+        stale.delete()
+
+        existing = PodState.objects.select_for_update().in_bulk(list(pods))
+        for (name, state) in existing.items():
+            for (field, value) in pod_fields(pods[name]).items():
+                setattr(state, field, value)
+        PodState.objects.bulk_update(existing.values(), ["phase", "conditions"])
+
+        PodState.objects.bulk_create(
+            PodState(connection_name=name, **pod_fields(pod))
+            for (name, pod) in pods.items()
+            if name not in existing
+        )
+
+    logger.info(f"Resynchronized state of {len(pods)} pods")
+
+
+def apply_event(event):
+    """
+    Update the PodState table with a single watch event, and return the
+    resource version of the event (if it has one).
+    """
+    kind = event.get("type")
+    pod = event.get("object") or {}
+
+    if kind == "ERROR":
+        raise WatchExpired(pod.get("message", "Watch failed"))
+    if kind in ("ADDED", "MODIFIED"):
+        PodState.objects.update_or_create(
+            connection_name=pod["name"], defaults=pod_fields(pod)
+        )
+    elif kind == "DELETED":
+        PodState.objects.filter(connection_name=pod["name"]).delete()
+    elif kind != "BOOKMARK":
+        logger.warning(f"Ignoring unknown pod event type {kind!r}")
+
+    return pod.get("resourceVersion")
+
+
+def consume(lines):
+    """
+    Apply every event in a stream of JSON-encoded watch events, and return the
+    resource version of the last event that was applied.
+    """
+    resource_version = None
+    for line in lines:
+        if not line:
+            # Blank lines are sent to keep the connection alive
+            continue
+        resource_version = apply_event(json.loads(line)) or resource_version
+    return resource_version
+
+
+"""
+---------------------------------------------------
+Watch loop
+---------------------------------------------------
+"""
+
+
+def watch(client=None, backend=None, reconnect_delay=1, max_reconnects=None):
+    """
+    Keep the PodState table in sync with the hub. Every time the stream is
+    (re)opened, we first resynchronize the table against a full listing of
+    the pods, and then watch for events from that listing's resource version.
+
+    Keyword parameters
+    ----------
+    client (HubClient) (default = None)
+        The client used to communicate with the hub. Defaults to the client
+        returned by get_client() for the backend.
+    backend (str) (default = None)
+        The hub backend to watch. Defaults to the default backend.
+    reconnect_delay (float) (default = 1)
+        Time (in seconds) to wait before reconnecting after the stream is
+        closed or fails.
+    max_reconnects (int) (default = None)
+        Number of times to reconnect before giving up. If this is None, we
+        keep reconnecting forever.
+    """
+    client = client or get_client(backend)
+    # Resynchronization only needs to be scoped when other backends' pods
+    # could be in the table.
+    scope = get_backend(backend).name if len(get_backends()) > 1 else None
+    attempt = 0
+
+    while True:
+        try:
+            pods, resource_version = client.list_pods()
+            resync(pods, backend=scope)
+            consume(client.watch_pods(resource_version))
+            logger.info("Pod event stream closed by the hub")
+        except (requests.RequestException, WatchExpired, ValueError) as ex:
+            logger.error(f"Pod event stream failed: {ex}")
+
+        attempt += 1
+        if max_reconnects is not None and attempt > max_reconnects:
+            break
+        time.sleep(reconnect_delay)
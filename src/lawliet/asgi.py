@@ -0,0 +1,23 @@
+"""
+ASGI config for lawliet project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The pod status endpoints are served natively by labs.asgi.PodStatusApp, and
+every other request is passed on to Django.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lawliet.settings")
+
+django_application = get_asgi_application()
+
+# Imported once Django has been set up, since it loads models
+from labs.asgi import PodStatusApp
+
+application = PodStatusApp(django_application)
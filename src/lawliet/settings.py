@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import json
 import logging
 import os
 import dotenv
@@ -105,6 +106,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "lawliet.wsgi.application"
+ASGI_APPLICATION = "lawliet.asgi.application"
 
 # Change the form renderer so that we can use custom widget templates
 FORM_RENDERER = "django.forms.renderers.TemplatesSetting"
@@ -135,6 +137,21 @@ elif ENGINE == "mysql":
 else:
     raise Exception("Environmental variable 'ENGINE' must be either sqlite3 or mysql")
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+#
+# By default every process has its own in-memory cache. Set CACHE_BACKEND and
+# CACHE_LOCATION (e.g. to point to a memcached server) to share the cache
+# between processes.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -216,6 +233,249 @@ EMAIL_USE_TLS = bool(os.getenv("EMAIL_USE_TLS", True))
 MAX_PASSWORD_LENGTH = int(os.getenv("MAX_PASSWORD_LENGTH", 64))
 MIN_PASSWORD_LENGTH = int(os.getenv("MIN_PASSWORD_LENGTH", 8))
 
+# Lawliet Hub parameters
+
+# Location of the Lawliet Hub API server that creates and deletes lab pods
+HUB_API_HOST = os.getenv("HUB_API_HOST", "http://lawliet-k8s-api-server")
+
+# Timeouts (in seconds) for connecting to and reading responses from the hub
+HUB_API_CONNECT_TIMEOUT = float(os.getenv("HUB_API_CONNECT_TIMEOUT", 3.05))
+HUB_API_READ_TIMEOUT = float(os.getenv("HUB_API_READ_TIMEOUT", 30))
+
+# HUB_API_FAKE: if "yes", every process starts its own in-memory fake hub (see
+# labs.fakehub) and sends its hub requests there instead of to HUB_API_HOST.
+# HUB_FAKE_LATENCY is the fake hub's average response time (in seconds),
+# HUB_FAKE_FAILURE_RATE the fraction of pod creations and deletions that fail,
+# and HUB_FAKE_READY_DELAY the time (in seconds) that pods take to become
+# ready. To share a single fake hub between processes, run it with the
+# run_fake_hub command and point HUB_API_HOST at it instead.
+HUB_API_FAKE = os.getenv("HUB_API_FAKE", "").lower() == "yes"
+HUB_FAKE_LATENCY = float(os.getenv("HUB_FAKE_LATENCY", 0))
+HUB_FAKE_FAILURE_RATE = float(os.getenv("HUB_FAKE_FAILURE_RATE", 0))
+HUB_FAKE_READY_DELAY = float(os.getenv("HUB_FAKE_READY_DELAY", 0))
+
+# HUB_API_BACKENDS: JSON-encoded list of hub API servers (one per cluster)
+# that labs can be created on, e.g.
+#
+#   [{"name": "east", "url": "http://hub-east", "weight": 2, "capacity": 200},
+#    {"name": "west", "url": "http://hub-west", "weight": 1, "capacity": 100}]
+#
+# Each new lab is sent to one of the healthy backends that has room for it,
+# chosen at random in proportion to its weight and its free capacity. The
+# capacity (maximum number of labs) is optional. If no backends are given,
+# every lab is created on HUB_API_HOST.
+HUB_API_BACKENDS = json.loads(os.getenv("HUB_API_BACKENDS", "[]"))
+
+# Every backend has a circuit breaker, which opens after
+# HUB_BACKEND_FAILURE_THRESHOLD consecutive requests to it fail. While the
+# breaker is open, requests to the backend fail immediately (new labs are sent
+# to other backends, or refused if there are none, and dashboards are shown
+# the last known status of each lab). After HUB_BACKEND_RETRY_INTERVAL seconds
+# a single probe request is let through, which closes the breaker if it
+# succeeds.
+HUB_BACKEND_FAILURE_THRESHOLD = int(os.getenv("HUB_BACKEND_FAILURE_THRESHOLD", 3))
+HUB_BACKEND_RETRY_INTERVAL = float(os.getenv("HUB_BACKEND_RETRY_INTERVAL", 30))
+
+# Lab provisioning parameters
+
+# LAB_PROVISIONING_WORKERS: number of background threads per process that
+# send pod creation requests to the hub. If this is set to zero, provisioning
+# jobs are run synchronously inside of the request that created them.
+LAB_PROVISIONING_WORKERS = int(os.getenv("LAB_PROVISIONING_WORKERS", 8))
+
+# LAB_PROVISIONING_MAX_ATTEMPTS: number of times a job is attempted before it
+# is marked as failed.
+LAB_PROVISIONING_MAX_ATTEMPTS = int(os.getenv("LAB_PROVISIONING_MAX_ATTEMPTS", 3))
+
+# LAB_PROVISIONING_RETRY_DELAY: base delay (in seconds) between attempts. The
+# delay doubles after every failed attempt.
+LAB_PROVISIONING_RETRY_DELAY = float(os.getenv("LAB_PROVISIONING_RETRY_DELAY", 1))
+
+# HUB_API_POOL_SIZE: maximum number of keep-alive connections each process
+# holds open to the hub. By default there is one connection for every
+# provisioning worker, plus the same number again for requests made directly
+# by views.
+HUB_API_POOL_SIZE = int(
+    os.getenv("HUB_API_POOL_SIZE", 2 * max(LAB_PROVISIONING_WORKERS, 1))
+)
+
+# HUB_API_ASYNC_POOL_SIZE: maximum number of connections that each event loop
+# holds open to each hub when running under ASGI (see labs.asgi), which is
+# also the number of pod status requests it can have in flight at once.
+HUB_API_ASYNC_POOL_SIZE = int(os.getenv("HUB_API_ASYNC_POOL_SIZE", 256))
+
+# LAB_BULK_CONCURRENCY: maximum number of pod creation requests that are sent
+# to the hub at once when provisioning labs for a whole class.
+LAB_BULK_CONCURRENCY = int(os.getenv("LAB_BULK_CONCURRENCY", 16))
+
+# Pod status parameters
+
+# LAB_POD_STATUS_CACHE_TTL: time (in seconds) for which a pod's status is
+# cached before it is requested from the hub again.
+LAB_POD_STATUS_CACHE_TTL = float(os.getenv("LAB_POD_STATUS_CACHE_TTL", 2))
+
+# LAB_POD_STATUS_STALE_TTL: time (in seconds) for which the last known status
+# of a pod is kept, to be served to dashboards while the hub is unavailable.
+LAB_POD_STATUS_STALE_TTL = float(os.getenv("LAB_POD_STATUS_STALE_TTL", 3600))
+
+# Number of seconds that clients are asked to wait between status checks for
+# pods that are still starting up, and for pods that are ready.
+LAB_POD_STATUS_POLL_INTERVAL = float(os.getenv("LAB_POD_STATUS_POLL_INTERVAL", 2))
+LAB_POD_STATUS_READY_POLL_INTERVAL = float(
+    os.getenv("LAB_POD_STATUS_READY_POLL_INTERVAL", 30)
+)
+
+# LAB_POD_EVENTS: if set to "yes", dashboards watch their labs over a stream of
+# Server-Sent Events (served by /labs/pod/events) instead of polling the batch
+# status endpoint. Every open stream holds a worker for up to
+# LAB_POD_EVENTS_MAX_DURATION, so this should only be turned on when Lawliet is
+# run with enough workers (or threads) to hold one per open dashboard.
+LAB_POD_EVENTS = os.getenv("LAB_POD_EVENTS", "").lower() == "yes"
+
+# LAB_POD_EVENTS_MAX_DURATION: maximum time (in seconds) that a pod readiness
+# event stream is held open before the client is asked to reconnect.
+LAB_POD_EVENTS_MAX_DURATION = float(os.getenv("LAB_POD_EVENTS_MAX_DURATION", 300))
+
+# LAB_POD_STATE_WATCH: if set to "yes", pod statuses are read from the local
+# PodState table instead of being requested from the hub. The table is kept up
+# to date by the watch_pods command, which must be running.
+LAB_POD_STATE_WATCH = os.getenv("LAB_POD_STATE_WATCH", "").lower() == "yes"
+
+# Warm pool parameters
+
+# LAB_CLASS_HOURS: start and end hour (in TIME_ZONE, on a 24-hour clock) of the
+# part of the day when classes are held. LAB_CLASS_DAYS lists the days of the
+# week (0 = Monday) on which classes are held. Outside of these times the warm
+# pool for each lab is shrunk to its off-hours size.
+LAB_CLASS_HOURS = [int(h) for h in os.getenv("LAB_CLASS_HOURS", "8,22").split(",")]
+LAB_CLASS_DAYS = [int(d) for d in os.getenv("LAB_CLASS_DAYS", "0,1,2,3,4").split(",")]
+
+# LAB_WARM_POOL_REFILL_INTERVAL: time (in seconds) between refills of the
+# warm pools by the refill_warm_pools command.
+LAB_WARM_POOL_REFILL_INTERVAL = float(os.getenv("LAB_WARM_POOL_REFILL_INTERVAL", 30))
+
+# Idle lab parameters
+
+# LAB_IDLE_TIMEOUT: default number of minutes that a lab can go without anyone
+# connecting to it before it is deleted. This can be overridden for each lab
+# environment; zero disables the reaper.
+LAB_IDLE_TIMEOUT = int(os.getenv("LAB_IDLE_TIMEOUT", 120))
+
+# LAB_REAPER_BATCH_SIZE: number of labs deleted in each batch by the
+# reap_idle_labs and expire_leases commands, and LAB_REAPER_INTERVAL the time
+# (in seconds) between runs of the idle lab reaper.
+LAB_REAPER_BATCH_SIZE = int(os.getenv("LAB_REAPER_BATCH_SIZE", 50))
+LAB_REAPER_INTERVAL = float(os.getenv("LAB_REAPER_INTERVAL", 60))
+
+# Reconciliation parameters
+
+# LAB_RECONCILE_PAGE_SIZE: number of pods requested from the hub at a time by
+# the reconcile_labs command, and LAB_RECONCILE_INTERVAL the time (in seconds)
+# between its runs.
+LAB_RECONCILE_PAGE_SIZE = int(os.getenv("LAB_RECONCILE_PAGE_SIZE", 500))
+LAB_RECONCILE_INTERVAL = float(os.getenv("LAB_RECONCILE_INTERVAL", 600))
+
+# LAB_RECONCILE_GRACE_PERIOD: time (in seconds) after a lab is created before
+# the reconciler treats it as orphaned if its pods don't exist, so that labs
+# whose pods are still being created are left alone.
+LAB_RECONCILE_GRACE_PERIOD = float(os.getenv("LAB_RECONCILE_GRACE_PERIOD", 900))
+
+# Lease parameters
+
+# LAB_LEASE_DURATION: number of minutes that a lab runs for after it is
+# created before it is deleted, and LAB_LEASE_EXTENSION the number of minutes
+# that are added to the lease every time a user extends it.
+LAB_LEASE_DURATION = int(os.getenv("LAB_LEASE_DURATION", 240))
+LAB_LEASE_EXTENSION = int(os.getenv("LAB_LEASE_EXTENSION", 60))
+
+# LAB_LEASE_MAX_DURATION: maximum lifetime (in minutes) of a lab, no matter
+# how many times its lease is extended. Zero means that there is no limit.
+LAB_LEASE_MAX_DURATION = int(os.getenv("LAB_LEASE_MAX_DURATION", 720))
+
+# LAB_LEASE_CHECK_INTERVAL: maximum time (in seconds) that the expire_leases
+# command sleeps between checks for expired leases.
+LAB_LEASE_CHECK_INTERVAL = float(os.getenv("LAB_LEASE_CHECK_INTERVAL", 60))
+
+# LAB_LEASE_RETRY_DELAY: time (in seconds) that the expire_leases command waits
+# before retrying the labs for expired leases that it failed to delete. The
+# delay doubles after every failed attempt, up to LAB_LEASE_CHECK_INTERVAL.
+LAB_LEASE_RETRY_DELAY = float(os.getenv("LAB_LEASE_RETRY_DELAY", 5))
+
+# Admission control parameters
+
+# LAB_CLUSTER_CPU and LAB_CLUSTER_MEMORY: total CPU (in millicores) and memory
+# (in mebibytes) available to lab pods. When starting a lab would exceed
+# either of these, the request is put in the admission queue instead. Zero
+# means that the resource is unlimited.
+LAB_CLUSTER_CPU = int(os.getenv("LAB_CLUSTER_CPU", 0))
+LAB_CLUSTER_MEMORY = int(os.getenv("LAB_CLUSTER_MEMORY", 0))
+
+# LAB_MAX_LABS_PER_USER: maximum number of labs that a user can be running or
+# waiting for at once. Zero means that there is no limit.
+LAB_MAX_LABS_PER_USER = int(os.getenv("LAB_MAX_LABS_PER_USER", 0))
+
+# LAB_ADMISSION_INTERVAL: time (in seconds) between attempts by the
+# process_admission_queue command to admit waiting requests.
+LAB_ADMISSION_INTERVAL = float(os.getenv("LAB_ADMISSION_INTERVAL", 5))
+
+# Image registry parameters
+
+# LAB_PIN_IMAGE_DIGESTS: if set to "yes", the digest of a lab's image is looked
+# up (in the background) when the lab is uploaded, and pods are created from
+# that digest rather than from the image's tag.
+LAB_PIN_IMAGE_DIGESTS = os.getenv("LAB_PIN_IMAGE_DIGESTS", "").lower() == "yes"
+
+# LAB_REGISTRY_URL: registry used for images that don't name a registry, and
+# LAB_REGISTRY_TIMEOUT the timeout (in seconds) for requests to registries.
+LAB_REGISTRY_URL = os.getenv("LAB_REGISTRY_URL", "https://registry-1.docker.io")
+LAB_REGISTRY_TIMEOUT = float(os.getenv("LAB_REGISTRY_TIMEOUT", 5))
+
+# Image pre-pull parameters
+
+# LAB_IMAGE_PULL_TIMEOUT: maximum time (in seconds) to wait for a lab's image
+# to be pulled onto every node, and LAB_IMAGE_PULL_POLL_INTERVAL the time
+# between checks on the progress of the pulls.
+LAB_IMAGE_PULL_TIMEOUT = float(os.getenv("LAB_IMAGE_PULL_TIMEOUT", 900))
+LAB_IMAGE_PULL_POLL_INTERVAL = float(os.getenv("LAB_IMAGE_PULL_POLL_INTERVAL", 10))
+
+# LAB_IMAGE_PULL_WORKERS: number of background threads per process that start
+# and monitor image pulls. These are separate from the provisioning workers,
+# so that a long pull never holds up lab starts. If this is zero, images are
+# pulled in the thread that requests them.
+LAB_IMAGE_PULL_WORKERS = int(os.getenv("LAB_IMAGE_PULL_WORKERS", 2))
+
+# Placement parameters
+
+# LAB_NODE_POOLS: JSON list of the node pools that lab pods can be placed on.
+# Each pool is given as {"name": ..., "nodes": ..., "cpu": ..., "memory": ...},
+# where cpu (in millicores) and memory (in mebibytes) are the capacity of each
+# node in the pool. If no pools are listed, the hub decides where pods go.
+LAB_NODE_POOLS = json.loads(os.getenv("LAB_NODE_POOLS", "[]"))
+
+# Metrics parameters
+
+# LAB_METRICS_WINDOW: number of days of lab startups that are included in the
+# startup latency statistics.
+LAB_METRICS_WINDOW = float(os.getenv("LAB_METRICS_WINDOW", 14))
+
+# LAB_LIFECYCLE_SYNC_INTERVAL: time (in seconds) between the runs of the
+# sync_lifecycles command, which copies the first session of each lab out of
+# Guacamole's connection history.
+LAB_LIFECYCLE_SYNC_INTERVAL = float(os.getenv("LAB_LIFECYCLE_SYNC_INTERVAL", 60))
+
+# Idempotency parameters
+
+# LAB_IDEMPOTENCY_KEY_TTL: number of hours for which the response to a request
+# with an Idempotency-Key header is kept, and returned again if the request is
+# repeated with the same key.
+LAB_IDEMPOTENCY_KEY_TTL = float(os.getenv("LAB_IDEMPOTENCY_KEY_TTL", 24))
+
+# LAB_IDEMPOTENCY_CLAIM_TIMEOUT: number of seconds after which a request that
+# claimed an idempotency key, but never stored its response (e.g. because its
+# worker was killed), is considered abandoned. Its key can then be claimed by
+# a repeat of the request.
+LAB_IDEMPOTENCY_CLAIM_TIMEOUT = float(os.getenv("LAB_IDEMPOTENCY_CLAIM_TIMEOUT", 120))
+
 # Logging settings
 LOGGING = {
     "version": 1,
@@ -13,6 +13,7 @@ from django.contrib.staticfiles.testing import StaticLiveServerTestCase
 from selenium import webdriver
 from uuid import UUID
 
+from labs.hub import reset_client
 from users.models import User
 
 
@@ -78,6 +79,10 @@ Generic abstract testing class
 
 class AbstractTestCase(abc.ABC):
     def setUp(self, seed=0, create_user=False, preauth=False):
+        ### Start with fresh hub clients, so that circuit breakers tripped by
+        ### earlier tests don't carry over
+        reset_client()
+
         ### Seed RNG for consistent results
         self.rd = random.Random()
         self.rd.seed(seed)